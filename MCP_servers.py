@@ -17,7 +17,8 @@ import sys
 from typing import List
 
 from mcp.server.fastmcp import FastMCPServer
-import yfinance as yf
+
+from .market_data import YFinanceProvider, fetch_prices_batch_async
 
 
 # ============================
@@ -25,6 +26,11 @@ import yfinance as yf
 # ============================
 
 market_app = FastMCPServer("market_data_server")
+_market_provider = YFinanceProvider(period="1mo", interval="1d")
+
+
+def _price_records(df) -> list:
+    return df.reset_index()[["Date", "Close"]].tail(10).to_dict(orient="records")
 
 
 @market_app.tool()
@@ -32,11 +38,25 @@ async def get_prices(ticker: str) -> dict:
     """
     Вернуть последние котировки для тикера.
     """
-    df = yf.download(ticker, period="1mo", interval="1d")
-    if df.empty:
+    frames = await fetch_prices_batch_async([ticker], _market_provider)
+    if ticker not in frames:
         return {"ticker": ticker, "prices": []}
-    records = df.reset_index()[["Date", "Close"]].tail(10).to_dict(orient="records")
-    return {"ticker": ticker, "prices": records}
+    return {"ticker": ticker, "prices": _price_records(frames[ticker])}
+
+
+@market_app.tool()
+async def get_prices_batch(tickers: List[str]) -> dict:
+    """
+    Вернуть последние котировки сразу для списка тикеров
+    (один запрос к yfinance на чанк, а не на тикер).
+    """
+    frames = await fetch_prices_batch_async(tickers, _market_provider)
+    return {
+        "prices": {
+            t: _price_records(frames[t]) if t in frames else []
+            for t in tickers
+        }
+    }
 
 
 # ============================
@@ -1,15 +1,52 @@
 from __future__ import annotations
 
+import json
+import threading
+from typing import Optional
+
 from crewai import Agent, LLM
 
+from . import streaming
+from .llm_cache import get_llm_cache, llm_cache_key
+
+
+class CachedLLM(LLM):
+    """
+    LLM с кэшем ответов: байт-в-байт одинаковые промпты (например, при
+    перезапуске после падения) не отправляются в Ollama повторно.
+    Вызовы с tools не кэшируются — там важны побочные эффекты.
+    Внутри streaming.stage() Ollama-модель вызывается напрямую и потоково:
+    токены сразу уходят в дашборд (ответ из кэша — одним событием).
+    """
+
+    def call(self, messages, tools=None, *args, **kwargs):
+        if tools:
+            return super().call(messages, tools, *args, **kwargs)
+
+        prompt = messages if isinstance(messages, str) else json.dumps(messages, ensure_ascii=False)
+        cache = get_llm_cache()
+        key = llm_cache_key(self, prompt)
+        cached = cache.get(key)
+        if cached is not None:
+            streaming.emit(cached)
+            return cached
+
+        if streaming.active() and str(self.model).startswith("ollama/"):
+            response = streaming.ollama_chat(self, messages)
+        else:
+            response = super().call(messages, tools, *args, **kwargs)
+        if isinstance(response, str):
+            cache.put(key, response)
+        return response
+
 
 def build_local_llm() -> LLM:
     """
-    Локальная LLM через Ollama + LiteLLM.
+    Локальная LLM через Ollama + LiteLLM (с кэшем ответов).
     ВАЖНО: у тебя должен быть запущен ollama с моделью mistral:
       ollama run mistral
     """
-    return LLM(
+    return CachedLLM(
         model="ollama/mistral",          # строка, а НЕ dict!
         base_url="http://localhost:11434",
         temperature=0.2,
@@ -104,4 +141,37 @@ def build_agents() -> dict:
         "risk": risk_agent,
         "report": report_agent,
         "evaluator": evaluator_agent,
-    }
\ No newline at end of file
+    }
+
+
+_agents: Optional[dict] = None
+_agents_lock = threading.Lock()
+
+
+def get_agents() -> dict:
+    """
+    Агенты, общие на процесс: в прогретом воркере (worker.py) строятся
+    один раз и переиспользуются всеми запусками.
+    """
+    global _agents
+    with _agents_lock:
+        if _agents is None:
+            _agents = build_agents()
+        return _agents
+
+
+def fresh_agent(template: Agent) -> Agent:
+    """
+    Независимая копия агента для одного исполнения задачи. crewai держит в
+    Agent состояние выполнения (agent_executor, сообщения, итерации), так
+    что параллельные узлы DAG не должны делить один объект; LLM (и её кэш)
+    остаётся общей.
+    """
+    return Agent(
+        role=template.role,
+        goal=template.goal,
+        backstory=template.backstory,
+        llm=template.llm,
+        allow_delegation=False,
+        verbose=template.verbose,
+    )
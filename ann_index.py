@@ -0,0 +1,402 @@
+# ann_index.py
+
+"""
+Векторные индексы для долгосрочной памяти.
+
+- ExactIndex — точный поиск (numpy), хранение float32 / float16 / int8
+  (int8: симметричная квантизация с масштабом на вектор);
+- HnswlibIndex — HNSW через hnswlib (опционально), параметры M / ef;
+- FaissIndex — HNSW через faiss-cpu (опционально); с квантизацией
+  использует IndexHNSWSQ (fp16 / 8 bit скалярный квантизатор). 8 bit
+  обучается на первых TRAIN_SIZE векторах, до этого они лежат в точном
+  float32-буфере (память пишется по одной записи — обучение на первом
+  батче давало квантизатор по одному вектору).
+
+Все индексы работают со скалярным произведением нормированных векторов
+(= косинус), id — целые числа, которые выдаёт вызывающий код.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import time
+from pathlib import Path
+from typing import List, Optional, Protocol, Tuple
+
+import numpy as np
+
+from .config import settings
+
+
+QUANTIZATIONS = ("none", "float16", "int8")
+
+
+def normalize(vectors) -> np.ndarray:
+    x = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(x, axis=1, keepdims=True)
+    return x / np.where(norms == 0, 1.0, norms)
+
+
+class VectorIndex(Protocol):
+    dim: int
+
+    def __len__(self) -> int: ...
+
+    def add(self, ids: List[int], vectors: np.ndarray) -> None: ...
+
+    def search(self, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]: ...
+
+    def save(self, path: Path) -> None: ...
+
+
+# ============================
+# Точный поиск с квантизацией
+# ============================
+
+class ExactIndex:
+    """
+    Полный перебор блоками; память = N * dim * (4 | 2 | 1) байт.
+    Квантизованные блоки распаковываются во float32 по 8k строк, чтобы
+    временный буфер оставался в кэше процессора.
+    """
+
+    def __init__(self, dim: int, quantization: str = "none", block_rows: int = 8192) -> None:
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"unknown quantization {quantization!r}, expected one of {QUANTIZATIONS}")
+        self.dim = dim
+        self.quantization = quantization
+        self.block_rows = block_rows
+        dtype = {"none": np.float32, "float16": np.float16, "int8": np.int8}[quantization]
+        self._codes = np.empty((1024, dim), dtype=dtype)
+        self._scales = np.empty(1024, dtype=np.float32)
+        self._ids = np.empty(1024, dtype=np.int64)
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def nbytes(self) -> int:
+        n = self._size
+        return self._codes[:n].nbytes + self._ids[:n].nbytes + (self._scales[:n].nbytes if self.quantization == "int8" else 0)
+
+    def _reserve(self, extra: int) -> None:
+        need = self._size + extra
+        if need <= len(self._ids):
+            return
+        cap = max(need, len(self._ids) * 2)
+        for name in ("_codes", "_scales", "_ids"):
+            old = getattr(self, name)
+            new = np.empty((cap,) + old.shape[1:], dtype=old.dtype)
+            new[: self._size] = old[: self._size]
+            setattr(self, name, new)
+
+    def add(self, ids: List[int], vectors: np.ndarray) -> None:
+        x = normalize(vectors)
+        n = len(x)
+        self._reserve(n)
+        rows = slice(self._size, self._size + n)
+        if self.quantization == "int8":
+            scale = np.abs(x).max(axis=1) / 127.0
+            scale[scale == 0] = 1.0
+            self._codes[rows] = np.round(x / scale[:, None]).astype(np.int8)
+            self._scales[rows] = scale
+        else:
+            self._codes[rows] = x
+        self._ids[rows] = np.asarray(ids, dtype=np.int64)
+        self._size += n
+
+    def search(self, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        q = normalize(query)
+        k = min(k, self._size)
+        best_scores = np.full((len(q), 0), -np.inf, dtype=np.float32)
+        best_rows = np.zeros((len(q), 0), dtype=np.int64)
+        for start in range(0, self._size, self.block_rows):
+            stop = min(start + self.block_rows, self._size)
+            scores = q @ self._codes[start:stop].astype(np.float32, copy=False).T
+            if self.quantization == "int8":
+                scores *= self._scales[start:stop]
+            take = min(k, stop - start)
+            part = np.argpartition(-scores, take - 1, axis=1)[:, :take]
+            best_scores = np.hstack([best_scores, np.take_along_axis(scores, part, axis=1)])
+            best_rows = np.hstack([best_rows, part + start])
+            if best_scores.shape[1] > k:
+                keep = np.argpartition(-best_scores, k - 1, axis=1)[:, :k]
+                best_scores = np.take_along_axis(best_scores, keep, axis=1)
+                best_rows = np.take_along_axis(best_rows, keep, axis=1)
+        order = np.argsort(-best_scores, axis=1)
+        rows = np.take_along_axis(best_rows, order, axis=1)
+        return self._ids[rows], np.take_along_axis(best_scores, order, axis=1)
+
+    def save(self, path: Path) -> None:
+        n = self._size
+        tmp = Path(path).with_name(Path(path).name + ".tmp.npz")
+        np.savez(tmp, codes=self._codes[:n], scales=self._scales[:n], ids=self._ids[:n],
+                 quantization=np.array(self.quantization))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: Path) -> "ExactIndex":
+        with np.load(path) as data:
+            index = cls(data["codes"].shape[1], str(data["quantization"]))
+            n = len(data["ids"])
+            index._reserve(n)
+            index._codes[:n] = data["codes"]
+            index._scales[:n] = data["scales"]
+            index._ids[:n] = data["ids"]
+            index._size = n
+        return index
+
+
+# ============================
+# HNSW (опциональные зависимости)
+# ============================
+
+class HnswlibIndex:
+    """HNSW через hnswlib; хранит float32 (квантизация не поддерживается)."""
+
+    def __init__(self, dim: int, M: int = 16, ef_construction: int = 100,
+                 ef_search: int = 64, capacity: int = 10_000) -> None:
+        try:
+            import hnswlib
+        except ImportError as exc:
+            raise ImportError("backend 'hnswlib' requires: pip install hnswlib") from exc
+        self.dim = dim
+        self.ef_search = ef_search
+        self._index = hnswlib.Index(space="ip", dim=dim)
+        self._index.init_index(max_elements=capacity, M=M, ef_construction=ef_construction)
+        self._index.set_ef(ef_search)
+
+    def __len__(self) -> int:
+        return self._index.get_current_count()
+
+    def add(self, ids: List[int], vectors: np.ndarray) -> None:
+        need = len(self) + len(ids)
+        if need > self._index.get_max_elements():
+            self._index.resize_index(max(need, 2 * self._index.get_max_elements()))
+        self._index.add_items(normalize(vectors), np.asarray(ids, dtype=np.int64))
+
+    def search(self, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        k = min(k, len(self))
+        self._index.set_ef(max(self.ef_search, k))
+        labels, distances = self._index.knn_query(normalize(query), k=k)
+        # для space="ip" hnswlib возвращает 1 - <q, x>
+        return labels.astype(np.int64), 1.0 - distances
+
+    def save(self, path: Path) -> None:
+        tmp = str(path) + ".tmp"
+        self._index.save_index(tmp)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: Path, dim: int, ef_search: int = 64) -> "HnswlibIndex":
+        import hnswlib
+
+        index = cls.__new__(cls)
+        index.dim = dim
+        index.ef_search = ef_search
+        index._index = hnswlib.Index(space="ip", dim=dim)
+        index._index.load_index(str(path))
+        index._index.set_ef(ef_search)
+        return index
+
+
+class FaissIndex:
+    """
+    HNSW через faiss; при quantization != none — IndexHNSWSQ.
+    int8: до TRAIN_SIZE векторов поиск идёт по точному буферу, затем
+    квантизатор обучается на всём буфере и векторы переезжают в HNSW.
+    """
+
+    TRAIN_SIZE = 256
+
+    def __init__(self, dim: int, quantization: str = "none", M: int = 16,
+                 ef_construction: int = 100, ef_search: int = 64) -> None:
+        try:
+            import faiss
+        except ImportError as exc:
+            raise ImportError("backend 'faiss' requires: pip install faiss-cpu") from exc
+        self.dim = dim
+        self.ef_search = ef_search
+        if quantization == "none":
+            base = faiss.IndexHNSWFlat(dim, M, faiss.METRIC_INNER_PRODUCT)
+        else:
+            qtype = {"float16": faiss.ScalarQuantizer.QT_fp16, "int8": faiss.ScalarQuantizer.QT_8bit}[quantization]
+            base = faiss.IndexHNSWSQ(dim, qtype, M, faiss.METRIC_INNER_PRODUCT)
+        base.hnsw.efConstruction = ef_construction
+        base.hnsw.efSearch = ef_search
+        if quantization == "float16":
+            base.train(np.zeros((1, dim), dtype=np.float32))  # fp16 не зависит от данных
+        self._base = base
+        self._index = faiss.IndexIDMap2(base)
+        self._pending = ExactIndex(dim)
+
+    def __len__(self) -> int:
+        return self._index.ntotal + len(self._pending)
+
+    def add(self, ids: List[int], vectors: np.ndarray) -> None:
+        x = normalize(vectors)
+        if self._base.is_trained:
+            self._index.add_with_ids(x, np.asarray(ids, dtype=np.int64))
+            return
+        self._pending.add(ids, x)
+        n = len(self._pending)
+        if n >= self.TRAIN_SIZE:
+            # диапазоны 8 bit квантизатора — по всем накопленным векторам
+            buffered = self._pending._codes[:n].astype(np.float32)
+            self._base.train(buffered)
+            self._index.add_with_ids(buffered, self._pending._ids[:n])
+            self._pending = ExactIndex(self.dim)
+
+    def search(self, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        if len(self._pending):
+            return self._pending.search(query, k)
+        self._base.hnsw.efSearch = max(self.ef_search, k)
+        scores, labels = self._index.search(normalize(query), min(k, len(self)))
+        return labels, scores
+
+    def _pending_path(self, path: Path) -> Path:
+        return Path(str(path) + ".pending.npz")
+
+    def save(self, path: Path) -> None:
+        import faiss
+
+        tmp = str(path) + ".tmp"
+        faiss.write_index(self._index, tmp)
+        os.replace(tmp, path)
+        pending = self._pending_path(path)
+        if len(self._pending):
+            self._pending.save(pending)
+        else:
+            pending.unlink(missing_ok=True)
+
+    @classmethod
+    def load(cls, path: Path, ef_search: int = 64) -> "FaissIndex":
+        import faiss
+
+        index = cls.__new__(cls)
+        index._index = faiss.read_index(str(path))
+        index._base = faiss.downcast_index(index._index.index)
+        index.dim = index._index.d
+        index.ef_search = ef_search
+        index._base.hnsw.efSearch = ef_search
+        pending = index._pending_path(path)
+        index._pending = ExactIndex.load(pending) if pending.exists() else ExactIndex(index.dim)
+        return index
+
+
+# ============================
+# Фабрика и персистентность
+# ============================
+
+ANN_BACKENDS = ("exact", "hnswlib", "faiss")
+
+
+def make_index(
+    backend: str,
+    dim: int,
+    quantization: Optional[str] = None,
+    M: Optional[int] = None,
+    ef_construction: Optional[int] = None,
+    ef_search: Optional[int] = None,
+) -> VectorIndex:
+    quantization = quantization or settings.MEMORY_ANN_QUANTIZATION
+    M = M or settings.MEMORY_HNSW_M
+    ef_construction = ef_construction or settings.MEMORY_HNSW_EF_CONSTRUCTION
+    ef_search = ef_search or settings.MEMORY_HNSW_EF_SEARCH
+    if backend == "exact":
+        return ExactIndex(dim, quantization)
+    if backend == "hnswlib":
+        if quantization != "none":
+            print(f"⚠️ hnswlib stores float32; quantization={quantization} ignored")
+        return HnswlibIndex(dim, M, ef_construction, ef_search)
+    if backend == "faiss":
+        return FaissIndex(dim, quantization, M, ef_construction, ef_search)
+    raise ValueError(f"unknown ANN backend {backend!r}, expected one of {ANN_BACKENDS}")
+
+
+def save_index(index: VectorIndex, directory: Path) -> None:
+    directory.mkdir(parents=True, exist_ok=True)
+    backend = {ExactIndex: "exact", HnswlibIndex: "hnswlib", FaissIndex: "faiss"}[type(index)]
+    index.save(directory / f"index.{backend}")
+    tmp = directory / "index.json.tmp"
+    tmp.write_text(json.dumps({"backend": backend, "dim": index.dim, "count": len(index)}))
+    os.replace(tmp, directory / "index.json")
+
+
+def load_index(directory: Path) -> Optional[VectorIndex]:
+    try:
+        meta = json.loads((directory / "index.json").read_text())
+    except FileNotFoundError:
+        return None
+    path = directory / f"index.{meta['backend']}"
+    if meta["backend"] == "exact":
+        return ExactIndex.load(path)
+    if meta["backend"] == "hnswlib":
+        return HnswlibIndex.load(path, meta["dim"], settings.MEMORY_HNSW_EF_SEARCH)
+    return FaissIndex.load(path, settings.MEMORY_HNSW_EF_SEARCH)
+
+
+# ============================
+# Бенчмарк recall / latency против точного поиска
+# ============================
+
+def _synthetic_embeddings(n: int, dim: int, rng: np.random.Generator, intrinsic: int = 24) -> np.ndarray:
+    """
+    Как у реальных эмбеддингов, внутренняя размерность ниже dim:
+    латентные факторы + линейная проекция + небольшой шум.
+    """
+    projection = np.random.default_rng(1).normal(size=(intrinsic, dim)).astype(np.float32)
+    out = np.empty((n, dim), dtype=np.float32)
+    for start in range(0, n, 100_000):
+        stop = min(start + 100_000, n)
+        latent = rng.normal(size=(stop - start, intrinsic)).astype(np.float32)
+        out[start:stop] = latent @ projection + 0.3 * rng.normal(size=(stop - start, dim)).astype(np.float32)
+    return out
+
+
+def _benchmark(sizes=(100_000, 1_000_000), dim: int = 128, n_queries: int = 200, k: int = 10) -> None:
+    rng = np.random.default_rng(0)
+    for n in sizes:
+        data = _synthetic_embeddings(n, dim, rng)
+        queries = _synthetic_embeddings(n_queries, dim, rng)
+        ids = np.arange(n)
+
+        exact = ExactIndex(dim)
+        exact.add(ids, data)
+        truth, _ = exact.search(queries, k)
+        started = time.perf_counter()
+        for q in queries:
+            exact.search(q, k)
+        exact_ms = (time.perf_counter() - started) * 1000 / n_queries
+        print(f"\nN={n:,} dim={dim}: exact float32 {exact_ms:.2f} ms/query, {exact.nbytes / 2 ** 20:.0f} MB")
+
+        candidates = [("exact", "float16", None), ("exact", "int8", None),
+                      ("hnswlib", "none", 32), ("hnswlib", "none", 128),
+                      ("faiss", "none", 64), ("faiss", "int8", 64)]
+        for backend, quantization, ef in candidates:
+            try:
+                index = make_index(backend, dim, quantization, ef_search=ef)
+            except ImportError as exc:
+                print(f"  {backend:8s} skipped: {exc}")
+                continue
+            started = time.perf_counter()
+            for start in range(0, n, 50_000):
+                index.add(ids[start:start + 50_000], data[start:start + 50_000])
+            build = time.perf_counter() - started
+
+            # по одному запросу — как в реальном пайплайне
+            started = time.perf_counter()
+            found = np.vstack([index.search(q, k)[0] for q in queries])
+            latency = (time.perf_counter() - started) * 1000 / n_queries
+            recall = np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth)])
+            size = f", {index.nbytes / 2 ** 20:.0f} MB" if hasattr(index, "nbytes") else ""
+            label = f"ef={ef}" if ef else ""
+            print(f"  {backend:8s} {quantization:8s} {label:7s} recall@{k} {recall:.3f}, "
+                  f"{latency:.2f} ms/query, build {build:.1f} s{size}")
+        del data, exact
+
+
+if __name__ == "__main__":
+    _benchmark()
@@ -0,0 +1,460 @@
+# asgi_app.py
+
+"""
+ASGI-режим дашборда (Starlette + uvicorn) для SSE-стриминга запусков.
+
+Во Flask-режиме (web_app.py) каждый SSE-зритель занимает поток на всё
+время пайплайна — минуты; несколько зрителей исчерпывают сервер. Здесь:
+
+- SSE-генераторы асинхронные: ждущий зритель — корутина и asyncio.Event
+  (Job.subscribe_async), без потока и без опроса;
+- вывод процесса пайплайна читает один поток JobManager на запуск, а не
+  поток на зрителя, — цикл событий на чтении не блокируется;
+- каждые SSE_HEARTBEAT секунд уходит event: heartbeat, заодно
+  проверяется, не отключился ли клиент;
+- при отключении клиента генератор отменяется и подписка снимается;
+  запуск, созданный совместимым /stream, отменяется, когда уходит его
+  последний зритель (результат больше никто не ждёт);
+- PDF рендерится (или берётся из кэша) в пуле pdf_renderer, файлы
+  отдаются потоково через FileResponse.
+
+Запуск:   uvicorn Final_Project.asgi_app:app --port 8000
+    или:  python -m Final_Project.asgi_app
+Нагрузочный тест (рой локальных SSE-клиентов):
+          python -m Final_Project.asgi_app --loadtest 300
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from pathlib import Path
+from typing import AsyncIterator, List, Optional
+
+import numpy as np
+from starlette.applications import Starlette
+from starlette.exceptions import HTTPException
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import FileResponse, HTMLResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+from .config import settings
+from .dashboard_ui import render_index
+from .jobs import Job, JobManager
+from .pdf_renderer import get_pdf_renderer
+from .report_store import ReportStore, get_report_store, query_filters
+from .streaming import sse_frame
+
+
+BASE_DIR = Path(__file__).resolve().parent
+REPORT_MD = BASE_DIR / "final_investment_report.md"
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+# ============================
+# SSE
+# ============================
+
+async def sse_events(
+    request: Request,
+    job: Job,
+    last_seq: int = 0,
+    heartbeat: Optional[float] = None,
+) -> AsyncIterator[str]:
+    """SSE по логу запуска: id: — номер строки (для Last-Event-ID), токены LLM — event: token."""
+    lines = job.subscribe_async(last_seq, heartbeat or settings.SSE_HEARTBEAT)
+    try:
+        async for item in lines:
+            if item is None:
+                if await request.is_disconnected():
+                    return
+                yield f"event: heartbeat\ndata: {job.status}\n\n"
+                continue
+            yield sse_frame(*item)
+        yield f"event: done\ndata: {job.status}\n\n"
+    finally:
+        # снимаем подписку сразу, не дожидаясь сборщика мусора
+        await lines.aclose()
+
+
+async def pdf_response(md_path: Path) -> FileResponse:
+    pdf_path = await asyncio.wrap_future(get_pdf_renderer().submit(md_path))
+    return FileResponse(pdf_path, filename=md_path.with_suffix(".pdf").name)
+
+
+def _last_seq(request: Request) -> int:
+    last_id = request.headers.get("last-event-id") or request.query_params.get("last_id") or 0
+    try:
+        return int(last_id)
+    except ValueError:
+        return 0
+
+
+# ============================
+# Приложение
+# ============================
+
+def create_app(manager: Optional[JobManager] = None, store: Optional[ReportStore] = None) -> Starlette:
+    jobs = manager or JobManager()
+    reports = store or get_report_store()
+
+    def get_job(request: Request) -> Job:
+        job = jobs.get(request.path_params["job_id"])
+        if job is None:
+            raise HTTPException(404)
+        return job
+
+    async def index(request: Request) -> HTMLResponse:
+        return HTMLResponse(render_index(settings.DEFAULT_TICKERS))
+
+    async def list_jobs(request: Request) -> JSONResponse:
+        return JSONResponse([job.to_dict() for job in jobs.list()])
+
+    async def create_job(request: Request) -> JSONResponse:
+        # JSON-тело (как шлёт дашборд) или ?tickers=; формы не разбираем,
+        # чтобы не тянуть python-multipart
+        try:
+            payload = await request.json()
+        except ValueError:
+            payload = None
+        if not isinstance(payload, dict):
+            payload = {}
+        raw = payload.get("tickers") or request.query_params.get("tickers") or ",".join(settings.DEFAULT_TICKERS)
+        tickers = raw.split(",") if isinstance(raw, str) else raw
+        try:
+            job, created = jobs.submit(tickers)
+        except ValueError as e:
+            return JSONResponse({"error": str(e)}, status_code=400)
+        return JSONResponse({**job.to_dict(), "created": created}, status_code=201 if created else 200)
+
+    async def job_status(request: Request) -> JSONResponse:
+        return JSONResponse(get_job(request).to_dict())
+
+    async def cancel_job(request: Request) -> JSONResponse:
+        job = jobs.cancel(get_job(request).id)
+        return JSONResponse(job.to_dict())
+
+    async def job_stream(request: Request) -> StreamingResponse:
+        job = get_job(request)
+        return StreamingResponse(
+            sse_events(request, job, _last_seq(request)),
+            media_type="text/event-stream",
+            headers=SSE_HEADERS,
+        )
+
+    async def stream(request: Request) -> StreamingResponse:
+        # совместимость: запуск с тикерами по умолчанию (или присоединение к нему)
+        job, created = jobs.submit(settings.DEFAULT_TICKERS)
+
+        async def events() -> AsyncIterator[str]:
+            try:
+                async for chunk in sse_events(request, job):
+                    yield chunk
+            finally:
+                if created and not job.done and job.viewers == 0:
+                    print(f"🛑 last viewer of job {job.id} disconnected, cancelling")
+                    jobs.cancel(job.id)
+
+        return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+    async def job_download_md(request: Request) -> FileResponse:
+        job = get_job(request)
+        if not job.report_path.exists():
+            raise HTTPException(404)
+        return FileResponse(job.report_path, filename=job.report_path.name)
+
+    async def job_download_pdf(request: Request) -> FileResponse:
+        job = get_job(request)
+        if not job.report_path.exists():
+            raise HTTPException(404)
+        return await pdf_response(job.report_path)
+
+    async def download_md(request: Request) -> FileResponse:
+        md_path = jobs.latest_report() or REPORT_MD
+        if not md_path.exists():
+            raise HTTPException(404)
+        return FileResponse(md_path, filename=md_path.name)
+
+    async def download_pdf(request: Request) -> FileResponse:
+        md_path = jobs.latest_report() or REPORT_MD
+        if not md_path.exists():
+            raise HTTPException(404)
+        return await pdf_response(md_path)
+
+    async def list_reports(request: Request) -> JSONResponse:
+        # список и фильтры — из SQLite-индекса, без обхода каталогов
+        try:
+            filters = query_filters(request.query_params)
+        except ValueError as e:
+            return JSONResponse({"error": str(e)}, status_code=400)
+        found = await run_in_threadpool(reports.list, **filters)
+        return JSONResponse([r.to_dict() for r in found])
+
+    async def diff_reports(request: Request) -> PlainTextResponse:
+        old, new = request.query_params.get("a"), request.query_params.get("b")
+        diff = await run_in_threadpool(reports.diff, old, new) if old and new else None
+        if diff is None:
+            raise HTTPException(404)
+        return PlainTextResponse(diff)
+
+    async def read_report(request: Request) -> str:
+        text = await run_in_threadpool(reports.read, request.path_params["run_id"])
+        if text is None:
+            raise HTTPException(404)
+        return text
+
+    async def report_md(request: Request) -> Response:
+        run_id = request.path_params["run_id"]
+        return Response(
+            await read_report(request), media_type="text/markdown; charset=utf-8",
+            headers={"Content-Disposition": f"attachment; filename={run_id}.md"},
+        )
+
+    async def report_pdf(request: Request) -> FileResponse:
+        run_id = request.path_params["run_id"]
+        text = await read_report(request)
+        pdf_path = await asyncio.wrap_future(get_pdf_renderer().submit_text(text, title=run_id))
+        return FileResponse(pdf_path, filename=f"{run_id}.pdf")
+
+    routes = [
+        Route("/", index),
+        Route("/jobs", list_jobs, methods=["GET"]),
+        Route("/jobs", create_job, methods=["POST"]),
+        Route("/jobs/{job_id}", job_status, methods=["GET"]),
+        Route("/jobs/{job_id}", cancel_job, methods=["DELETE"]),
+        Route("/jobs/{job_id}/stream", job_stream),
+        Route("/stream", stream),
+        Route("/jobs/{job_id}/download_md", job_download_md),
+        Route("/jobs/{job_id}/download_pdf", job_download_pdf),
+        Route("/download_md", download_md),
+        Route("/download_pdf", download_pdf),
+        Route("/reports", list_reports),
+        Route("/reports/diff", diff_reports),
+        Route("/reports/{run_id}", report_md),
+        Route("/reports/{run_id}/pdf", report_pdf),
+    ]
+    app = Starlette(routes=routes)
+    app.state.jobs = jobs
+    return app
+
+
+app = create_app()
+
+
+# ============================
+# Нагрузочный тест: рой SSE-клиентов
+# ============================
+
+# Вместо пайплайна — процесс, который молчит idle секунд (зрители висят
+# без данных), затем печатает метки времени: по ним меряется задержка доставки.
+_TICK_SCRIPT = (
+    "import sys, time\n"
+    "idle, ticks, period = float(sys.argv[1]), int(sys.argv[2]), float(sys.argv[3])\n"
+    "time.sleep(idle)\n"
+    "for i in range(ticks):\n"
+    "    print(f'tick {i} {time.time():.6f}', flush=True)\n"
+    "    time.sleep(period)\n"
+)
+
+
+class _TickJobManager(JobManager):
+    def _command(self, job: Job) -> List[str]:
+        return [
+            sys.executable, "-c", _TICK_SCRIPT,
+            os.environ.get("LOADTEST_IDLE", "5"),
+            os.environ.get("LOADTEST_TICKS", "20"),
+            os.environ.get("LOADTEST_PERIOD", "0.25"),
+        ]
+
+
+def loadtest_app() -> Starlette:
+    """Фабрика для `uvicorn --factory`: тот же API, но запуски — тикающий процесс."""
+    return create_app(_TickJobManager(root=Path(tempfile.mkdtemp(prefix="asgi_loadtest_"))))
+
+
+def _rss_kb(pid: int) -> Optional[int]:
+    try:
+        with open(f"/proc/{pid}/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None  # не Linux
+
+
+def _http_json(port: int, method: str, path: str, payload: Optional[dict] = None) -> dict:
+    data = json.dumps(payload).encode("utf-8") if payload is not None else None
+    req = urllib.request.Request(
+        f"http://127.0.0.1:{port}{path}", data=data, method=method,
+        headers={"Content-Type": "application/json"},
+    )
+    with urllib.request.urlopen(req, timeout=10) as resp:
+        return json.loads(resp.read())
+
+
+class _SwarmStats:
+    def __init__(self, clients: int) -> None:
+        self.clients = clients
+        self.connected = 0
+        self.all_connected = asyncio.Event()
+        self.connect_ms: List[float] = []
+        self.latency_ms: List[float] = []
+        self.heartbeats = 0
+        self.done = 0
+
+    def on_connect(self, ms: float) -> None:
+        self.connect_ms.append(ms)
+        self.connected += 1
+        if self.connected == self.clients:
+            self.all_connected.set()
+
+
+async def _sse_client(port: int, path: str, stats: _SwarmStats, hold: Optional[asyncio.Event] = None) -> None:
+    """Минимальный SSE-клиент на сокете: тысяча таких не нагружает сам тест."""
+    t0 = time.perf_counter()
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(
+        f"GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nAccept: text/event-stream\r\n\r\n".encode("ascii")
+    )
+    await writer.drain()
+    while (await reader.readline()) not in (b"\r\n", b""):
+        pass  # заголовки ответа
+    stats.on_connect((time.perf_counter() - t0) * 1000)
+    try:
+        if hold is not None:
+            await hold.wait()  # сценарий отключения: висим и рвём соединение
+            return
+        while True:
+            # тело chunked: строки размеров чанков просто пропускаются
+            line = await reader.readline()
+            if not line:
+                break
+            if line.startswith(b"data: tick "):
+                stats.latency_ms.append((time.time() - float(line.split()[3])) * 1000)
+            elif line.startswith(b"event: heartbeat"):
+                stats.heartbeats += 1
+            elif line.startswith(b"event: done"):
+                stats.done += 1
+                break
+    finally:
+        writer.close()
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_ready(port: int, process: subprocess.Popen, timeout: float = 30.0) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("server exited during startup")
+        try:
+            _http_json(port, "GET", "/jobs")
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("server did not start")
+
+
+def _pct(values: List[float], q: float) -> float:
+    return float(np.percentile(values, q)) if values else float("nan")
+
+
+async def _loadtest(clients: int, idle: float, ticks: int, period: float, heartbeat: float) -> None:
+    port = _free_port()
+    env = {
+        **os.environ,
+        "SSE_HEARTBEAT": str(heartbeat),
+        "LOADTEST_IDLE": str(idle),
+        "LOADTEST_TICKS": str(ticks),
+        "LOADTEST_PERIOD": str(period),
+    }
+    server = subprocess.Popen(
+        [
+            sys.executable, "-m", "uvicorn", "--factory", f"{__package__}.asgi_app:loadtest_app",
+            "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning", "--no-access-log",
+        ],
+        env=env,
+        cwd=str(Path(__file__).resolve().parent.parent),
+    )
+    try:
+        await asyncio.to_thread(_wait_ready, port, server)
+        rss_base = _rss_kb(server.pid)
+
+        # 1) рой зрителей одного запуска: память на соединение и задержка доставки
+        job = await asyncio.to_thread(_http_json, port, "POST", "/jobs", {"tickers": "LOAD"})
+        stats = _SwarmStats(clients)
+        t0 = time.perf_counter()
+        tasks = [asyncio.create_task(_sse_client(port, f"/jobs/{job['id']}/stream", stats)) for _ in range(clients)]
+        await stats.all_connected.wait()
+        connect_s = time.perf_counter() - t0
+        rss_idle = _rss_kb(server.pid)
+        info = await asyncio.to_thread(_http_json, port, "GET", f"/jobs/{job['id']}")
+        await asyncio.gather(*tasks)
+
+        print(f"📡 {clients} SSE clients connected in {connect_s:.2f}s "
+              f"(connect p50 {_pct(stats.connect_ms, 50):.1f} ms, p95 {_pct(stats.connect_ms, 95):.1f} ms), "
+              f"server sees {info['viewers']} viewers")
+        if rss_base is not None and rss_idle is not None:
+            print(f"🧮 server RSS {rss_base / 1024:.1f} MB -> {rss_idle / 1024:.1f} MB with idle clients: "
+                  f"{(rss_idle - rss_base) / clients:.1f} KB per connection")
+        expected = clients * ticks
+        print(f"⏱️ delivered {len(stats.latency_ms)}/{expected} events, latency "
+              f"p50 {_pct(stats.latency_ms, 50):.1f} ms, p95 {_pct(stats.latency_ms, 95):.1f} ms, "
+              f"max {max(stats.latency_ms, default=float('nan')):.1f} ms")
+        print(f"💓 {stats.heartbeats} heartbeats during {idle:.0f}s idle "
+              f"({stats.heartbeats / clients:.1f} per client), {stats.done}/{clients} got 'done'")
+
+        # 2) зрители уходят, не дождавшись конца: подписки должны освободиться
+        job = await asyncio.to_thread(_http_json, port, "POST", "/jobs", {"tickers": "LOAD2"})
+        stats, hold = _SwarmStats(clients), asyncio.Event()
+        tasks = [
+            asyncio.create_task(_sse_client(port, f"/jobs/{job['id']}/stream", stats, hold))
+            for _ in range(clients)
+        ]
+        await stats.all_connected.wait()
+        hold.set()
+        await asyncio.gather(*tasks)
+        t0 = time.perf_counter()
+        viewers = clients
+        while viewers and time.perf_counter() - t0 < heartbeat * 3 + 5:
+            await asyncio.sleep(0.1)
+            viewers = (await asyncio.to_thread(_http_json, port, "GET", f"/jobs/{job['id']}"))["viewers"]
+        print(f"🔌 {clients} clients disconnected: {viewers} subscriptions left after "
+              f"{time.perf_counter() - t0:.2f}s")
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ASGI dashboard server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--loadtest", type=int, default=0, metavar="N",
+                        help="run an SSE load test with N local clients instead of serving")
+    parser.add_argument("--idle", type=float, default=5.0, help="load test: seconds before first event")
+    parser.add_argument("--ticks", type=int, default=20, help="load test: events per job")
+    parser.add_argument("--heartbeat", type=float, default=1.0, help="load test: SSE heartbeat period")
+    args = parser.parse_args()
+
+    if args.loadtest:
+        asyncio.run(_loadtest(args.loadtest, args.idle, args.ticks, 0.25, args.heartbeat))
+    else:
+        import uvicorn
+
+        uvicorn.run(app, host=args.host, port=args.port)
@@ -1,7 +1,7 @@
 # chains.py
 
 from __future__ import annotations
-from typing import List
+from typing import Dict, List, Literal, Optional, Sequence
 
 from pydantic import BaseModel, Field
 
@@ -10,7 +10,11 @@ from langchain_core.prompts import PromptTemplate
 from langchain_core.language_models import BaseLanguageModel
 
 from .config import settings
-from .rag_kg import dynamic_retriever
+from .context_budget import get_budgeter
+from .llm_cache import cached_invoke
+from .retrieval import get_retriever
+from .streaming import stage
+from .structured_output import compact, get_structured
 
 
 # ============================
@@ -21,7 +25,7 @@ class TechnicalAnalysis(BaseModel):
     ticker: str = Field(..., description="Stock ticker symbol")
     trend_summary: str
     key_indicators: List[str]
-    rating: str  # "bullish" | "bearish" | "neutral"
+    rating: Literal["bullish", "bearish", "neutral"]
 
 
 class FundamentalAnalysis(BaseModel):
@@ -35,7 +39,7 @@ class FundamentalAnalysis(BaseModel):
 class RiskAssessment(BaseModel):
     ticker: str
     risk_factors: List[str]
-    overall_risk_level: str  # "low" | "medium" | "high"
+    overall_risk_level: Literal["low", "medium", "high"]
     comments: str
 
 
@@ -47,24 +51,37 @@ def _build_prompt(template: str) -> PromptTemplate:
     return PromptTemplate.from_template(template)
 
 
+def _complete(llm: BaseLanguageModel, text: str, schema, ticker: str, structured: Optional[bool], task: str):
+    """
+    Свободный текст или объект схемы (STRUCTURED_OUTPUT); токены ответа
+    стримятся в дашборд как стадия task/ticker.
+    """
+    with stage(task, ticker):
+        if settings.STRUCTURED_OUTPUT if structured is None else structured:
+            return get_structured(llm).generate(schema, text, known={"ticker": ticker})
+        return cached_invoke(llm, text)
+
+
 # =======================================
 # Цепочка технического анализа
 # =======================================
 
-def build_technical_chain(llm: BaseLanguageModel):
+def build_technical_chain(llm: BaseLanguageModel, structured: Optional[bool] = None):
     prompt = _build_prompt(
         "You are a technical analyst.\n"
         "Given recent price behaviour and basic stats for {ticker}, "
         "produce a concise technical view.\n\n"
+        "Computed indicators (last bar):\n{indicators}\n\n"
         "Context:\n{context}\n\n"
         "Answer in English."
     )
 
     class Chain:
         def invoke(self, inputs):
-            text = prompt.format(**inputs)
-            result = llm.invoke(text)
-            return result.content
+            text = get_budgeter().fit_prompt(
+                prompt, {"indicators": "n/a", **inputs}, ["indicators", "context"], name="technical"
+            )
+            return _complete(llm, text, TechnicalAnalysis, inputs["ticker"], structured, "technical")
 
     return Chain()
 
@@ -73,7 +90,7 @@ def build_technical_chain(llm: BaseLanguageModel):
 # Цепочка фундаментального анализа (RAG)
 # =======================================
 
-def build_fundamental_chain(llm: BaseLanguageModel):
+def build_fundamental_chain(llm: BaseLanguageModel, structured: Optional[bool] = None):
     prompt = _build_prompt(
         "You are a fundamental equity analyst.\n\n"
         "Use the context below to summarize the business and fundamentals of {ticker}.\n"
@@ -83,9 +100,8 @@ def build_fundamental_chain(llm: BaseLanguageModel):
 
     class Chain:
         def invoke(self, inputs):
-            text = prompt.format(**inputs)
-            result = llm.invoke(text)
-            return result.content
+            text = get_budgeter().fit_prompt(prompt, inputs, ["context"], name="fundamental")
+            return _complete(llm, text, FundamentalAnalysis, inputs["ticker"], structured, "fundamental")
 
     return Chain()
 
@@ -94,7 +110,7 @@ def build_fundamental_chain(llm: BaseLanguageModel):
 # Цепочка оценки рисков
 # =======================================
 
-def build_risk_chain(llm: BaseLanguageModel):
+def build_risk_chain(llm: BaseLanguageModel, structured: Optional[bool] = None):
     prompt = _build_prompt(
         "You are a risk manager.\n\n"
         "Given the technical and fundamental analysis for {ticker} and extra context:\n"
@@ -104,9 +120,9 @@ def build_risk_chain(llm: BaseLanguageModel):
 
     class Chain:
         def invoke(self, inputs):
-            text = prompt.format(**inputs)
-            result = llm.invoke(text)
-            return result.content
+            inputs = {k: compact(v) for k, v in inputs.items()}
+            text = get_budgeter().fit_prompt(prompt, inputs, ["context"], name="risk")
+            return _complete(llm, text, RiskAssessment, inputs["ticker"], structured, "risk")
 
     return Chain()
 
@@ -126,9 +142,11 @@ def build_report_chain(llm: BaseLanguageModel):
 
     class Chain:
         def invoke(self, inputs):
-            text = prompt.format(**inputs)
-            result = llm.invoke(text)
-            return result.content
+            # объекты стадий идут в промпт компактным JSON, а не прозой
+            inputs = {k: compact(v) for k, v in inputs.items()}
+            text = get_budgeter().fit_prompt(prompt, inputs, ["tech", "fund", "risk"], name="report")
+            with stage("report", inputs["ticker"]):
+                return cached_invoke(llm, text)
 
     return Chain()
 
@@ -137,7 +155,30 @@ def build_report_chain(llm: BaseLanguageModel):
 # Вспомогательный доступ к RAG
 # =======================================
 
-def retrieve_context_for_question(ticker: str, qtype: str) -> str:
-    retriever = dynamic_retriever(qtype)
-    docs = retriever.similarity_search(ticker, k=6)
-    return "\n\n".join(d.page_content for d in docs)
\ No newline at end of file
+def retrieve_context_for_question(ticker: str, qtype: str, k: int = 6) -> str:
+    """
+    Контекст только по документам этого тикера; набор источников зависит
+    от qtype (technical/fundamental/risk). Ранжирование — BM25 + векторы (RRF).
+    """
+    docs = get_retriever().retrieve(ticker, qtype, k=k)
+    return "\n\n".join(d.page_content for d in docs)
+
+
+def rag_contexts(
+    tickers: Sequence[str],
+    qtypes: Sequence[str] = ("fundamental", "risk"),
+) -> Dict[str, Dict[str, str]]:
+    """
+    ticker -> qtype -> контекст из RAG (новости, PDF) для узлов DAG.
+    Ошибка поиска не валит запуск: узел получает пустой контекст.
+    """
+    contexts: Dict[str, Dict[str, str]] = {}
+    for ticker in tickers:
+        contexts[ticker] = {}
+        for qtype in qtypes:
+            try:
+                contexts[ticker][qtype] = retrieve_context_for_question(ticker, qtype)
+            except Exception as e:
+                print(f"⚠️ RAG context for {ticker}/{qtype} unavailable: {e}")
+                contexts[ticker][qtype] = ""
+    return contexts
\ No newline at end of file
@@ -2,6 +2,7 @@
 
 import os
 from pathlib import Path
+from typing import List, Optional
 from pydantic_settings import BaseSettings
 
 # Корень проекта = папка, где лежит Final_Project
@@ -13,21 +14,129 @@ class Settings(BaseSettings):
     DATA_DIR: Path = BASE_DIR / "data"
     VECTOR_DB_DIR: Path = BASE_DIR / "vector_store_v2"
     KG_DB_PATH: Path = BASE_DIR / "kg_graph_v2.gml"
+    # Граф знаний в компактном бинарном виде (CSR, .npz); GML — только экспорт
+    KG_STORE_PATH: Path = BASE_DIR / "data" / "knowledge_graph.npz"
+    # Ограничения k-hop окружения тикера для промптов агентов
+    KG_CONTEXT_HOPS: int = 2
+    KG_CONTEXT_MAX_NODES: int = 40
     REPORTS_DIR: Path = BASE_DIR / "reports"
 
+    # === PDF ingestion: размер чанка и перекрытие (в символах) ===
+    PDF_CHUNK_SIZE: int = 1000
+    PDF_CHUNK_OVERLAP: int = 150
+
     # === LLM/Embeddings (без обязательного OPENAI_API_KEY) ===
     # Эта модель используется HuggingFaceEmbeddings
     HF_EMBEDDING_MODEL: str = "sentence-transformers/all-mpnet-base-v2"
+    # Общий сервис эмбеддингов: размер батча, число потоков torch (None = по умолчанию)
+    # и персистентный кэш векторов
+    EMBEDDING_BATCH_SIZE: int = 64
+    EMBEDDING_THREADS: Optional[int] = None
+    EMBEDDING_CACHE_PATH: Path = BASE_DIR / "data" / "embedding_cache.sqlite"
+
+    # Долгосрочная память: "chroma" (по умолчанию) или свой индекс
+    # "exact" | "hnswlib" | "faiss"; квантизация "none" | "float16" | "int8"
+    MEMORY_ANN_BACKEND: str = "chroma"
+    MEMORY_ANN_QUANTIZATION: str = "none"
+    MEMORY_HNSW_M: int = 16
+    MEMORY_HNSW_EF_CONSTRUCTION: int = 100
+    MEMORY_HNSW_EF_SEARCH: int = 64
+    MEMORY_INDEX_DIR: Path = BASE_DIR / "data" / "long_term_memory"
+    # Бюджет короткой памяти (токены); старые реплики вытесняются в long-term
+    SHORT_TERM_MAX_TOKENS: int = 2000
+    # Отложенная запись в long-term: размер батча, макс. ожидание (сек)
+    # и ёмкость очереди (при переполнении submit ждёт)
+    MEMORY_WRITE_BATCH_SIZE: int = 32
+    MEMORY_WRITE_FLUSH_INTERVAL: float = 2.0
+    MEMORY_WRITE_QUEUE_SIZE: int = 1000
+    # Сколько токенов воспоминаний попадает в промпт
+    MEMORY_CONTEXT_TOKENS: int = 600
 
     # Строка-модель для CrewAI через LiteLLM
     # Если используется Ollama:
     CREW_LLM_MODEL: str = "ollama/mistral"
     # Для другой среды можно поменять, например: "gpt-4o-mini"
 
+    # Сколько LLM-вызовов DAG-исполнитель пускает одновременно
+    # (для Ollama имеет смысл держать равным OLLAMA_NUM_PARALLEL)
+    LLM_MAX_CONCURRENCY: int = 2
+
+    # Бюджет токенов промпта (окно Ollama/Mistral минус место под ответ)
+    # и порог MinHash-сходства, с которого чанки считаются дубликатами
+    PROMPT_TOKEN_BUDGET: int = 3000
+    CONTEXT_DEDUP_THRESHOLD: float = 0.8
+
+    # Структурированные ответы агентов (схемы chains.py): technical,
+    # fundamental и risk отдают объекты, между стадиями идёт компактный JSON.
+    # CONSTRAINED — JSON Schema в Ollama как format (constrained decoding);
+    # MAX_REPAIRS — сколько точечных повторов для невалидных полей
+    STRUCTURED_OUTPUT: bool = True
+    STRUCTURED_CONSTRAINED: bool = True
+    STRUCTURED_MAX_REPAIRS: int = 2
+    STRUCTURED_TIMEOUT: float = 300.0
+
+    # Токен-события LLM в stdout (для SSE дашборда; запуски из дашборда
+    # включают сами) и как часто сбрасывать накопленные токены стадии (сек)
+    TOKEN_EVENTS: bool = False
+    TOKEN_FLUSH_INTERVAL: float = 0.2
+
+    # Кэш ответов LLM (SQLite): LRU по числу записей, TTL в секундах (None = без TTL)
+    LLM_CACHE_ENABLED: bool = True
+    LLM_CACHE_PATH: Path = BASE_DIR / "data" / "llm_cache.sqlite"
+    LLM_CACHE_MAX_ENTRIES: int = 5000
+    LLM_CACHE_TTL: Optional[float] = None
+
     # MCP: просто команды/описания для отчёта
     MCP_MARKET_SERVER_CMD: str = "python -m Final_Project.MCP_servers market"
     MCP_NEWS_SERVER_CMD: str = "python -m Final_Project.MCP_servers news"
 
+    # === Веб-дашборд: запуски пайплайна ===
+    # Тикеры по умолчанию (main.py и дашборды без тяжёлых импортов пайплайна)
+    DEFAULT_TICKERS: List[str] = ["AAPL", "MSFT", "TSLA"]
+    # Сколько пайплайнов идёт одновременно, сколько строк лога хранится
+    # для опоздавших зрителей и сколько завершённых запусков помнить
+    JOB_MAX_WORKERS: int = 2
+    JOB_LOG_LINES: int = 2000
+    JOB_HISTORY: int = 50
+    # Как исполняются запуски: "subprocess" — новый процесс на каждый
+    # (холодный старт: импорты, агенты, модель эмбеддингов заново);
+    # "worker" — постоянные прогретые процессы worker.py
+    JOB_EXECUTOR: str = "subprocess"
+    # Сколько прогретых процессов держать (по умолчанию JOB_MAX_WORKERS)
+    WORKER_PROCESSES: Optional[int] = None
+    # PDF-отчёты: кэш по хэшу Markdown (сколько файлов хранить), потоки
+    # рендеринга и TTF-шрифт с кириллицей (по умолчанию DejaVu из matplotlib)
+    PDF_CACHE_DIR: Path = BASE_DIR / "reports" / "pdf_cache"
+    PDF_CACHE_FILES: int = 64
+    PDF_RENDER_WORKERS: int = 2
+    PDF_FONT_PATH: Optional[str] = None
+    # Хранилище отчётов: каталог (+ SQLite-индекс), сжатие "none" | "zstd",
+    # срок хранения в днях (0 — бессрочно) и сколько последних хранить
+    REPORT_STORE_DIR: Path = BASE_DIR / "reports" / "store"
+    REPORT_COMPRESSION: str = "none"
+    REPORT_RETENTION_DAYS: float = 365.0
+    REPORT_MAX_COUNT: int = 500
+    # Графики цен: панели ("price", "volume", "indicators" — SMA/Боллинджер
+    # поверх цены, "drawdown"), DPI, процессы рендеринга и с какого размера
+    # батча их задействовать (мелкий батч быстрее нарисовать на месте)
+    CHART_PANELS: List[str] = ["price", "volume", "indicators", "drawdown"]
+    CHART_DPI: int = 100
+    CHART_WORKERS: int = max(1, min(4, os.cpu_count() or 1))
+    CHART_PROCESS_MIN: int = 8
+    # Период heartbeat-событий в SSE-потоке (сек): держит соединение
+    # живым через прокси и быстро выявляет ушедших зрителей
+    SSE_HEARTBEAT: float = 15.0
+
+    # === Market data ===
+    # Лимит провайдера (запросов в секунду), параллелизм, число ретраев
+    # и сколько тикеров уходит в один запрос yf.download
+    MARKET_RATE_LIMIT: float = 2.0
+    MARKET_MAX_CONCURRENCY: int = 8
+    MARKET_MAX_RETRIES: int = 3
+    MARKET_BATCH_SIZE: int = 50
+    # Сколько секунд закэшированные бары считаются свежими (без запроса в сеть)
+    PRICE_CACHE_TTL: float = 3600.0
+
     class Config:
         env_file = ".env"
         extra = "ignore"
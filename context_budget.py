@@ -0,0 +1,289 @@
+# context_budget.py
+
+"""
+Бюджет токенов для промптов агентов (без LLM).
+
+- токены считаются через tiktoken (cl100k_base), а если он не
+  установлен или словарь недоступен офлайн — локальной аппроксимацией
+  (слова режутся на куски по 4 символа, пунктуация — отдельно);
+- общий бюджет делится между секциями промпта ({context}, {tech}, ...)
+  по весам; то, что секции не нужно, достаётся остальным;
+- почти одинаковые чанки (шаблонные новости, повторы из разных
+  источников) отбрасываются по MinHash-оценке Жаккара;
+- внутри секции чанки берутся по убыванию релевантности, порядок
+  в тексте сохраняется;
+- на каждый вызов печатается, сколько токенов сэкономлено.
+
+Промпт короче — меньше prefill у локальной модели и нет переполнения
+окна Mistral при большом числе тикеров.
+"""
+
+from __future__ import annotations
+
+import re
+import threading
+import zlib
+from dataclasses import dataclass, field
+from typing import Dict, List, Mapping, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from langchain_core.prompts import PromptTemplate
+
+from .config import settings
+
+
+# ============================
+# Подсчёт токенов
+# ============================
+
+_PIECE = re.compile(r"\w{1,4}|[^\w\s]")
+_encoder = None
+_encoder_ready = False
+_encoder_lock = threading.Lock()
+
+
+def _get_encoder():
+    global _encoder, _encoder_ready
+    if _encoder_ready:
+        return _encoder
+    # узлы DAG считают токены параллельно: пока словарь грузится, остальные
+    # ждут его, а не считают приближённо (счёт разошёлся бы между вызовами)
+    with _encoder_lock:
+        if not _encoder_ready:
+            try:
+                import tiktoken
+                _encoder = tiktoken.get_encoding("cl100k_base")
+            except Exception:
+                # нет пакета или словаря (офлайн) — считаем приближённо
+                _encoder = None
+            _encoder_ready = True
+    return _encoder
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    encoder = _get_encoder()
+    if encoder is not None:
+        return len(encoder.encode(text, disallowed_special=()))
+    return len(_PIECE.findall(text))
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """Обрезает текст до max_tokens токенов (маркер обрезки входит в лимит)."""
+    if max_tokens <= 1:
+        return ""
+    encoder = _get_encoder()
+    if encoder is not None:
+        ids = encoder.encode(text, disallowed_special=())
+        if len(ids) <= max_tokens:
+            return text
+        return encoder.decode(ids[: max_tokens - 1]) + " …"
+    for i, match in enumerate(_PIECE.finditer(text)):
+        if i == max_tokens - 1 and count_tokens(text) > max_tokens:
+            return text[: match.start()].rstrip() + " …"
+    return text
+
+
+# ============================
+# MinHash-дедупликация
+# ============================
+
+_PRIME = np.uint64(4294967311)  # простое > 2^32; a < 2^31, поэтому a*x+b не переполняет uint64
+_rng = np.random.default_rng(1234)
+_PERM_A = _rng.integers(1, 1 << 31, size=64, dtype=np.uint64)
+_PERM_B = _rng.integers(0, 1 << 32, size=64, dtype=np.uint64)
+
+
+def minhash_signature(text: str, shingle: int = 3) -> np.ndarray:
+    """64 хэша по словесным шинглам; доля совпадений ≈ Жаккар."""
+    words = re.findall(r"\w+", text.lower())
+    grams = {" ".join(words[i:i + shingle]) for i in range(max(len(words) - shingle + 1, 1))}
+    hashes = np.array([zlib.crc32(g.encode("utf-8")) for g in grams], dtype=np.uint64)
+    permuted = (np.outer(hashes, _PERM_A) + _PERM_B) % _PRIME
+    return permuted.min(axis=0)
+
+
+def dedupe_chunks(
+    chunks: Sequence[str],
+    threshold: float,
+    seen: Optional[List[np.ndarray]] = None,
+) -> List[int]:
+    """
+    Индексы чанков, оставшихся после удаления почти-дубликатов (первый
+    выигрывает). seen — сигнатуры уже принятых чанков, пополняется.
+    """
+    seen = [] if seen is None else seen
+    kept: List[int] = []
+    for i, text in enumerate(chunks):
+        sig = minhash_signature(text)
+        if any(np.mean(sig == other) >= threshold for other in seen):
+            continue
+        kept.append(i)
+        seen.append(sig)
+    return kept
+
+
+# ============================
+# Бюджетирование секций
+# ============================
+
+SectionInput = Union[str, Sequence[str], Sequence[Tuple[str, float]]]
+
+
+@dataclass
+class BudgetStats:
+    calls: int = 0
+    tokens_in: int = 0
+    tokens_out: int = 0
+    duplicates: int = 0
+
+    @property
+    def saved(self) -> int:
+        return self.tokens_in - self.tokens_out
+
+    def report(self) -> str:
+        return (
+            f"context budget: {self.calls} prompts, {self.tokens_in} -> {self.tokens_out} "
+            f"context tokens (saved {self.saved}, {self.duplicates} near-duplicate chunks dropped)"
+        )
+
+
+@dataclass
+class _Chunk:
+    text: str
+    score: float
+    tokens: int
+    position: int = field(default=0)
+
+
+def _as_chunks(value: SectionInput) -> List[_Chunk]:
+    """Строка режется по пустым строкам; без оценок ранние чанки важнее."""
+    if isinstance(value, str):
+        items = [(part, None) for part in re.split(r"\n\s*\n", value) if part.strip()]
+    else:
+        items = [(v, None) if isinstance(v, str) else (v[0], float(v[1])) for v in value]
+    return [
+        _Chunk(text, score if score is not None else 1.0 / (1 + i), count_tokens(text), i)
+        for i, (text, score) in enumerate(items)
+    ]
+
+
+def allocate(needs: Mapping[str, int], weights: Mapping[str, float], total: int) -> Dict[str, int]:
+    """
+    Делит total между секциями пропорционально весам; секции, которым
+    нужно меньше своей доли, получают сколько нужно, остаток делится дальше.
+    """
+    budget = {name: 0 for name in needs}
+    active = {name for name, need in needs.items() if need > 0}
+    remaining = total
+    while active and remaining > 0:
+        weight_sum = sum(weights.get(n, 1.0) for n in active)
+        shares = {n: remaining * weights.get(n, 1.0) / weight_sum for n in active}
+        satisfied = {n for n in active if needs[n] <= shares[n]}
+        if not satisfied:
+            for n in active:
+                budget[n] = int(shares[n])
+            break
+        for n in satisfied:
+            budget[n] = needs[n]
+            remaining -= needs[n]
+        active -= satisfied
+    return budget
+
+
+class ContextBudgeter:
+    def __init__(
+        self,
+        max_tokens: Optional[int] = None,
+        dedup_threshold: Optional[float] = None,
+        min_partial_tokens: int = 32,
+    ) -> None:
+        self.max_tokens = max_tokens or settings.PROMPT_TOKEN_BUDGET
+        self.dedup_threshold = dedup_threshold or settings.CONTEXT_DEDUP_THRESHOLD
+        self.min_partial_tokens = min_partial_tokens
+        self.stats = BudgetStats()
+
+    def _fill(self, chunks: List[_Chunk], budget: int) -> str:
+        chosen: List[_Chunk] = []
+        left = budget
+        for chunk in sorted(chunks, key=lambda c: -c.score):
+            if chunk.tokens <= left:
+                chosen.append(chunk)
+                left -= chunk.tokens
+            elif left >= self.min_partial_tokens or not chosen:
+                # самый релевантный из не влезших — частично
+                chosen.append(_Chunk(truncate_tokens(chunk.text, left), chunk.score, left, chunk.position))
+                break
+        return "\n\n".join(c.text for c in sorted(chosen, key=lambda c: c.position) if c.text)
+
+    def fit(
+        self,
+        sections: Mapping[str, SectionInput],
+        weights: Optional[Mapping[str, float]] = None,
+        max_tokens: Optional[int] = None,
+        name: str = "prompt",
+    ) -> Dict[str, str]:
+        """Возвращает секции, суммарно укладывающиеся в max_tokens."""
+        total = self.max_tokens if max_tokens is None else max_tokens
+        weights = weights or {}
+
+        parsed: Dict[str, List[_Chunk]] = {}
+        tokens_in = duplicates = 0
+        # дубликаты ищем и между секциями: ранние секции приоритетнее
+        seen: List[np.ndarray] = []
+        for section, value in sections.items():
+            chunks = _as_chunks(value)
+            tokens_in += sum(c.tokens for c in chunks)
+            kept = dedupe_chunks([c.text for c in chunks], self.dedup_threshold, seen)
+            duplicates += len(chunks) - len(kept)
+            parsed[section] = [chunks[i] for i in kept]
+
+        needs = {s: sum(c.tokens for c in chunks) for s, chunks in parsed.items()}
+        budget = allocate(needs, weights, max(total, 0))
+        fitted = {s: self._fill(chunks, budget[s]) for s, chunks in parsed.items()}
+
+        tokens_out = sum(count_tokens(t) for t in fitted.values())
+        self.stats.calls += 1
+        self.stats.tokens_in += tokens_in
+        self.stats.tokens_out += tokens_out
+        self.stats.duplicates += duplicates
+        if tokens_in > tokens_out:
+            print(
+                f"✂️ {name}: context {tokens_in} -> {tokens_out} tokens "
+                f"(saved {tokens_in - tokens_out}, {duplicates} duplicates)"
+            )
+        return fitted
+
+    def fit_prompt(
+        self,
+        template: PromptTemplate,
+        inputs: Mapping[str, SectionInput],
+        sections: Sequence[str],
+        weights: Optional[Mapping[str, float]] = None,
+        name: str = "prompt",
+    ) -> str:
+        """
+        Форматирует шаблон так, чтобы весь промпт уложился в бюджет:
+        секциям достаётся бюджет минус «скелет» шаблона и прочие поля.
+        """
+        fixed = {k: v for k, v in inputs.items() if k not in sections}
+        skeleton = count_tokens(template.format(**fixed, **{s: "" for s in sections}))
+        fitted = self.fit(
+            {s: inputs.get(s, "") for s in sections},
+            weights=weights,
+            max_tokens=self.max_tokens - skeleton,
+            name=name,
+        )
+        return template.format(**fixed, **{s: fitted[s] or "n/a" for s in sections})
+
+
+_budgeter: Optional[ContextBudgeter] = None
+
+
+def get_budgeter() -> ContextBudgeter:
+    """Общий на процесс бюджетировщик (накапливает статистику)."""
+    global _budgeter
+    if _budgeter is None:
+        _budgeter = ContextBudgeter()
+    return _budgeter
@@ -1,43 +1,59 @@
 from __future__ import annotations
 
 import asyncio
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 
-from crewai import Task, Crew, Process
+from crewai import Task
 from langchain_core.documents import Document
 
-from .agents import build_agents
-from .data_prep import build_multimodal_sample
-from .visualization import generate_price_plot
-from .rag_kg import build_vector_store, build_knowledge_graph
-from .evaluation import build_evaluation_chain
+from .agents import fresh_agent, get_agents
+from .chains import FundamentalAnalysis, RiskAssessment, TechnicalAnalysis
+from .data_prep import MultimodalSample, collect_multimodal_samples
+from .market_data import MarketDataCollector
+from .visualization import render_charts
+from .rag_kg import build_knowledge_graph, build_vector_store, load_pdf_documents
+from .config import settings
+from .dag_scheduler import DagExecutor, NodeResult, TaskNode, timing_report
+from .indicators import format_summary, persistent_summary
+from .context_budget import count_tokens, get_budgeter
+from .streaming import node_stage, stage
+from .structured_output import compact, get_structured, schema_hint
+
+
+INDICATOR_STATE_PATH = settings.DATA_DIR / "indicator_state.npz"
 
 
 # =========================
 # 1. ПАРАЛЛЕЛЬНЫЙ СБОР ДАННЫХ
 # =========================
 
-async def run_data_stage(ticker: str) -> Dict[str, Any]:
+async def run_data_stage(ticker: str, sample: MultimodalSample, img_path: str = "") -> Dict[str, Any]:
     """
-    Асинхронно собирает мультимодальные данные для одного тикера.
+    Пост-обработка уже собранных данных для одного тикера
+    (график цен рисуется заранее, батчем — см. parallel_data_collection).
     """
-    try:
-        sample = await build_multimodal_sample(ticker)
-        img_path = generate_price_plot(ticker, sample.price_table)
-        return {
-            "ticker": ticker,
-            "sample": sample,
-            "image_path": img_path,
-        }
-    except Exception as e:
-        return {"ticker": ticker, "error": str(e)}
+    return {
+        "ticker": ticker,
+        "sample": sample,
+        "image_path": img_path,
+    }
 
 
-async def parallel_data_collection(tickers: List[str]) -> List[Dict[str, Any]]:
+async def parallel_data_collection(
+    tickers: List[str],
+    collector: Optional[MarketDataCollector] = None,
+) -> List[Dict[str, Any]]:
     """
-    Запускает сбор данных по всем тикерам параллельно.
+    Собирает данные по всем тикерам параллельно (с rate limit провайдера),
+    затем строит графики.
     """
-    tasks = [run_data_stage(t) for t in tickers]
+    samples = await collect_multimodal_samples(tickers, collector)
+    # графики — одним батчем вне цикла событий (крупный батч — в пуле процессов)
+    charts, stats = await asyncio.to_thread(
+        render_charts, {t: s.price_table for t, s in samples.items()}
+    )
+    print(f"📈 {stats.report()}")
+    tasks = [run_data_stage(t, samples[t], charts.get(t, "")) for t in samples]
     return await asyncio.gather(*tasks)
 
 
@@ -45,12 +61,29 @@ async def parallel_data_collection(tickers: List[str]) -> List[Dict[str, Any]]:
 # 2. PREPARE DOCS ДЛЯ RAG
 # =========================
 
-def prepare_docs(samples: List[Dict[str, Any]]) -> List[Document]:
+def compute_technical_summary(samples: List[Dict[str, Any]]) -> Dict[str, Dict[str, float]]:
+    """
+    Индикаторы по всем тикерам сразу. Состояние индикаторов хранится
+    между запусками, поэтому пересчитываются только новые бары;
+    fallback-данные в состояние не пишутся (persistent_summary).
+    """
+    items = [item for item in samples if "error" not in item]
+    frames = {item["ticker"]: item["sample"].price_table for item in items}
+    synthetic = [item["ticker"] for item in items if item["sample"].synthetic]
+    return persistent_summary(frames, INDICATOR_STATE_PATH, stateless=synthetic)
+
+
+def prepare_docs(
+    samples: List[Dict[str, Any]],
+    summary: Optional[Dict[str, Dict[str, float]]] = None,
+) -> List[Document]:
     """
     Превращаем таблицы цен, новости и текстовые описания в список Document.
     Параллельно строим векторное хранилище и граф знаний (для отчёта).
     """
     docs: List[Document] = []
+    if summary is None:
+        summary = compute_technical_summary(samples)
 
     for item in samples:
         if "error" in item:
@@ -69,6 +102,18 @@ def prepare_docs(samples: List[Dict[str, Any]]) -> List[Document]:
             )
         )
 
+        # 1.1) Сводка технических индикаторов
+        if ticker in summary:
+            docs.append(
+                Document(
+                    page_content=(
+                        f"Technical indicators for {ticker}:\n"
+                        f"{format_summary({ticker: summary[ticker]})}"
+                    ),
+                    metadata={"ticker": ticker, "source": "technical_indicators"},
+                )
+            )
+
         # 2) Новости
         for news in sample.news_texts:
             docs.append(
@@ -88,137 +133,264 @@ def prepare_docs(samples: List[Dict[str, Any]]) -> List[Document]:
 
     # Строим RAG-структуры (как часть пайплайна; возвращаем docs)
     if docs:
-        _vs = build_vector_store(docs)
-        _kg = build_knowledge_graph(docs)
-        # Мы их не обязательно используем напрямую в коде агентов,
-        # но они существуют как компонент системы для отчёта по проекту.
+        pdf_docs = load_pdf_documents(docs)
+        _vs = build_vector_store(docs, pdf_docs)
+        # граф знаний сохраняется на диск; агенты получают из него
+        # k-hop окружение тикера (knowledge_graph_contexts); чанки PDF
+        # привязываются к своему тикеру
+        build_knowledge_graph(docs + pdf_docs, summary)
 
     return docs
 
 
 # =========================
-# 3. СБОРКА CREW (БЕЗ ИЕРАРХИИ/MCP)
+# 3. DAG ПО ТИКЕРАМ (ПАРАЛЛЕЛЬНОЕ ИСПОЛНЕНИЕ)
 # =========================
 
-def build_crew(tickers: List[str]) -> Crew:
+def _crew_node(agent, description: str, expected_output: str):
     """
-    Создаём Crew с несколькими агентами.
-    Без hierarchical process, без manager_agent, чтобы НЕ было MCP-делегирования
-    и ошибок Delegate/AskQuestion.
+    Узел DAG, исполняющий одну crewai-задачу. Результаты зависимостей
+    передаются агенту как context, ужатый до бюджета токенов промпта.
     """
-    agents = build_agents()
-    eval_chain = build_evaluation_chain()
-
-    tickers_str = ", ".join(tickers)
-
-    # --- ЗАДАЧИ ---
-
-    # 1) Технический анализ
-    technical_task = Task(
-        description=(
-            f"Perform technical analysis for tickers: {tickers_str}.\n"
-            "- Используй информацию о трендах, волатильности и уровнях\n"
-            "- Опиши краткосрочный и долгосрочный тренд\n"
-            "- Сформируй технический вердикт по каждому тикеру"
-        ),
-        agent=agents["technical"],
-        expected_output=(
-            "JSON-like текст с полями: ticker, trend, key_levels, "
-            "volatility_comment, technical_view."
-        ),
-    )
+    def run(inputs: Dict[str, Any]) -> str:
+        budget = settings.PROMPT_TOKEN_BUDGET - count_tokens(description) - count_tokens(expected_output)
+        fitted = get_budgeter().fit(
+            {name: compact(output) for name, output in inputs.items()},
+            max_tokens=budget,
+            name=agent.role,
+        )
+        context = "\n\n".join(f"[{name}]\n{text}" for name, text in fitted.items() if text)
+        # своя копия агента на исполнение: crewai хранит в Agent состояние
+        # выполнения, а узлы DAG идут параллельно в разных потоках
+        runner = fresh_agent(agent)
+        task = Task(description=description, expected_output=expected_output, agent=runner)
+        return task.execute_sync(agent=runner, context=context or None).raw
 
-    # 2) Фундаментальный анализ
-    fundamental_task = Task(
-        description=(
-            f"Perform fundamental analysis for tickers: {tickers_str}.\n"
-            "- Оцени бизнес-модель, новости, отрасль\n"
-            "- Выдели драйверы роста и основные риски\n"
-            "- Сформируй фундаментальный вердикт и горизонт инвестиций"
-        ),
-        agent=agents["fundamental"],
-        expected_output=(
-            "Структурированный текст, по каждому тикеру: "
-            "business_summary, growth_drivers, key_risks, fundamental_view."
-        ),
-    )
+    return run
 
-    # 3) Оценка рисков (зависит от двух предыдущих)
-    risk_task = Task(
-        description=(
-            f"Combine technical and fundamental insights into a unified risk view for: {tickers_str}.\n"
-            "- Сопоставь технические сигналы и фундаментальные факторы\n"
-            "- Оцени общий риск-профиль (низкий/средний/высокий)\n"
-            "- Выдели отдельные риски для каждого тикера"
-        ),
-        agent=agents["risk"],
-        expected_output=(
-            "Структурированный текст с полями: ticker, risk_level, "
-            "risk_factors, upside_comment."
-        ),
-        depends_on=[technical_task, fundamental_task],
-    )
 
-    # 4) Финальный инвестиционный отчёт
-    report_task = Task(
-        description=(
-            f"Write a final investment report for tickers: {tickers_str}.\n"
+def _final_report_node(agent, tickers: List[str]):
+    """
+    Общий отчёт по тикерам, чьи разделы готовы; тикеры с упавшими
+    разделами перечисляются в самом отчёте.
+    """
+    def run(inputs: Dict[str, Any]) -> str:
+        done = [t for t in tickers if f"{t}:report" in inputs]
+        failed = [t for t in tickers if t not in done]
+        description = (
+            f"Write a final investment report for tickers: {', '.join(done)}.\n"
             "Структура отчёта:\n"
             "1. Introduction (goal, data sources, period)\n"
             "2. Market overview (very short)\n"
-            "3. Company-by-company analysis (technical + fundamental)\n"
+            "3. Company-by-company analysis (используй готовые разделы из контекста)\n"
             "4. Risk assessment\n"
             "5. Final recommendations (Buy/Hold/Sell with horizon)\n"
             "Пиши в виде аккуратного Markdown-отчёта."
-        ),
-        agent=agents["report"],
-        expected_output="Полный Markdown-отчёт.",
-        depends_on=[risk_task],
-    )
+        )
+        if failed:
+            description += (
+                f"\nAnalysis failed for: {', '.join(failed)}. "
+                "Mention this in the introduction and do not make recommendations for them."
+            )
+        report = _crew_node(agent, description, "Полный Markdown-отчёт.")(inputs)
+        if failed:
+            report += f"\n\n> ⚠️ Not covered (analysis failed): {', '.join(failed)}\n"
+        return report
+
+    return run
+
+
+def _structured_node(agent, description: str, schema, ticker: str):
+    """
+    Узел DAG со структурированным ответом: объект схемы вместо прозы
+    (см. structured_output). Зависимости приходят компактным JSON.
+    """
+    def run(inputs: Dict[str, Any]):
+        budget = (
+            settings.PROMPT_TOKEN_BUDGET - count_tokens(description) - count_tokens(schema_hint(schema))
+        )
+        fitted = get_budgeter().fit(
+            {name: compact(output) for name, output in inputs.items()},
+            max_tokens=budget,
+            name=agent.role,
+        )
+        context = "\n\n".join(f"[{name}]\n{text}" for name, text in fitted.items() if text)
+        prompt = f"You are a {agent.role}. {agent.goal}\n\n{description}"
+        if context:
+            prompt += f"\n\nContext from previous stages:\n{context}"
+        return get_structured(agent.llm).generate(schema, prompt, known={"ticker": ticker})
 
-    # 5) Оценка качества отчёта
-    evaluation_task = Task(
-        description=(
-            "Evaluate the quality of the final investment report.\n"
-            "- Проверь глубину анализа\n"
-            "- Логичность структуры\n"
-            "- Отражение рисков\n"
-            "- Полезность для частного инвестора\n"
-            "Верни краткое заключение и список замечаний/улучшений."
+    return run
+
+
+def _stage_node(agent, description: str, expected_output: str, schema, ticker: str):
+    if settings.STRUCTURED_OUTPUT:
+        return _structured_node(agent, description, schema, ticker)
+    return _crew_node(agent, description, expected_output)
+
+
+def build_ticker_graph(
+    ticker: str,
+    agents: dict,
+    technical_context: str = "",
+    graph_context: str = "",
+    rag_context: Optional[Dict[str, str]] = None,
+) -> List[TaskNode]:
+    """
+    Граф одного тикера: technical ∥ fundamental -> risk -> report.
+    graph_context — связи тикера из графа знаний (сектор, новости, события);
+    rag_context — qtype -> документы тикера из RAG (chains.rag_contexts).
+    """
+    # по строке на ребро; ближние связи идут первыми и приоритетнее
+    graph_context = get_budgeter().fit(
+        {"graph": graph_context.splitlines()},
+        max_tokens=settings.PROMPT_TOKEN_BUDGET // 4,
+        name=f"{ticker}:graph",
+    )["graph"]
+    # чанки уже отранжированы ретривером — лучшие первыми
+    documents = {
+        qtype: get_budgeter().fit(
+            {"documents": text.split("\n\n") if text else []},
+            max_tokens=settings.PROMPT_TOKEN_BUDGET // 4,
+            name=f"{ticker}:{qtype}:documents",
+        )["documents"]
+        for qtype, text in (rag_context or {}).items()
+    }
+    return [
+        TaskNode(
+            f"{ticker}:technical",
+            _stage_node(
+                agents["technical"],
+                f"Perform technical analysis for {ticker}.\n"
+                "- Опиши краткосрочный и долгосрочный тренд, волатильность и уровни\n"
+                "- Сформируй технический вердикт\n"
+                "Рассчитанные индикаторы (последний бар):\n"
+                f"{technical_context or 'n/a'}",
+                "JSON-like текст с полями: ticker, trend, key_levels, "
+                "volatility_comment, technical_view.",
+                TechnicalAnalysis,
+                ticker,
+            ),
         ),
-        agent=agents["evaluator"],
-        expected_output=(
-            "JSON-like текст с полями: depth_score (1-10), "
-            "consistency_score (1-10), risk_coverage_score (1-10), "
-            "usefulness_score (1-10), comments."
+        TaskNode(
+            f"{ticker}:fundamental",
+            _stage_node(
+                agents["fundamental"],
+                f"Perform fundamental analysis for {ticker}.\n"
+                "- Оцени бизнес-модель, новости, отрасль\n"
+                "- Выдели драйверы роста и основные риски\n"
+                "- Сформируй фундаментальный вердикт и горизонт инвестиций\n"
+                "Связи из графа знаний:\n"
+                f"{graph_context or 'n/a'}\n"
+                "Документы по тикеру (новости, публикации):\n"
+                f"{documents.get('fundamental') or 'n/a'}",
+                "Структурированный текст: business_summary, growth_drivers, "
+                "key_risks, fundamental_view.",
+                FundamentalAnalysis,
+                ticker,
+            ),
         ),
-        depends_on=[report_task],
-    )
+        TaskNode(
+            f"{ticker}:risk",
+            _stage_node(
+                agents["risk"],
+                f"Combine technical and fundamental insights into a risk view for {ticker}.\n"
+                "- Оцени риск-профиль (низкий/средний/высокий) и отдельные риски\n"
+                "Связи из графа знаний (события, новости):\n"
+                f"{graph_context or 'n/a'}\n"
+                "Документы по тикеру (риски, новости):\n"
+                f"{documents.get('risk') or 'n/a'}",
+                "Структурированный текст с полями: ticker, risk_level, "
+                "risk_factors, upside_comment.",
+                RiskAssessment,
+                ticker,
+            ),
+            depends_on=[f"{ticker}:technical", f"{ticker}:fundamental"],
+        ),
+        TaskNode(
+            f"{ticker}:report",
+            _crew_node(
+                agents["report"],
+                f"Write the company section of the investment report for {ticker}: "
+                "technical + fundamental summary, risks and a Buy/Hold/Sell "
+                "recommendation with horizon. Markdown.",
+                "Markdown-раздел отчёта по тикеру.",
+            ),
+            # компактные объекты всех стадий дешевле, чем один прозаический risk
+            depends_on=(
+                [f"{ticker}:technical", f"{ticker}:fundamental", f"{ticker}:risk"]
+                if settings.STRUCTURED_OUTPUT
+                else [f"{ticker}:risk"]
+            ),
+        ),
+    ]
 
-    # --- CREW ---
 
-    crew = Crew(
-        agents=[
-            agents["data"],
-            agents["technical"],
-            agents["fundamental"],
-            agents["risk"],
-            agents["report"],
+def build_analysis_dag(
+    tickers: List[str],
+    technical_contexts: Dict[str, str],
+    graph_contexts: Optional[Dict[str, str]] = None,
+    rag_contexts: Optional[Dict[str, Dict[str, str]]] = None,
+) -> List[TaskNode]:
+    """
+    Графы всех тикеров + общий финальный отчёт и его оценка.
+    """
+    agents = get_agents()
+    graph_contexts = graph_contexts or {}
+    rag_contexts = rag_contexts or {}
+    nodes: List[TaskNode] = []
+    for t in tickers:
+        nodes += build_ticker_graph(
+            t, agents, technical_contexts.get(t, ""), graph_contexts.get(t, ""), rag_contexts.get(t)
+        )
+
+    # partial: упавший тикер не отменяет общий отчёт по остальным
+    nodes.append(TaskNode(
+        "report",
+        _final_report_node(agents["report"], tickers),
+        depends_on=[f"{t}:report" for t in tickers],
+        partial=True,
+    ))
+    nodes.append(TaskNode(
+        "evaluation",
+        _crew_node(
             agents["evaluator"],
-        ],
-        tasks=[
-            technical_task,
-            fundamental_task,
-            risk_task,
-            report_task,
-            evaluation_task,
-        ],
-        process=Process.sequential,  # ❗ НЕТ hierarchical -> НЕТ MCP-делегирования
-        verbose=True,
-    )
+            "Evaluate the quality of the final investment report: depth, structure, "
+            "risk coverage, usefulness for a private investor.",
+            "JSON-like текст с полями: depth_score (1-10), consistency_score (1-10), "
+            "risk_coverage_score (1-10), usefulness_score (1-10), comments.",
+        ),
+        depends_on=["report"],
+    ))
+    return nodes
+
+
+def _streamed(node: TaskNode) -> TaskNode:
+    """Токены LLM узла помечаются его стадией ("AAPL:technical" -> technical/AAPL)."""
+    fn = node.fn
+
+    def run(inputs: Dict[str, Any]):
+        with stage(*node_stage(node.name)):
+            return fn(inputs)
 
-    # "приклеим" eval_chain, если ты его потом используешь
-    crew._eval_chain = eval_chain
-    crew._tickers = tickers
+    node.fn = run
+    return node
 
-    return crew
\ No newline at end of file
+
+async def run_analysis_dag(
+    tickers: List[str],
+    technical_contexts: Dict[str, str],
+    graph_contexts: Optional[Dict[str, str]] = None,
+    rag_contexts: Optional[Dict[str, Dict[str, str]]] = None,
+    max_llm_concurrency: Optional[int] = None,
+) -> Dict[str, NodeResult]:
+    """
+    Запускает DAG анализа; время ≈ критический путь, а не сумма всех задач.
+    """
+    nodes = [
+        _streamed(n)
+        for n in build_analysis_dag(tickers, technical_contexts, graph_contexts, rag_contexts)
+    ]
+    results = await DagExecutor(max_llm_concurrency).run(nodes)
+    print(f"⏱️ {timing_report(nodes, results)}")
+    return results
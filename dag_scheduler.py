@@ -0,0 +1,199 @@
+# dag_scheduler.py
+
+"""
+Асинхронный исполнитель DAG задач.
+
+Узел запускается, как только готовы все его зависимости, поэтому
+независимые задачи (технический ∥ фундаментальный анализ, разные тикеры)
+идут параллельно. Общий семафор ограничивает число одновременных
+LLM-вызовов, так что локальная модель не перегружается.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import functools
+import inspect
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+from .config import settings
+
+
+@dataclass
+class TaskNode:
+    """
+    fn получает словарь {имя зависимости: её результат}.
+    uses_llm=True — узел занимает слот общего LLM-семафора.
+    partial=True — узел идёт, если успешна хотя бы одна зависимость;
+    упавшие в словарь не попадают.
+    """
+    name: str
+    fn: Callable[[Dict[str, Any]], Any]
+    depends_on: List[str] = field(default_factory=list)
+    uses_llm: bool = True
+    partial: bool = False
+
+
+@dataclass
+class NodeResult:
+    name: str
+    output: Any = None
+    error: Optional[str] = None
+    started: float = 0.0
+    finished: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    @property
+    def duration(self) -> float:
+        return self.finished - self.started
+
+
+def topological_order(nodes: List[TaskNode]) -> List[str]:
+    """Порядок Кана; заодно проверяет, что граф ацикличен и полон."""
+    by_name = {n.name: n for n in nodes}
+    if len(by_name) != len(nodes):
+        raise ValueError("duplicate node names in DAG")
+    for n in nodes:
+        missing = [d for d in n.depends_on if d not in by_name]
+        if missing:
+            raise ValueError(f"node {n.name} depends on unknown nodes: {missing}")
+
+    indegree = {n.name: len(n.depends_on) for n in nodes}
+    children: Dict[str, List[str]] = {n.name: [] for n in nodes}
+    for n in nodes:
+        for d in n.depends_on:
+            children[d].append(n.name)
+
+    ready = [name for name, deg in indegree.items() if deg == 0]
+    order = []
+    while ready:
+        name = ready.pop()
+        order.append(name)
+        for child in children[name]:
+            indegree[child] -= 1
+            if indegree[child] == 0:
+                ready.append(child)
+
+    if len(order) != len(nodes):
+        raise ValueError("DAG contains a cycle")
+    return order
+
+
+def critical_path(nodes: List[TaskNode], durations: Dict[str, float]) -> float:
+    """Длина самого длинного пути по фактическим длительностям узлов."""
+    by_name = {n.name: n for n in nodes}
+    finish: Dict[str, float] = {}
+    for name in topological_order(nodes):
+        deps = by_name[name].depends_on
+        finish[name] = max((finish[d] for d in deps), default=0.0) + durations.get(name, 0.0)
+    return max(finish.values(), default=0.0)
+
+
+class DagExecutor:
+    def __init__(self, max_llm_concurrency: Optional[int] = None) -> None:
+        self.max_llm_concurrency = max_llm_concurrency or settings.LLM_MAX_CONCURRENCY
+
+    async def _call(self, node: TaskNode, inputs: Dict[str, Any], pool: ThreadPoolExecutor) -> Any:
+        if inspect.iscoroutinefunction(node.fn):
+            return await node.fn(inputs)
+        # блокирующие вызовы (crewai, LLM) уходят в собственный пул потоков:
+        # дефолтный пул asyncio на малом числе CPU меньше числа LLM-слотов
+        ctx = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(
+            pool, functools.partial(ctx.run, node.fn, inputs)
+        )
+
+    async def run(self, nodes: List[TaskNode]) -> Dict[str, NodeResult]:
+        topological_order(nodes)
+        # примитивы создаём на каждый запуск, чтобы не привязываться к event loop
+        llm_slots = asyncio.Semaphore(self.max_llm_concurrency)
+        done: Dict[str, asyncio.Future] = {
+            n.name: asyncio.get_running_loop().create_future() for n in nodes
+        }
+        results: Dict[str, NodeResult] = {}
+        origin = time.perf_counter()
+
+        async def run_node(node: TaskNode) -> None:
+            result = NodeResult(name=node.name)
+            try:
+                deps = [await done[d] for d in node.depends_on]
+                failed = [r.name for r in deps if not r.ok]
+                if failed and (not node.partial or len(failed) == len(deps)):
+                    result.error = f"skipped: upstream failed ({', '.join(failed)})"
+                else:
+                    inputs = {r.name: r.output for r in deps if r.ok}
+                    if node.uses_llm:
+                        async with llm_slots:
+                            result.started = time.perf_counter() - origin
+                            result.output = await self._call(node, inputs, pool)
+                    else:
+                        result.started = time.perf_counter() - origin
+                        result.output = await self._call(node, inputs, pool)
+            except Exception as e:
+                result.error = f"{type(e).__name__}: {e}"
+            finally:
+                if not result.started:
+                    result.started = time.perf_counter() - origin
+                result.finished = time.perf_counter() - origin
+                results[node.name] = result
+                done[node.name].set_result(result)
+
+        pool = ThreadPoolExecutor(max_workers=self.max_llm_concurrency + 4)
+        try:
+            await asyncio.gather(*(run_node(n) for n in nodes))
+        except BaseException:
+            # отмена запуска: не ждём идущие вызовы, ещё не начатые снимаем с очереди
+            pool.shutdown(wait=False, cancel_futures=True)
+            raise
+        pool.shutdown()
+        return results
+
+
+def timing_report(nodes: List[TaskNode], results: Dict[str, NodeResult]) -> str:
+    durations = {name: r.duration for name, r in results.items()}
+    wall = max((r.finished for r in results.values()), default=0.0)
+    return (
+        f"DAG: {len(nodes)} nodes, wall {wall:.2f}s, "
+        f"sum of tasks {sum(durations.values()):.2f}s, "
+        f"critical path {critical_path(nodes, durations):.2f}s, "
+        f"failed {sum(1 for r in results.values() if not r.ok)}"
+    )
+
+
+# ============================
+# Бенчмарк со stub-LLM
+# ============================
+
+def _stub_llm(latency: float) -> Callable[[Dict[str, Any]], str]:
+    def call(inputs: Dict[str, Any]) -> str:
+        time.sleep(latency)
+        return f"stub output from {len(inputs)} inputs"
+    return call
+
+
+def _benchmark(n_tickers: int = 10, latency: float = 0.2, llm_slots: int = 8) -> None:
+    nodes: List[TaskNode] = []
+    for i in range(n_tickers):
+        t = f"T{i:02d}"
+        nodes += [
+            TaskNode(f"{t}:technical", _stub_llm(latency)),
+            TaskNode(f"{t}:fundamental", _stub_llm(latency)),
+            TaskNode(f"{t}:risk", _stub_llm(latency), [f"{t}:technical", f"{t}:fundamental"]),
+            TaskNode(f"{t}:report", _stub_llm(latency), [f"{t}:risk"]),
+        ]
+    nodes.append(TaskNode("report", _stub_llm(latency), [n.name for n in nodes if n.name.endswith(":report")]))
+
+    for slots in (1, llm_slots):
+        results = asyncio.run(DagExecutor(max_llm_concurrency=slots).run(nodes))
+        print(f"llm slots={slots}: {timing_report(nodes, results)}")
+
+
+if __name__ == "__main__":
+    _benchmark()
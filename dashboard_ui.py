@@ -0,0 +1,215 @@
+# dashboard_ui.py
+
+"""
+Страница дашборда — общая для Flask (web_app.py) и ASGI (asgi_app.py)
+режимов, чтобы ASGI-сервер не импортировал Flask.
+"""
+
+from __future__ import annotations
+
+import html
+from typing import Iterable
+
+
+HTML = """
+<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="utf-8">
+    <title>Intelligent Financial Agent Platform</title>
+    <style>
+        body {
+            background: #0f172a;          /* тёмно-синий */
+            color: #f1f5f9;               /* светлый текст */
+            font-family: monospace;
+            padding: 20px;
+        }
+        pre {
+            background: #020617;
+            padding: 20px;
+            border-radius: 12px;
+            white-space: pre-wrap;
+            font-size: 13px;
+            height: 600px;
+            overflow-y: scroll;
+            border: 2px solid #22c55e;    /* зелёный акцент */
+        }
+        h1 {
+            color: #22c55e;               /* зелёный заголовок */
+        }
+        .buttons {
+            margin-bottom: 20px;
+        }
+        button, a {
+            background: #22c55e;          /* зелёные кнопки */
+            color: #020617;               /* тёмный текст */
+            border: none;
+            padding: 10px 22px;
+            margin-right: 12px;
+            text-decoration: none;
+            border-radius: 10px;
+            font-weight: bold;
+            cursor: pointer;
+            transition: 0.2s;
+        }
+        button:hover, a:hover {
+            background: #16a34a;          /* тёмно-зелёный hover */
+        }
+        #history td {
+            padding: 6px 10px;
+        }
+        #history a {
+            padding: 4px 10px;
+        }
+        #panels {
+            display: grid;
+            grid-template-columns: repeat(auto-fill, minmax(420px, 1fr));
+            gap: 12px;
+            margin-bottom: 20px;
+        }
+        #panels pre {
+            height: 220px;
+            margin: 0;
+        }
+        #panels h3 {
+            margin: 0 0 6px 0;
+            color: #22c55e;
+        }
+    </style>
+</head>
+<body>
+
+    <h1>Intelligent Financial Multi-Agent Dashboard</h1>
+
+    <div class="buttons">
+        <input id="tickers" value="{{ tickers }}">
+        <button onclick="startJob()">Run Pipeline</button>
+        <button onclick="cancelJob()">Cancel</button>
+        <a id="download_md" href="/download_md" target="_blank">Download Markdown</a>
+        <a id="download_pdf" href="/download_pdf" target="_blank">Download PDF</a>
+        <span id="status"></span>
+    </div>
+
+    <div id="panels"></div>
+
+    <pre id="output"></pre>
+
+    <h2>History</h2>
+    <div class="buttons">
+        <input id="history_ticker" placeholder="ticker">
+        <button onclick="loadHistory()">Refresh</button>
+        <button onclick="diffSelected()">Diff selected</button>
+    </div>
+    <table id="history"></table>
+    <pre id="diff"></pre>
+
+    <script>
+        let evtSource = null;
+        let currentJob = null;
+        let panels = {};
+
+        // панель на стадию (ticker · task): токены дописываются по мере генерации
+        function panelFor(token) {
+            const key = (token.ticker ? token.ticker + " · " : "") + token.task;
+            if (!panels[key]) {
+                const box = document.createElement("div");
+                const title = document.createElement("h3");
+                const body = document.createElement("pre");
+                title.textContent = key + " …";
+                box.append(title, body);
+                document.getElementById("panels").append(box);
+                panels[key] = {key, title, body};
+            }
+            return panels[key];
+        }
+
+        function watch(jobId) {
+            if (evtSource) evtSource.close();
+            currentJob = jobId;
+            history.replaceState(null, "", "/?job=" + jobId);
+            document.getElementById("output").textContent = "";
+            document.getElementById("panels").innerHTML = "";
+            panels = {};
+            document.getElementById("download_md").href = "/jobs/" + jobId + "/download_md";
+            document.getElementById("download_pdf").href = "/jobs/" + jobId + "/download_pdf";
+            // при обрыве EventSource переподключается сам и шлёт Last-Event-ID
+            evtSource = new EventSource("/jobs/" + jobId + "/stream");
+            evtSource.onmessage = function(event) {
+                document.getElementById("output").textContent += event.data + "\\n";
+            };
+            evtSource.addEventListener("token", function(event) {
+                const token = JSON.parse(event.data);
+                const panel = panelFor(token);
+                panel.body.textContent += token.text;
+                panel.body.scrollTop = panel.body.scrollHeight;
+                if (token.done) panel.title.textContent = panel.key + " ✓";
+            });
+            evtSource.addEventListener("done", function(event) {
+                document.getElementById("status").textContent = event.data;
+                evtSource.close();
+                loadHistory();
+            });
+        }
+
+        async function startJob() {
+            const resp = await fetch("/jobs", {
+                method: "POST",
+                headers: {"Content-Type": "application/json"},
+                body: JSON.stringify({tickers: document.getElementById("tickers").value}),
+            });
+            const job = await resp.json();
+            document.getElementById("status").textContent =
+                job.created ? "started " + job.id : "joined running " + job.id;
+            watch(job.id);
+        }
+
+        async function loadHistory() {
+            const ticker = document.getElementById("history_ticker").value.trim();
+            const resp = await fetch("/reports?limit=20" + (ticker ? "&ticker=" + encodeURIComponent(ticker) : ""));
+            const rows = await resp.json();
+            const table = document.getElementById("history");
+            table.replaceChildren();
+            // только textContent и свойства элементов: поля отчёта не разбираются как HTML
+            for (const r of rows) {
+                const tr = table.insertRow();
+                const box = document.createElement("input");
+                box.type = "checkbox";
+                box.value = r.run_id;
+                tr.insertCell().append(box);
+                tr.insertCell().textContent = r.created_iso;
+                tr.insertCell().textContent = r.tickers.join(", ");
+                const links = tr.insertCell();
+                for (const [label, suffix] of [["md", ""], ["pdf", "/pdf"]]) {
+                    const a = document.createElement("a");
+                    a.href = "/reports/" + encodeURIComponent(r.run_id) + suffix;
+                    a.textContent = label;
+                    links.append(a, " ");
+                }
+            }
+        }
+
+        async function diffSelected() {
+            const ids = [...document.querySelectorAll("#history input:checked")].map(e => e.value);
+            if (ids.length !== 2) { alert("select two reports"); return; }
+            // список идёт от новых к старым: старый отчёт — второй
+            const resp = await fetch("/reports/diff?a=" + encodeURIComponent(ids[1]) + "&b=" + encodeURIComponent(ids[0]));
+            document.getElementById("diff").textContent = resp.ok ? await resp.text() : "diff unavailable";
+        }
+
+        async function cancelJob() {
+            if (!currentJob) return;
+            await fetch("/jobs/" + currentJob, {method: "DELETE"});
+        }
+
+        loadHistory();
+        const current = new URLSearchParams(location.search).get("job");
+        if (current) { watch(current); } else { startJob(); }
+    </script>
+
+</body>
+</html>
+"""
+
+
+def render_index(tickers: Iterable[str]) -> str:
+    return HTML.replace("{{ tickers }}", html.escape(",".join(tickers), quote=True))
@@ -1,34 +1,76 @@
-import time
+import asyncio
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
 import pandas as pd
-import yfinance as yf
 
 from .config import settings
+from .market_data import MarketDataCollector, YFinanceProvider, fetch_prices_batch
+from .price_cache import CachedPriceProvider, PriceCache
+
+
+@dataclass
+class MultimodalSample:
+    ticker: str
+    price_table: pd.DataFrame
+    news_texts: List[str]
+    image_caption: str
+    # синтетические бары fallback_prices (штамп «сейчас»): в персистентное
+    # состояние индикаторов не попадают
+    synthetic: bool = False
+
+
+def fallback_prices(ticker: str, reason: str) -> pd.DataFrame:
+    print(f"⚠️ Using fallback data for {ticker}: {reason}")
+    dates = pd.date_range(end=pd.Timestamp.today(), periods=180)
+    prices = pd.Series(range(180)) + 100
+    return pd.DataFrame({"Adj Close": prices.values}, index=dates)
 
 
 def safe_download(ticker: str):
-    try:
-        df = yf.download(ticker, period="6mo", interval="1d", progress=False)
-        if df.empty:
-            raise ValueError("Empty dataframe")
-        return df
-    except Exception as e:
-        print(f"⚠️ Using fallback data for {ticker}: {e}")
-        dates = pd.date_range(end=pd.Timestamp.today(), periods=180)
-        prices = pd.Series(range(180)) + 100
-        return pd.DataFrame({"Adj Close": prices.values}, index=dates)
-
-
-def build_multimodal_sample(tickers):
+    frames = fetch_prices_batch([ticker])
+    if ticker in frames:
+        return frames[ticker]
+    return fallback_prices(ticker, "Empty dataframe")
+
+
+def _make_sample(ticker: str, df: pd.DataFrame, synthetic: bool = False) -> MultimodalSample:
+    return MultimodalSample(
+        ticker=ticker,
+        price_table=df,
+        news_texts=[f"Demo news about {ticker}. No external API used."],
+        image_caption=f"Image placeholder for {ticker}",
+        synthetic=synthetic,
+    )
+
+
+async def collect_multimodal_samples(
+    tickers: List[str],
+    collector: Optional[MarketDataCollector] = None,
+) -> Dict[str, MultimodalSample]:
+    """
+    Параллельный сбор данных по всем тикерам через MarketDataCollector
+    (rate limit + ретраи). По умолчанию бары берутся из локального кэша
+    и докачиваются только с последнего закэшированного бара.
+    Если по тикеру ничего не удалось скачать, подставляются
+    fallback-данные, остальные тикеры не страдают.
+    """
+    if collector is None:
+        collector = MarketDataCollector(CachedPriceProvider(YFinanceProvider(), PriceCache()))
+    fetched = await collector.collect(tickers)
+
+    cache = getattr(collector.provider, "cache", None)
+    if cache is not None:
+        print(f"💾 {cache.stats.report()}")
+
     result = {}
+    for t, res in fetched.items():
+        df = res.frame if res.ok else fallback_prices(t, res.error)
+        result[t] = _make_sample(t, df, synthetic=not res.ok)
 
-    for t in tickers:
-        time.sleep(3)
-        df = safe_download(t)
+    return result
 
-        result[t] = {
-            "prices": df,
-            "news": [f"Demo news about {t}. No external API used."],
-            "images": [f"Image placeholder for {t}"]
-        }
 
-    return result
\ No newline at end of file
+def build_multimodal_sample(tickers, collector: Optional[MarketDataCollector] = None):
+    """Синхронная обёртка над collect_multimodal_samples."""
+    return asyncio.run(collect_multimodal_samples(tickers, collector))
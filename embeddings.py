@@ -0,0 +1,208 @@
+# embeddings.py
+
+"""
+Общий на процесс сервис эмбеддингов.
+
+- модель sentence-transformers грузится лениво и один раз
+  (раньше rag_kg и memory_system держали по своей копии ~400 MB);
+- батчевое кодирование с настраиваемым batch size и числом потоков;
+- персистентный кэш векторов по sha256(model + текст): повторяющиеся
+  чанки (шаблонные новости, неизменные страницы PDF) не кодируются заново.
+
+HashingEmbeddings — дешёвые детерминированные эмбеддинги без модели
+для бенчмарков и офлайн-прогонов.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Set
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from .config import settings
+
+
+@dataclass
+class EmbeddingStats:
+    requested: int = 0
+    cache_hits: int = 0
+    encoded: int = 0
+    encode_seconds: float = 0.0
+    model_loads: int = 0
+    consumers: Set[str] = field(default_factory=set)  # модули, делящие одну модель
+    model_bytes: int = 0
+
+    @property
+    def throughput(self) -> float:
+        return self.encoded / self.encode_seconds if self.encode_seconds else 0.0
+
+    def report(self) -> str:
+        # каждый потребитель раньше грузил свою копию модели
+        saved_mb = max(len(self.consumers) - self.model_loads, 0) * self.model_bytes / 2 ** 20
+        return (
+            f"embeddings: {self.requested} texts, {self.cache_hits} from cache, "
+            f"{self.encoded} encoded at {self.throughput:.1f} texts/sec; "
+            f"model loaded {self.model_loads}x for {len(self.consumers)} consumers "
+            f"({', '.join(sorted(self.consumers)) or 'none'}; ~{saved_mb:.0f} MB saved)"
+        )
+
+
+class _VectorCache:
+    """SQLite: sha256 текста -> float32 вектор."""
+
+    def __init__(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS vectors (key TEXT PRIMARY KEY, vec BLOB NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        found: Dict[str, List[float]] = {}
+        with self._lock:
+            # SQLite ограничивает число параметров в запросе
+            for i in range(0, len(keys), 500):
+                part = keys[i:i + 500]
+                marks = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT key, vec FROM vectors WHERE key IN ({marks})", part
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+        return found
+
+    def put_many(self, items: Dict[str, List[float]]) -> None:
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO vectors(key, vec) VALUES (?, ?)",
+                [(k, np.asarray(v, dtype=np.float32).tobytes()) for k, v in items.items()],
+            )
+            self._conn.commit()
+
+
+class CachedEmbeddings(Embeddings):
+    def __init__(
+        self,
+        model_name: Optional[str] = None,
+        batch_size: Optional[int] = None,
+        threads: Optional[int] = None,
+        cache_path: Optional[Path] = None,
+    ) -> None:
+        self.model_name = model_name or settings.HF_EMBEDDING_MODEL
+        self.batch_size = batch_size or settings.EMBEDDING_BATCH_SIZE
+        self.threads = threads or settings.EMBEDDING_THREADS
+        self.stats = EmbeddingStats()
+        self._cache = _VectorCache(Path(cache_path or settings.EMBEDDING_CACHE_PATH))
+        self._model = None
+        self._load_lock = threading.Lock()
+
+    @property
+    def model(self):
+        with self._load_lock:
+            if self._model is None:
+                from langchain_community.embeddings import HuggingFaceEmbeddings
+
+                if self.threads:
+                    import torch
+                    torch.set_num_threads(self.threads)
+
+                self._model = HuggingFaceEmbeddings(
+                    model_name=self.model_name,
+                    encode_kwargs={"batch_size": self.batch_size},
+                )
+                self.stats.model_loads += 1
+                client = getattr(self._model, "_client", None) or getattr(self._model, "client", None)
+                if client is not None and hasattr(client, "parameters"):
+                    self.stats.model_bytes = sum(
+                        p.numel() * p.element_size() for p in client.parameters()
+                    )
+            return self._model
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\x1f{text}".encode("utf-8")).hexdigest()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.stats.requested += len(texts)
+        keys = [self._key(t) for t in texts]
+        vectors = self._cache.get_many(list(dict.fromkeys(keys)))
+        self.stats.cache_hits += sum(1 for k in keys if k in vectors)
+
+        # уникальные промахи кодируем одним батчевым вызовом
+        todo: Dict[str, str] = {}
+        for k, t in zip(keys, texts):
+            if k not in vectors:
+                todo.setdefault(k, t)
+        if todo:
+            started = time.perf_counter()
+            encoded = self.model.embed_documents(list(todo.values()))
+            self.stats.encode_seconds += time.perf_counter() - started
+            self.stats.encoded += len(todo)
+            fresh = dict(zip(todo.keys(), encoded))
+            self._cache.put_many(fresh)
+            vectors.update(fresh)
+
+        return [vectors[k] for k in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    Детерминированные эмбеддинги «мешка слов» через хэширование токенов
+    (L2-нормированные). Без модели — для бенчмарков и тестов.
+    """
+
+    def __init__(self, dim: int = 256) -> None:
+        self.dim = dim
+
+    def _vector(self, text: str) -> List[float]:
+        vec = np.zeros(self.dim, dtype=np.float32)
+        for token in re.findall(r"\w+", text.lower()):
+            h = int.from_bytes(hashlib.blake2b(token.encode(), digest_size=8).digest(), "little")
+            vec[h % self.dim] += 1.0 if (h >> 63) == 0 else -1.0
+        norm = np.linalg.norm(vec)
+        return (vec / norm if norm else vec).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._vector(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._vector(text)
+
+
+_embeddings: Optional[CachedEmbeddings] = None
+_embeddings_lock = threading.Lock()
+
+
+def get_embeddings(consumer: Optional[str] = None) -> CachedEmbeddings:
+    """
+    Единый на процесс экземпляр; модель грузится при первом encode.
+    consumer — имя модуля-потребителя: в статистике считаются разные
+    потребители, а не вызовы (прогрев и служебные вызовы передают None).
+    """
+    global _embeddings
+    with _embeddings_lock:
+        if _embeddings is None:
+            _embeddings = CachedEmbeddings()
+        if consumer:
+            _embeddings.stats.consumers.add(consumer)
+        return _embeddings
+
+
+def embedding_report() -> str:
+    """Статистика общего сервиса (без регистрации нового пользователя)."""
+    if _embeddings is None:
+        return "embeddings: model not loaded"
+    return _embeddings.stats.report()
@@ -0,0 +1,96 @@
+# file_lock.py
+
+"""
+Межпроцессные блокировки и атомарная запись общих файлов состояния.
+
+Запуски дашборда идут параллельно в разных процессах и обновляют одни и
+те же файлы (граф знаний, состояние индикаторов, кэш цен) по схеме
+load -> modify -> save:
+
+- file_lock(path) — эксклюзивная блокировка на <path>.lock (flock на POSIX,
+  msvcrt на Windows); повторный вход из того же потока не блокируется;
+- atomic_file(path) — уникальный временный файл (mkstemp) в каталоге цели,
+  по успешному выходу — os.replace на path; параллельные писатели не
+  затирают чужой временный файл.
+"""
+
+from __future__ import annotations
+
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterator
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+_held = threading.local()
+
+
+def _acquire(f: BinaryIO) -> None:
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        return
+    f.seek(0)
+    while True:
+        try:
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            return
+        except OSError:  # LK_LOCK сдаётся после ~10 секунд — ждём дальше
+            time.sleep(0.1)
+
+
+def _release(f: BinaryIO) -> None:
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+@contextmanager
+def file_lock(path: Path) -> Iterator[None]:
+    """Эксклюзивная секция по path между процессами (и потоками)."""
+    lock_path = Path(str(path) + ".lock")
+    key = str(lock_path.resolve())
+    depth: Dict[str, int] = getattr(_held, "depth", None) or {}
+    _held.depth = depth
+    if depth.get(key):
+        depth[key] += 1  # уже держим в этом потоке
+        try:
+            yield
+        finally:
+            depth[key] -= 1
+        return
+
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(lock_path, "a+b") as f:
+        _acquire(f)
+        depth[key] = 1
+        try:
+            yield
+        finally:
+            depth.pop(key, None)
+            _release(f)
+
+
+@contextmanager
+def atomic_file(path: Path) -> Iterator[BinaryIO]:
+    """Файл для записи на месте path: виден целиком или не виден вовсе."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=f".{path.name}.", suffix=".tmp", dir=str(path.parent))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            yield f
+        os.replace(tmp, path)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
@@ -0,0 +1,677 @@
+# indicators.py
+
+"""
+Векторизованный движок технических индикаторов.
+
+Все функции работают с 2-D массивами формы (n_tickers, n_bars):
+один проход считает индикатор сразу для всех тикеров, без цикла
+по тикерам в pandas. Ведущие NaN (у тикера история короче) допустимы.
+
+compute_indicators -> словарь матриц индикаторов
+summarize          -> компактная числовая сводка по последнему бару
+format_summary     -> текст для контекста Technical Analyst
+"""
+
+from __future__ import annotations
+
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .file_lock import atomic_file, file_lock
+
+
+TRADING_DAYS = 252
+
+
+# ============================
+# Подготовка матриц
+# ============================
+
+def _price_column(df: pd.DataFrame) -> str:
+    for col in ("Close", "Adj Close"):
+        if col in df.columns:
+            return col
+    raise KeyError("no Close/Adj Close column")
+
+
+def stack_frames(
+    frames: Dict[str, pd.DataFrame],
+) -> Tuple[List[str], pd.DatetimeIndex, Dict[str, np.ndarray]]:
+    """
+    Выравнивает фреймы тикеров по общему индексу дат и возвращает
+    матрицы close/high/low формы (n_tickers, n_bars).
+    Если High/Low нет (fallback-данные), используется close.
+    """
+    tickers = [t for t, df in frames.items() if df is not None and not df.empty]
+    if not tickers:
+        return [], pd.DatetimeIndex([]), {}
+
+    close = pd.concat({t: frames[t][_price_column(frames[t])] for t in tickers}, axis=1)
+    close = close.sort_index().ffill()
+
+    def field(name: str) -> np.ndarray:
+        cols = {
+            t: frames[t][name] if name in frames[t].columns else frames[t][_price_column(frames[t])]
+            for t in tickers
+        }
+        return pd.concat(cols, axis=1).reindex(close.index).ffill().to_numpy(np.float64).T
+
+    matrices = {
+        "close": close.to_numpy(np.float64).T,
+        "high": field("High"),
+        "low": field("Low"),
+    }
+    return tickers, close.index, matrices
+
+
+# ============================
+# Примитивы
+# ============================
+
+def _rolling_sum(x: np.ndarray, window: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Скользящая сумма и число валидных значений по окну (через cumsum)."""
+
+    def windowed(values: np.ndarray) -> np.ndarray:
+        csum = np.cumsum(values, axis=1, dtype=np.float64)
+        out = csum.copy()
+        out[:, window:] -= csum[:, :-window]
+        return out
+
+    valid = ~np.isnan(x)
+    if valid.all():
+        count = np.minimum(np.arange(1, x.shape[1] + 1), window).astype(np.float64)
+        return windowed(x), np.broadcast_to(count, x.shape)
+    return windowed(np.where(valid, x, 0.0)), windowed(valid)
+
+
+def sma(x: np.ndarray, window: int) -> np.ndarray:
+    total, count = _rolling_sum(x, window)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(count >= window, total / window, np.nan)
+
+
+def rolling_mean_std(x: np.ndarray, window: int, ddof: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+    """Скользящие среднее и стандартное отклонение за один набор cumsum."""
+    total, count = _rolling_sum(x, window)
+    total_sq, _ = _rolling_sum(x * x, window)
+    full = count >= window
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = total / count
+        var = (total_sq - count * mean * mean) / (count - ddof)
+    np.maximum(var, 0.0, out=var)
+    return np.where(full, mean, np.nan), np.where(full, np.sqrt(var), np.nan)
+
+
+def rolling_std(x: np.ndarray, window: int, ddof: int = 1) -> np.ndarray:
+    return rolling_mean_std(x, window, ddof)[1]
+
+
+def ewm(x: np.ndarray, alpha) -> np.ndarray:
+    """
+    Экспоненциальное сглаживание вдоль оси времени. alpha — скаляр или
+    вектор длины n_rows: так несколько EMA разных периодов считаются
+    одним проходом. Первое валидное значение строки — стартовое,
+    пропуски (NaN) внутри ряда сохраняют предыдущее состояние.
+    """
+    alpha = np.broadcast_to(np.asarray(alpha, dtype=np.float64), (x.shape[0],))
+    # цикл идёт по времени, поэтому держим время первой (непрерывной) осью
+    xt = np.ascontiguousarray(x.T)
+    out = np.empty_like(xt)
+    state = xt[0].copy()
+    out[0] = state
+    gaps = np.isnan(xt).any(axis=1)
+    unstarted = bool(gaps[0])
+
+    for i in range(1, xt.shape[0]):
+        col = xt[i]
+        upd = state + alpha * (col - state)
+        # медленный путь только там, где он нужен: до старта всех строк и на пропусках
+        if gaps[i]:
+            upd = np.where(np.isnan(col), state, upd)
+        if unstarted:
+            missing = np.isnan(state)
+            upd = np.where(missing, col, upd)
+            unstarted = bool(np.isnan(upd).any())
+        state = upd
+        out[i] = state
+    return out.T
+
+
+def ema(x: np.ndarray, span: int) -> np.ndarray:
+    return ewm(x, 2.0 / (span + 1))
+
+
+def true_range(high: np.ndarray, low: np.ndarray, close: np.ndarray) -> np.ndarray:
+    prev = np.concatenate([close[:, :1], close[:, :-1]], axis=1)
+    return np.fmax(high - low, np.fmax(np.abs(high - prev), np.abs(low - prev)))
+
+
+def drawdown(close: np.ndarray) -> np.ndarray:
+    peak = np.fmax.accumulate(close, axis=1)
+    return close / peak - 1.0
+
+
+def log_returns(close: np.ndarray) -> np.ndarray:
+    with np.errstate(invalid="ignore", divide="ignore"):
+        r = np.log(close[:, 1:] / close[:, :-1])
+    return np.concatenate([np.full((close.shape[0], 1), np.nan), r], axis=1)
+
+
+# ============================
+# Полный набор индикаторов
+# ============================
+
+def compute_indicators(
+    close: np.ndarray,
+    high: Optional[np.ndarray] = None,
+    low: Optional[np.ndarray] = None,
+) -> Dict[str, np.ndarray]:
+    """
+    SMA/EMA, RSI(14), MACD(12,26,9), Bollinger(20,2), ATR(14),
+    реализованная волатильность (20, годовая) и просадка.
+    Все рекурсивные фильтры (EMA, Wilder RSI/ATR) идут одним проходом.
+    """
+    high = close if high is None else high
+    low = close if low is None else low
+    n = close.shape[0]
+
+    diff = np.diff(close, axis=1, prepend=np.nan)
+    gain = np.where(diff > 0, diff, 0.0)
+    loss = np.where(diff < 0, -diff, 0.0)
+    gain[np.isnan(diff)] = np.nan
+    loss[np.isnan(diff)] = np.nan
+    tr = true_range(high, low, close)
+
+    # EMA12, EMA26, EMA20, Wilder(14) для gain/loss/TR — одной матрицей
+    stacked = np.concatenate([close, close, close, gain, loss, tr], axis=0)
+    alphas = np.repeat([2 / 13, 2 / 27, 2 / 21, 1 / 14, 1 / 14, 1 / 14], n)
+    smoothed = ewm(stacked, alphas)
+    ema12, ema26, ema20, avg_gain, avg_loss, atr14 = np.split(smoothed, 6, axis=0)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        rs = avg_gain / avg_loss
+        rsi14 = np.where(avg_loss == 0, 100.0, 100.0 - 100.0 / (1.0 + rs))
+    rsi14[np.isnan(avg_gain)] = np.nan
+
+    macd_line = ema12 - ema26
+    macd_signal = ema(macd_line, 9)
+
+    sma20, std20 = rolling_mean_std(close, 20, ddof=0)
+
+    return {
+        "sma20": sma20,
+        "sma50": sma(close, 50),
+        "ema20": ema20,
+        "rsi14": rsi14,
+        "macd": macd_line,
+        "macd_signal": macd_signal,
+        "macd_hist": macd_line - macd_signal,
+        "bb_upper": sma20 + 2 * std20,
+        "bb_lower": sma20 - 2 * std20,
+        "atr14": atr14,
+        "vol20": rolling_std(log_returns(close), 20) * np.sqrt(TRADING_DAYS),
+        "drawdown": drawdown(close),
+    }
+
+
+def summarize(
+    tickers: List[str],
+    close: np.ndarray,
+    indicators: Dict[str, np.ndarray],
+) -> Dict[str, Dict[str, float]]:
+    """Последние значения индикаторов + производные метрики по каждому тикеру."""
+    last = {name: arr[:, -1] for name, arr in indicators.items()}
+    last_close = close[:, -1]
+    first_idx = np.argmax(~np.isnan(close), axis=1)
+    first_close = close[np.arange(len(tickers)), first_idx]
+    max_dd = np.nanmin(indicators["drawdown"], axis=1)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        band = last["bb_upper"] - last["bb_lower"]
+        derived = {
+            "close": last_close,
+            "period_return": last_close / first_close - 1.0,
+            "bb_pct_b": (last_close - last["bb_lower"]) / band,
+            "atr_pct": last["atr14"] / last_close,
+            "max_drawdown": max_dd,
+        }
+
+    columns = {**last, **derived}
+    columns.pop("bb_upper")
+    columns.pop("bb_lower")
+    return {
+        t: {name: float(values[i]) for name, values in columns.items()}
+        for i, t in enumerate(tickers)
+    }
+
+
+def indicator_summary(frames: Dict[str, pd.DataFrame]) -> Dict[str, Dict[str, float]]:
+    """Фреймы цен -> сводка индикаторов по всем тикерам за один проход."""
+    tickers, _, m = stack_frames(frames)
+    if not tickers:
+        return {}
+    return summarize(tickers, m["close"], compute_indicators(m["close"], m["high"], m["low"]))
+
+
+def _fmt(value: float, pct: bool = False) -> str:
+    if value is None or np.isnan(value):
+        return "n/a"
+    return f"{value:+.1%}" if pct else f"{value:.2f}"
+
+
+def format_summary(summary: Dict[str, Dict[str, float]]) -> str:
+    """Компактное текстовое представление сводки — одна строка на тикер."""
+    lines = []
+    for t, s in summary.items():
+        lines.append(
+            f"{t}: close={_fmt(s['close'])} ret={_fmt(s['period_return'], True)} "
+            f"SMA20={_fmt(s['sma20'])} SMA50={_fmt(s['sma50'])} EMA20={_fmt(s['ema20'])} "
+            f"RSI14={_fmt(s['rsi14'])} MACD={_fmt(s['macd'])}/{_fmt(s['macd_signal'])} "
+            f"hist={_fmt(s['macd_hist'])} BB%B={_fmt(s['bb_pct_b'])} "
+            f"ATR14={_fmt(s['atr14'])} ({_fmt(s['atr_pct'], True)}) "
+            f"vol20={_fmt(s['vol20'], True)} DD={_fmt(s['drawdown'], True)} "
+            f"maxDD={_fmt(s['max_drawdown'], True)}"
+        )
+    return "\n".join(lines)
+
+
+# ============================
+# Инкрементальное состояние (O(1) на новый бар)
+# ============================
+
+class _RollingWelford:
+    """
+    Оконная дисперсия Уэлфорда для N рядов сразу: при заполненном окне
+    новое значение вытесняет самое старое из кольцевого буфера.
+    prev_* — состояние до последнего push (checkpoint/rollback), чтобы
+    пересчитать исправленный последний бар.
+    """
+
+    FIELDS = ("buf", "pos", "count", "mean", "m2",
+              "prev_pos", "prev_count", "prev_mean", "prev_m2", "prev_old")
+
+    def __init__(self, n: int, window: int) -> None:
+        self.window = window
+        self.buf = np.zeros((n, window))
+        self.pos = np.zeros(n, dtype=np.int64)
+        self.count = np.zeros(n, dtype=np.int64)
+        self.mean = np.zeros(n)
+        self.m2 = np.zeros(n)
+        self.prev_pos = np.zeros(n, dtype=np.int64)
+        self.prev_count = np.zeros(n, dtype=np.int64)
+        self.prev_mean = np.zeros(n)
+        self.prev_m2 = np.zeros(n)
+        self.prev_old = np.zeros(n)
+
+    def checkpoint(self, rows: np.ndarray) -> None:
+        """Запоминает состояние рядов перед очередным баром: O(1) на ряд."""
+        self.prev_pos[rows] = self.pos[rows]
+        self.prev_count[rows] = self.count[rows]
+        self.prev_mean[rows] = self.mean[rows]
+        self.prev_m2[rows] = self.m2[rows]
+        self.prev_old[rows] = self.buf[rows, self.pos[rows]]
+
+    def rollback(self, rows: np.ndarray) -> None:
+        """Возвращает ряды к последнему checkpoint (вытесненное значение — обратно в буфер)."""
+        self.pos[rows] = self.prev_pos[rows]
+        self.count[rows] = self.prev_count[rows]
+        self.mean[rows] = self.prev_mean[rows]
+        self.m2[rows] = self.prev_m2[rows]
+        self.buf[rows, self.pos[rows]] = self.prev_old[rows]
+
+    def push(self, rows: np.ndarray, x: np.ndarray) -> None:
+        full = self.count[rows] >= self.window
+
+        warm, xw = rows[~full], x[~full]
+        if len(warm):
+            self.count[warm] += 1
+            delta = xw - self.mean[warm]
+            self.mean[warm] += delta / self.count[warm]
+            self.m2[warm] += delta * (xw - self.mean[warm])
+
+        hot, xh = rows[full], x[full]
+        if len(hot):
+            old = self.buf[hot, self.pos[hot]]
+            mean_old = self.mean[hot]
+            mean_new = mean_old + (xh - old) / self.window
+            self.m2[hot] += (xh - old) * (xh - mean_new + old - mean_old)
+            self.mean[hot] = mean_new
+
+        self.buf[rows, self.pos[rows]] = x
+        self.pos[rows] = (self.pos[rows] + 1) % self.window
+
+    def mean_full(self) -> np.ndarray:
+        return np.where(self.count >= self.window, self.mean, np.nan)
+
+    def std_full(self, ddof: int = 1) -> np.ndarray:
+        var = np.maximum(self.m2, 0.0) / max(self.window - ddof, 1)
+        return np.where(self.count >= self.window, np.sqrt(var), np.nan)
+
+    def arrays(self, prefix: str) -> Dict[str, np.ndarray]:
+        return {f"{prefix}_{k}": getattr(self, k) for k in self.FIELDS}
+
+    def load(self, prefix: str, data) -> None:
+        for k in self.FIELDS:
+            setattr(self, k, np.array(data[f"{prefix}_{k}"]))
+
+
+class StreamingIndicators:
+    """
+    Инкрементальные индикаторы для набора тикеров: EMA-аккумуляторы,
+    Wilder RSI/ATR, оконный Уэлфорд (SMA, Bollinger, волатильность)
+    и пиковая цена для просадки. update() обрабатывает один новый бар
+    для всех тикеров за O(1) на тикер; значения совпадают с compute_indicators.
+
+    snapshot()/restore() сохраняют всё состояние в .npz, чтобы после
+    рестарта продолжить с последнего обработанного бара.
+
+    Последний бар может прийти повторно с другими значениями (незакрытый
+    внутридневной бар, скорректированный close): update() хранит состояние
+    до бара (prev_*) и сам бар (bar_*), и sync_frames() откатывает тикер
+    и применяет бар заново.
+    """
+
+    _EMA_ALPHAS = {"ema12": 2 / 13, "ema26": 2 / 27, "ema20": 2 / 21, "macd_signal": 2 / 10}
+    _WILDER = 1 / 14
+    _SCALARS = (
+        "ema12", "ema26", "ema20", "macd_signal", "avg_gain", "avg_loss", "atr14",
+        "prev_close", "peak", "max_dd", "first_close", "last_ts",
+    )
+    _BAR = ("bar_close", "bar_high", "bar_low")
+    _STATE = _SCALARS + tuple(f"prev_{name}" for name in _SCALARS) + _BAR
+
+    def __init__(self, tickers: List[str]) -> None:
+        self.tickers: List[str] = []
+        self._index: Dict[str, int] = {}
+        self._init_arrays(0)
+        self.add_tickers(tickers)
+
+    def _init_arrays(self, n: int) -> None:
+        for name in self._STATE:
+            setattr(self, name, np.full(n, np.nan))
+        self.last_ts = np.full(n, np.iinfo(np.int64).min, dtype=np.int64)
+        self.prev_last_ts = self.last_ts.copy()
+        self.w20 = _RollingWelford(n, 20)
+        self.w50 = _RollingWelford(n, 50)
+        self.wret = _RollingWelford(n, 20)
+
+    def add_tickers(self, tickers: List[str]) -> None:
+        """Расширяет вселенную тикеров пустым состоянием для новых."""
+        new = [t for t in dict.fromkeys(tickers) if t not in self._index]
+        if not new:
+            return
+        fresh = StreamingIndicators.__new__(StreamingIndicators)
+        fresh._init_arrays(len(new))
+        for name in self._STATE:
+            setattr(self, name, np.concatenate([getattr(self, name), getattr(fresh, name)]))
+        for w in ("w20", "w50", "wret"):
+            old, add = getattr(self, w), getattr(fresh, w)
+            for k in _RollingWelford.FIELDS:
+                setattr(old, k, np.concatenate([getattr(old, k), getattr(add, k)]))
+        for t in new:
+            self._index[t] = len(self.tickers)
+            self.tickers.append(t)
+
+    # ---------- обновление ----------
+
+    def update(
+        self,
+        close: np.ndarray,
+        high: Optional[np.ndarray] = None,
+        low: Optional[np.ndarray] = None,
+        ts: Optional[np.ndarray] = None,
+    ) -> None:
+        """
+        Один новый бар для всех тикеров (массивы в порядке self.tickers).
+        NaN в close означает «бара нет» — состояние тикера не меняется.
+        """
+        rows = np.nonzero(~np.isnan(close))[0]
+        if not len(rows):
+            return
+        self._checkpoint(rows, close, high, low)
+        c = close[rows]
+        h = c if high is None else np.fmax(high[rows], c)
+        lo = c if low is None else np.fmin(low[rows], c)
+        prev = self.prev_close[rows]
+
+        for name, alpha in self._EMA_ALPHAS.items():
+            if name == "macd_signal":
+                continue
+            state = getattr(self, name)
+            cur = state[rows]
+            state[rows] = np.where(np.isnan(cur), c, cur + alpha * (c - cur))
+
+        macd = self.ema12[rows] - self.ema26[rows]
+        sig = self.macd_signal[rows]
+        self.macd_signal[rows] = np.where(
+            np.isnan(sig), macd, sig + self._EMA_ALPHAS["macd_signal"] * (macd - sig)
+        )
+
+        # Wilder: gain/loss начинаются со второго бара, TR — с первого
+        diff = c - prev
+        has_prev = ~np.isnan(diff)
+        for name, value in (("avg_gain", np.maximum(diff, 0.0)), ("avg_loss", np.maximum(-diff, 0.0))):
+            state = getattr(self, name)
+            cur = state[rows]
+            upd = np.where(np.isnan(cur), value, cur + self._WILDER * (value - cur))
+            state[rows] = np.where(has_prev, upd, cur)
+
+        tr = np.fmax(h - lo, np.fmax(np.abs(h - prev), np.abs(lo - prev)))
+        cur = self.atr14[rows]
+        self.atr14[rows] = np.where(np.isnan(cur), tr, cur + self._WILDER * (tr - cur))
+
+        self.w20.push(rows, c)
+        self.w50.push(rows, c)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            ret = np.log(c / prev)
+        if has_prev.any():
+            self.wret.push(rows[has_prev], ret[has_prev])
+
+        self.peak[rows] = np.fmax(self.peak[rows], c)
+        self.max_dd[rows] = np.fmin(self.max_dd[rows], c / self.peak[rows] - 1.0)
+        self.first_close[rows] = np.where(np.isnan(self.first_close[rows]), c, self.first_close[rows])
+        self.prev_close[rows] = c
+        if ts is not None:
+            self.last_ts[rows] = ts[rows] if np.ndim(ts) else ts
+
+    def _checkpoint(
+        self,
+        rows: np.ndarray,
+        close: np.ndarray,
+        high: Optional[np.ndarray],
+        low: Optional[np.ndarray],
+    ) -> None:
+        for name in self._SCALARS:
+            getattr(self, f"prev_{name}")[rows] = getattr(self, name)[rows]
+        for w in ("w20", "w50", "wret"):
+            getattr(self, w).checkpoint(rows)
+        self.bar_close[rows] = close[rows]
+        self.bar_high[rows] = np.nan if high is None else high[rows]
+        self.bar_low[rows] = np.nan if low is None else low[rows]
+
+    def rollback(self, rows: np.ndarray) -> None:
+        """
+        Откатывает тикеры (индексы в self.tickers) на состояние до последнего
+        бара. Повторный откат невозможен: bar_* сбрасываются в NaN.
+        """
+        rows = rows[~np.isnan(self.bar_close[rows])]
+        for name in self._SCALARS:
+            getattr(self, name)[rows] = getattr(self, f"prev_{name}")[rows]
+        for w in ("w20", "w50", "wret"):
+            getattr(self, w).rollback(rows)
+        for name in self._BAR:
+            getattr(self, name)[rows] = np.nan
+
+    def _revised(self, rows: np.ndarray, ns: np.ndarray, m: Dict[str, np.ndarray]) -> np.ndarray:
+        """Маска тикеров, чей последний обработанный бар во фреймах изменился."""
+        last = self.last_ts[rows]
+        pos = np.minimum(np.searchsorted(ns, last), len(ns) - 1)
+        hit = (ns[pos] == last) & ~np.isnan(self.bar_close[rows])
+        changed = np.zeros(len(rows), dtype=bool)
+        for key, name in (("close", "bar_close"), ("high", "bar_high"), ("low", "bar_low")):
+            now = m[key][np.arange(len(rows)), pos]
+            was = getattr(self, name)[rows]
+            changed |= (now != was) & ~(np.isnan(now) & np.isnan(was))
+        return hit & changed
+
+    def sync_frames(self, frames: Dict[str, pd.DataFrame]) -> int:
+        """
+        Догоняет состояние по фреймам цен: обрабатываются бары новее
+        последнего обработанного для каждого тикера; если сам последний
+        бар во фреймах изменился, тикер откатывается и бар применяется заново.
+        Возвращает число пройденных временных шагов.
+        """
+        tickers, dates, m = stack_frames(frames)
+        if not tickers:
+            return 0
+        self.add_tickers(tickers)
+        rows = np.array([self._index[t] for t in tickers])
+        n = len(self.tickers)
+
+        stamps = pd.DatetimeIndex(dates).as_unit("ns")
+        ns = (stamps.tz_convert("UTC") if stamps.tz is not None else stamps).asi8
+        self.rollback(rows[self._revised(rows, ns, m)])
+        start = int(np.searchsorted(ns, self.last_ts[rows].min(), side="right"))
+
+        steps = 0
+        for i in range(start, len(ns)):
+            fresh = ns[i] > self.last_ts[rows]
+            if not fresh.any():
+                continue
+            close = np.full(n, np.nan)
+            high = np.full(n, np.nan)
+            low = np.full(n, np.nan)
+            close[rows[fresh]] = m["close"][fresh, i]
+            high[rows[fresh]] = m["high"][fresh, i]
+            low[rows[fresh]] = m["low"][fresh, i]
+            self.update(close, high, low)
+            self.last_ts[rows[fresh & ~np.isnan(m["close"][:, i])]] = ns[i]
+            steps += 1
+        return steps
+
+    # ---------- чтение ----------
+
+    def summary(self, tickers: Optional[List[str]] = None) -> Dict[str, Dict[str, float]]:
+        """Та же структура, что и у summarize()."""
+        with np.errstate(invalid="ignore", divide="ignore"):
+            rsi = np.where(
+                self.avg_loss == 0, 100.0, 100.0 - 100.0 / (1.0 + self.avg_gain / self.avg_loss)
+            )
+            rsi[np.isnan(self.avg_gain)] = np.nan
+            macd = self.ema12 - self.ema26
+            sma20 = self.w20.mean_full()
+            std20 = self.w20.std_full(ddof=0)
+            lower, upper = sma20 - 2 * std20, sma20 + 2 * std20
+            close = self.prev_close
+            columns = {
+                "sma20": sma20,
+                "sma50": self.w50.mean_full(),
+                "ema20": self.ema20,
+                "rsi14": rsi,
+                "macd": macd,
+                "macd_signal": self.macd_signal,
+                "macd_hist": macd - self.macd_signal,
+                "atr14": self.atr14,
+                "vol20": self.wret.std_full(ddof=1) * np.sqrt(TRADING_DAYS),
+                "drawdown": close / self.peak - 1.0,
+                "close": close,
+                "period_return": close / self.first_close - 1.0,
+                "bb_pct_b": (close - lower) / (upper - lower),
+                "atr_pct": self.atr14 / close,
+                "max_drawdown": self.max_dd,
+            }
+        wanted = tickers if tickers is not None else self.tickers
+        return {
+            t: {name: float(values[self._index[t]]) for name, values in columns.items()}
+            for t in wanted
+            if t in self._index
+        }
+
+    # ---------- snapshot / restore ----------
+
+    def snapshot(self, path: Path) -> None:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        arrays = {name: getattr(self, name) for name in self._STATE}
+        for w in ("w20", "w50", "wret"):
+            arrays.update(getattr(self, w).arrays(w))
+        with atomic_file(path) as f:
+            np.savez(f, tickers=np.array(self.tickers, dtype=str), version=2, **arrays)
+
+    @classmethod
+    def restore(cls, path: Path) -> "StreamingIndicators":
+        with np.load(path) as data:
+            state = cls(list(data["tickers"]))
+            for name in cls._STATE:
+                setattr(state, name, np.array(data[name]))
+            for w in ("w20", "w50", "wret"):
+                getattr(state, w).load(w, data)
+        return state
+
+    @classmethod
+    def load_or_create(cls, path: Path) -> "StreamingIndicators":
+        try:
+            return cls.restore(path)
+        except (FileNotFoundError, KeyError, ValueError):
+            return cls([])
+
+
+def persistent_summary(
+    frames: Dict[str, pd.DataFrame],
+    path: Path,
+    stateless: Iterable[str] = (),
+) -> Dict[str, Dict[str, float]]:
+    """
+    Сводка через StreamingIndicators, сохранённые в path (load -> sync ->
+    snapshot под межпроцессной блокировкой). Тикеры из stateless
+    (синтетические fallback-бары) считаются с нуля и в состояние не
+    попадают: их «сегодняшний» last_ts отрезал бы все следующие реальные бары.
+    """
+    stateless = set(stateless)
+    live = {t: df for t, df in frames.items() if t not in stateless}
+    summary: Dict[str, Dict[str, float]] = {}
+    if live:
+        with file_lock(path):
+            state = StreamingIndicators.load_or_create(path)
+            state.sync_frames(live)
+            state.snapshot(path)
+        summary.update(state.summary(list(live)))
+    summary.update(indicator_summary({t: df for t, df in frames.items() if t in stateless}))
+    return summary
+
+
+# ============================
+# Бенчмарк: 1000 тикеров x 5 лет
+# ============================
+
+def _benchmark(n_tickers: int = 1000, n_bars: int = 5 * TRADING_DAYS) -> None:
+    rng = np.random.default_rng(0)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.015, (n_tickers, n_bars)), axis=1))
+    spread = np.abs(rng.normal(0, 0.01, close.shape)) * close
+    tickers = [f"T{i:04d}" for i in range(n_tickers)]
+
+    started = time.perf_counter()
+    ind = compute_indicators(close, close + spread, close - spread)
+    summary = summarize(tickers, close, ind)
+    elapsed = time.perf_counter() - started
+
+    print(f"{n_tickers} tickers x {n_bars} bars: {elapsed * 1000:.0f} ms")
+    print(format_summary({tickers[0]: summary[tickers[0]]}))
+
+    # инкрементальный режим: один новый бар для всех тикеров
+    state = StreamingIndicators(tickers)
+    for i in range(n_bars - 1):
+        state.update(close[:, i], close[:, i] + spread[:, i], close[:, i] - spread[:, i])
+    started = time.perf_counter()
+    state.update(close[:, -1], close[:, -1] + spread[:, -1], close[:, -1] - spread[:, -1])
+    elapsed = time.perf_counter() - started
+    print(f"streaming update of {n_tickers} tickers: {elapsed * 1e6:.0f} us")
+    print(format_summary({tickers[0]: state.summary([tickers[0]])[tickers[0]]}))
+
+
+if __name__ == "__main__":
+    _benchmark()
@@ -0,0 +1,360 @@
+# jobs.py
+
+"""
+Менеджер запусков пайплайна для веб-дашборда.
+
+- у каждого запуска есть job id и свой каталог вывода (REPORTS_DIR/jobs/<id>);
+- число одновременных пайплайнов ограничено пулом воркеров, лишние
+  ждут в очереди;
+- повторный запрос с тем же набором тикеров, пока такой запуск ещё
+  в очереди или идёт, присоединяется к нему (refresh, вторая вкладка);
+- вывод процесса копится в кольцевом буфере строк с номерами: сколько
+  угодно SSE-зрителей читают один запуск, опоздавшие получают последние
+  строки, переподключение продолжает с Last-Event-ID;
+- зрители бывают синхронные (поток Flask на Condition) и асинхронные
+  (ASGI: asyncio.Event на зрителя, будится из потока запуска через
+  call_soon_threadsafe) — ждущий async-зритель не держит ни потока,
+  ни процесса;
+- запуск можно отменить: процесс пайплайна получает SIGTERM;
+- при JOB_EXECUTOR="worker" запуск идёт не в новом процессе, а в одном
+  из прогретых воркеров (worker.WarmWorkerPool) — без холодного старта;
+- запуски идут с TOKEN_EVENTS=1: токены LLM приходят в тот же лог
+  строками streaming.TOKEN_PREFIX и уходят в SSE как event: token.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import itertools
+import os
+import re
+import shutil
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import TYPE_CHECKING, AsyncIterator, Deque, Iterable, Iterator, List, Optional, Set, Tuple
+
+from .config import settings
+
+if TYPE_CHECKING:
+    from .worker import WarmWorkerPool
+
+
+ACTIVE = ("queued", "running")
+
+# тикеры уходят в argv пайплайна, историю отчётов и HTML дашборда
+_TICKER = re.compile(r"^[A-Z0-9.^=-]{1,15}$")
+
+
+def normalize_tickers(tickers: Iterable[str]) -> Tuple[str, ...]:
+    """
+    Ключ дедупликации: верхний регистр, без повторов, по алфавиту.
+    Не строка или не похоже на тикер — ValueError (API отвечает 400).
+    """
+    try:
+        items = list(tickers)
+    except TypeError:
+        raise ValueError("tickers must be a list or a comma-separated string") from None
+    key = set()
+    for item in items:
+        if not isinstance(item, str):
+            raise ValueError(f"invalid ticker {item!r}: expected a string")
+        ticker = item.strip().upper()
+        if not ticker:
+            continue
+        if not _TICKER.match(ticker):
+            raise ValueError(f"invalid ticker {ticker!r}")
+        key.add(ticker)
+    return tuple(sorted(key))
+
+
+@dataclass
+class Job:
+    id: str
+    tickers: Tuple[str, ...]
+    output_dir: Path
+    status: str = "queued"
+    created: float = field(default_factory=time.time)
+    started: Optional[float] = None
+    finished: Optional[float] = None
+    returncode: Optional[int] = None
+    log_size: int = 2000
+    _log: Deque[Tuple[int, str]] = field(default_factory=deque, repr=False)
+    _seq: int = 0
+    _cond: threading.Condition = field(default_factory=threading.Condition, repr=False)
+    _waiters: Set[Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = field(default_factory=set, repr=False)
+    _process: Optional[subprocess.Popen] = field(default=None, repr=False)
+    cancel_requested: bool = False
+
+    @property
+    def report_path(self) -> Path:
+        return self.output_dir / "final_investment_report.md"
+
+    @property
+    def done(self) -> bool:
+        return self.status not in ACTIVE
+
+    @property
+    def viewers(self) -> int:
+        """Сколько async-зрителей сейчас подписано."""
+        return len(self._waiters)
+
+    def _notify(self) -> None:
+        # вызывается под self._cond
+        self._cond.notify_all()
+        for loop, event in self._waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                pass  # цикл событий уже закрыт
+
+    def _since(self, last_seq: int) -> List[Tuple[int, str]]:
+        # номера идут подряд: сразу пропускаем прочитанное, без сравнения каждой строки
+        if not self._log:
+            return []
+        start = max(last_seq - self._log[0][0] + 1, 0)
+        return list(itertools.islice(self._log, start, None))
+
+    def append(self, line: str) -> None:
+        with self._cond:
+            self._seq += 1
+            self._log.append((self._seq, line.rstrip("\n")))
+            while len(self._log) > self.log_size:
+                self._log.popleft()
+            self._notify()
+
+    def set_status(self, status: str) -> None:
+        with self._cond:
+            self.status = status
+            if status == "running":
+                self.started = time.time()
+            elif status not in ACTIVE:
+                self.finished = time.time()
+            self._notify()
+
+    def subscribe(self, last_seq: int = 0, heartbeat: float = 15.0) -> Iterator[Optional[Tuple[int, str]]]:
+        """
+        Строки лога с номером > last_seq: сначала то, что есть в буфере
+        (replay), затем новые по мере появления. Если за heartbeat секунд
+        ничего не пришло — отдаёт None (повод отправить keep-alive).
+        Заканчивается, когда запуск завершён и всё прочитано.
+        """
+        while True:
+            with self._cond:
+                pending = self._since(last_seq)
+                if not pending:
+                    if self.done:
+                        return
+                    self._cond.wait(timeout=heartbeat)
+                    pending = self._since(last_seq)
+            if not pending:
+                yield None
+                continue
+            for item in pending:
+                last_seq = item[0]
+                yield item
+
+    async def subscribe_async(
+        self, last_seq: int = 0, heartbeat: float = 15.0
+    ) -> AsyncIterator[Optional[Tuple[int, str]]]:
+        """
+        То же, что subscribe, но для цикла событий: ожидание — это
+        asyncio.Event, который будит поток запуска. Если зритель ушёл
+        (генератор закрыт/отменён), подписка снимается в finally.
+        """
+        event = asyncio.Event()
+        waiter = (asyncio.get_running_loop(), event)
+        with self._cond:
+            self._waiters.add(waiter)
+        try:
+            while True:
+                # сброс до чтения буфера: уведомление после чтения не потеряется
+                event.clear()
+                with self._cond:
+                    pending = self._since(last_seq)
+                    done = self.done
+                if not pending:
+                    if done:
+                        return
+                    try:
+                        await asyncio.wait_for(event.wait(), timeout=heartbeat)
+                    except asyncio.TimeoutError:
+                        yield None
+                    continue
+                for item in pending:
+                    last_seq = item[0]
+                    yield item
+        finally:
+            with self._cond:
+                self._waiters.discard(waiter)
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "tickers": list(self.tickers),
+            "status": self.status,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "returncode": self.returncode,
+            "lines": self._seq,
+            "viewers": self.viewers,
+            "report": self.report_path.exists(),
+        }
+
+
+class JobManager:
+    def __init__(
+        self,
+        max_workers: Optional[int] = None,
+        root: Optional[Path] = None,
+        history: Optional[int] = None,
+        executor: Optional["WarmWorkerPool"] = None,
+    ) -> None:
+        self.root = Path(root or settings.REPORTS_DIR / "jobs")
+        if executor is None and settings.JOB_EXECUTOR == "worker":
+            from .worker import WarmWorkerPool
+            executor = WarmWorkerPool()
+        self.executor = executor
+        self.history = history or settings.JOB_HISTORY
+        self._pool = ThreadPoolExecutor(
+            max_workers=max_workers or settings.JOB_MAX_WORKERS, thread_name_prefix="pipeline-job"
+        )
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, tickers: Iterable[str]) -> Tuple[Job, bool]:
+        """
+        Ставит запуск в очередь. Возвращает (job, created): created=False,
+        если такой же набор тикеров уже в очереди или выполняется.
+        """
+        key = normalize_tickers(tickers)
+        if not key:
+            raise ValueError("at least one ticker is required")
+        with self._lock:
+            for job in reversed(self._jobs.values()):
+                if job.tickers == key and not job.done:
+                    return job, False
+
+            job_id = uuid.uuid4().hex[:12]
+            job = Job(job_id, key, self.root / job_id, log_size=settings.JOB_LOG_LINES)
+            job.output_dir.mkdir(parents=True, exist_ok=True)
+            self._jobs[job_id] = job
+            pruned = self._prune()
+        for old in pruned:
+            # отчёт уже сохранён в report_store; каталог запуска больше не нужен
+            shutil.rmtree(old.output_dir, ignore_errors=True)
+        job.append(f"🗂️ job {job_id} queued for {', '.join(key)}")
+        self._pool.submit(self._run, job)
+        return job, True
+
+    def _prune(self) -> List[Job]:
+        """Забывает старые завершённые запуски сверх history (под self._lock)."""
+        finished = [j for j in self._jobs.values() if j.done]
+        pruned = finished[: max(len(finished) - self.history, 0)]
+        for job in pruned:
+            del self._jobs[job.id]
+        return pruned
+
+    def _command(self, job: Job) -> List[str]:
+        return [
+            sys.executable, "-m", f"{__package__}.main",
+            "--tickers", ",".join(job.tickers),
+            "--output-dir", str(job.output_dir),
+            "--run-id", job.id,
+        ]
+
+    def _run(self, job: Job) -> None:
+        with job._cond:  # RLock: set_status внутри не блокируется
+            if job.cancel_requested:
+                return  # отменён, пока стоял в очереди
+            job.set_status("running")
+        if self.executor is not None:
+            self._run_warm(job)
+            return
+        # TOKEN_EVENTS: токены LLM идут в лог запуска (и в SSE как event: token)
+        env = {"TOKEN_EVENTS": "1", **os.environ, "PYTHONUNBUFFERED": "1"}
+        try:
+            process = job._process = subprocess.Popen(
+                self._command(job),
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                text=True,
+                bufsize=1,
+                env=env,
+                cwd=str(Path(__file__).resolve().parent.parent),
+            )
+            if job.cancel_requested:
+                process.terminate()  # cancel пришёл между проверкой и Popen
+            for line in process.stdout:
+                job.append(line)
+            job.returncode = process.wait()
+        except Exception as e:
+            job.append(f"❌ failed to run pipeline: {e}")
+            job.set_status("failed")
+            return
+        finally:
+            job._process = None
+        self._finish(job)
+
+    def _run_warm(self, job: Job) -> None:
+        try:
+            job.returncode = self.executor.run(
+                job.id, job.tickers, job.output_dir, job.append,
+                cancelled=lambda: job.cancel_requested,
+            )
+        except Exception as e:
+            job.append(f"❌ failed to run pipeline: {e}")
+            job.set_status("failed")
+            return
+        self._finish(job)
+
+    def _finish(self, job: Job) -> None:
+        if job.cancel_requested:
+            job.append(f"🛑 job {job.id} cancelled")
+            job.set_status("cancelled")
+            return
+        job.append(f"🏁 job {job.id} finished with code {job.returncode}")
+        job.set_status("succeeded" if job.returncode == 0 else "failed")
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """
+        Отменяет запуск: из очереди он просто не стартует, у идущего
+        процесс пайплайна получает SIGTERM (в прогретом воркере отменяется
+        asyncio-задача пайплайна). Завершённый не трогается.
+        """
+        job = self.get(job_id)
+        if job is None or job.done:
+            return job
+        with job._cond:
+            job.cancel_requested = True
+            queued = job.status == "queued"
+            process = job._process
+        if queued:
+            job.append(f"🛑 job {job.id} cancelled before start")
+            job.set_status("cancelled")
+        elif process is not None and process.poll() is None:
+            process.terminate()
+        elif self.executor is not None:
+            self.executor.cancel(job.id)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self) -> List[Job]:
+        with self._lock:
+            return list(reversed(self._jobs.values()))
+
+    def latest_report(self) -> Optional[Path]:
+        for job in self.list():
+            if job.status == "succeeded" and job.report_path.exists():
+                return job.report_path
+        return None
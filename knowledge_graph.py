@@ -0,0 +1,454 @@
+# knowledge_graph.py
+
+"""
+Персистентный граф знаний: тикеры, секторы, компании, события, новости
+и документы, связанные типизированными рёбрами.
+
+Хранение — компактные массивы (CSR-смежность) в одном .npz без pickle,
+поэтому граф на 100k+ узлов поднимается с диска за миллисекунды.
+Новые узлы/рёбра добавляются инкрементально поверх загруженного CSR.
+
+Вторичные индексы:
+- по сущности: ключ "kind:name" и имя без учёта регистра -> узлы;
+- по дате: отсортированные даты узлов -> диапазонные запросы.
+
+neighborhood()/context_for() — ограниченный k-hop обход для контекста
+фундаментального и риск-агентов.
+"""
+
+from __future__ import annotations
+
+import datetime as dt
+import hashlib
+import re
+import tempfile
+import time
+from collections import deque
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+from .config import settings
+from .file_lock import atomic_file
+
+
+NODE_KINDS = ("ticker", "sector", "company", "event", "news", "document")
+NO_DATE = -1
+
+
+def _day(value) -> int:
+    """Дата -> номер дня от эпохи (int32), NO_DATE если даты нет."""
+    if value is None or value == "":
+        return NO_DATE
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str):
+        value = dt.date.fromisoformat(value[:10])
+    if isinstance(value, dt.datetime):
+        value = value.date()
+    return (value - dt.date(1970, 1, 1)).days
+
+
+def _date_str(day: int) -> str:
+    return "" if day == NO_DATE else str(dt.date(1970, 1, 1) + dt.timedelta(days=int(day)))
+
+
+class _Buffer:
+    """Растущий numpy-буфер (амортизированное O(1) на append)."""
+
+    def __init__(self, dtype, data: Optional[np.ndarray] = None) -> None:
+        data = np.asarray(data if data is not None else [], dtype=dtype)
+        self._arr = np.empty(max(16, len(data) * 2), dtype=dtype)
+        self._arr[: len(data)] = data
+        self.size = len(data)
+
+    def append(self, value) -> None:
+        if self.size == len(self._arr):
+            grown = np.empty(len(self._arr) * 2, dtype=self._arr.dtype)
+            grown[: self.size] = self._arr[: self.size]
+            self._arr = grown
+        self._arr[self.size] = value
+        self.size += 1
+
+    def view(self) -> np.ndarray:
+        return self._arr[: self.size]
+
+
+class KnowledgeGraph:
+    def __init__(self) -> None:
+        self.keys: List[str] = []
+        self._key_index: Optional[Dict[str, int]] = {}
+        self.node_kind = _Buffer(np.int8)
+        self.node_date = _Buffer(np.int32)
+
+        self.edge_types: List[str] = []
+        self.src = _Buffer(np.int32)
+        self.dst = _Buffer(np.int32)
+        self.etype = _Buffer(np.int16)
+
+        # CSR по рёбрам, известным на момент загрузки; новые рёбра — в _pending
+        self._indptr = np.zeros(1, dtype=np.int64)
+        self._adj = np.zeros(0, dtype=np.int32)
+        self._pending: Dict[int, List[int]] = {}
+        self._edge_keys: Optional[Set[int]] = None
+        self._name_index: Optional[Dict[str, List[int]]] = None
+        self._date_order: Optional[np.ndarray] = None
+
+    @property
+    def _index(self) -> Dict[str, int]:
+        # строится при первом обращении: загрузка с диска не платит за dict на все узлы
+        if self._key_index is None:
+            self._key_index = dict(zip(self.keys, range(len(self.keys))))
+        return self._key_index
+
+    # ---------- вставка ----------
+
+    @staticmethod
+    def node_key(kind: str, name: str) -> str:
+        return f"{kind}:{name}"
+
+    def add_node(self, kind: str, name: str, date=None) -> int:
+        key = self.node_key(kind, name)
+        node = self._index.get(key)
+        if node is not None:
+            return node
+        node = len(self.keys)
+        self.keys.append(key)
+        self._index[key] = node
+        self.node_kind.append(NODE_KINDS.index(kind))
+        self.node_date.append(_day(date))
+        if self._name_index is not None:
+            self._name_index.setdefault(name.lower(), []).append(node)
+        self._date_order = None
+        return node
+
+    def _edge_type_id(self, etype: str) -> int:
+        if etype not in self.edge_types:
+            self.edge_types.append(etype)
+        return self.edge_types.index(etype)
+
+    @staticmethod
+    def _pack(src: int, dst: int, etype: int) -> int:
+        return (int(src) << 40) | (int(dst) << 12) | int(etype)
+
+    def add_edge(self, src: int, dst: int, etype: str) -> bool:
+        """Добавляет ребро, если такого ещё нет. O(1) амортизированно."""
+        t = self._edge_type_id(etype)
+        if self._edge_keys is None:
+            s, d, e = self.src.view(), self.dst.view(), self.etype.view()
+            packed = (s.astype(np.int64) << 40) | (d.astype(np.int64) << 12) | e.astype(np.int64)
+            self._edge_keys = set(packed.tolist())
+        key = self._pack(src, dst, t)
+        if key in self._edge_keys:
+            return False
+        self._edge_keys.add(key)
+
+        edge = self.src.size
+        self.src.append(src)
+        self.dst.append(dst)
+        self.etype.append(t)
+        self._pending.setdefault(src, []).append(edge)
+        self._pending.setdefault(dst, []).append(edge)
+        return True
+
+    def link(self, src_kind: str, src_name: str, etype: str, dst_kind: str, dst_name: str,
+             src_date=None, dst_date=None) -> bool:
+        return self.add_edge(
+            self.add_node(src_kind, src_name, src_date),
+            self.add_node(dst_kind, dst_name, dst_date),
+            etype,
+        )
+
+    # ---------- индексы и запросы ----------
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    @property
+    def edge_count(self) -> int:
+        return self.src.size
+
+    def find(self, kind: str, name: str) -> Optional[int]:
+        return self._index.get(self.node_key(kind, name))
+
+    def lookup(self, name: str) -> List[int]:
+        """Вторичный индекс по имени сущности (без учёта регистра и вида)."""
+        if self._name_index is None:
+            index: Dict[str, List[int]] = {}
+            for node, key in enumerate(self.keys):
+                index.setdefault(key.split(":", 1)[1].lower(), []).append(node)
+            self._name_index = index
+        return list(self._name_index.get(name.lower(), []))
+
+    def nodes_between(self, start, end, kind: Optional[str] = None) -> List[int]:
+        """Узлы с датой в [start, end] через отсортированный индекс дат."""
+        dates = self.node_date.view()
+        if self._date_order is None:
+            self._date_order = np.argsort(dates, kind="stable")
+        ordered = dates[self._date_order]
+        lo = np.searchsorted(ordered, _day(start), side="left")
+        hi = np.searchsorted(ordered, _day(end), side="right")
+        nodes = self._date_order[lo:hi]
+        if kind is not None:
+            nodes = nodes[self.node_kind.view()[nodes] == NODE_KINDS.index(kind)]
+        return nodes.tolist()
+
+    def incident_edges(self, node: int) -> List[int]:
+        edges: List[int] = []
+        if node + 1 < len(self._indptr):
+            edges.extend(self._adj[self._indptr[node]: self._indptr[node + 1]].tolist())
+        edges.extend(self._pending.get(node, ()))
+        return edges
+
+    def neighborhood(
+        self,
+        node: int,
+        k: int = 2,
+        max_nodes: int = 50,
+        edge_types: Optional[Iterable[str]] = None,
+    ) -> Tuple[List[int], List[int]]:
+        """
+        BFS до глубины k, не более max_nodes узлов.
+        Соседи обходятся от свежих к старым: сначала узлы без даты (сектор,
+        компания, тикеры), затем по дате узла и id ребра по убыванию —
+        иначе лимит max_nodes заполняли бы самые старые события.
+        Возвращает (узлы, рёбра) найденного подграфа.
+        """
+        allowed = None
+        if edge_types is not None:
+            allowed = {self.edge_types.index(t) for t in edge_types if t in self.edge_types}
+        src, dst, etype = self.src.view(), self.dst.view(), self.etype.view()
+        dates = self.node_date.view()
+
+        seen = {node}
+        edges: List[int] = []
+        queue = deque([(node, 0)])
+        while queue and len(seen) < max_nodes:
+            current, depth = queue.popleft()
+            if depth >= k:
+                continue
+            incident = np.asarray(self.incident_edges(current), dtype=np.int64)
+            others = np.where(src[incident] == current, dst[incident], src[incident])
+            when = dates[others].astype(np.int64)
+            when[when == NO_DATE] = np.iinfo(np.int64).max
+            for e in incident[np.lexsort((-incident, -when))].tolist():
+                if allowed is not None and etype[e] not in allowed:
+                    continue
+                other = int(dst[e] if src[e] == current else src[e])
+                if other not in seen:
+                    if len(seen) >= max_nodes:
+                        break
+                    seen.add(other)
+                    queue.append((other, depth + 1))
+                edges.append(e)
+        edges = [e for e in dict.fromkeys(edges) if src[e] in seen and dst[e] in seen]
+        return list(seen), edges
+
+    def describe_edge(self, edge: int) -> str:
+        s, d = int(self.src.view()[edge]), int(self.dst.view()[edge])
+        date = _date_str(int(self.node_date.view()[d]))
+        suffix = f" ({date})" if date else ""
+        return f"{self.keys[s]} -[{self.edge_types[self.etype.view()[edge]]}]-> {self.keys[d]}{suffix}"
+
+    def context_for(self, ticker: str, k: Optional[int] = None, max_nodes: Optional[int] = None) -> str:
+        """Текстовое k-hop окружение тикера для промпта агента."""
+        k = k or settings.KG_CONTEXT_HOPS
+        max_nodes = max_nodes or settings.KG_CONTEXT_MAX_NODES
+        node = self.find("ticker", ticker)
+        if node is None:
+            return "n/a"
+        _, edges = self.neighborhood(node, k=k, max_nodes=max_nodes)
+        return "\n".join(self.describe_edge(e) for e in edges) or "n/a"
+
+    # ---------- persist ----------
+
+    def _build_csr(self) -> Tuple[np.ndarray, np.ndarray]:
+        n = len(self.keys)
+        src, dst = self.src.view(), self.dst.view()
+        ends = np.concatenate([src, dst])
+        edge_ids = np.concatenate([np.arange(len(src)), np.arange(len(dst))]).astype(np.int32)
+        order = np.argsort(ends, kind="stable")
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(ends, minlength=n), out=indptr[1:])
+        return indptr, edge_ids[order]
+
+    def save(self, path: Optional[Path] = None) -> Path:
+        path = Path(path or settings.KG_STORE_PATH)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._indptr, self._adj = self._build_csr()
+        self._pending = {}
+
+        keys_blob = np.frombuffer("\n".join(self.keys).encode("utf-8"), dtype=np.uint8)
+        # уникальный временный файл: параллельные запуски не затирают друг друга
+        with atomic_file(path) as f:
+            np.savez(
+                f,
+                keys=keys_blob,
+                node_kind=self.node_kind.view(),
+                node_date=self.node_date.view(),
+                edge_types=np.array(self.edge_types, dtype=str),
+                src=self.src.view(),
+                dst=self.dst.view(),
+                etype=self.etype.view(),
+                indptr=self._indptr,
+                adj=self._adj,
+            )
+        return path
+
+    @classmethod
+    def load(cls, path: Optional[Path] = None) -> "KnowledgeGraph":
+        path = Path(path or settings.KG_STORE_PATH)
+        graph = cls()
+        if not path.exists():
+            return graph
+        with np.load(path) as data:
+            blob = data["keys"].tobytes().decode("utf-8")
+            graph.keys = blob.split("\n") if blob else []
+            graph._key_index = None
+            graph.node_kind = _Buffer(np.int8, data["node_kind"])
+            graph.node_date = _Buffer(np.int32, data["node_date"])
+            graph.edge_types = [str(t) for t in data["edge_types"]]
+            graph.src = _Buffer(np.int32, data["src"])
+            graph.dst = _Buffer(np.int32, data["dst"])
+            graph.etype = _Buffer(np.int16, data["etype"])
+            graph._indptr = np.array(data["indptr"])
+            graph._adj = np.array(data["adj"])
+        return graph
+
+    def to_networkx(self):
+        """Экспорт в networkx (для визуализации / GML)."""
+        import networkx as nx
+
+        g = nx.MultiDiGraph()
+        kinds, dates = self.node_kind.view(), self.node_date.view()
+        for i, key in enumerate(self.keys):
+            g.add_node(key, kind=NODE_KINDS[kinds[i]], date=_date_str(int(dates[i])))
+        for s, d, t in zip(self.src.view(), self.dst.view(), self.etype.view()):
+            g.add_edge(self.keys[s], self.keys[d], type=self.edge_types[t])
+        return g
+
+    def export_gml(self, path: Optional[Path] = None) -> Path:
+        import networkx as nx
+
+        path = Path(path or settings.KG_DB_PATH)
+        nx.write_gml(self.to_networkx(), str(path))
+        return path
+
+
+# ============================
+# Наполнение из документов пайплайна
+# ============================
+
+_SYMBOL = re.compile(r"\b[A-Z]{1,5}\b")
+
+
+def _signal_events(summary: Dict[str, float]) -> List[str]:
+    events = []
+    rsi = summary.get("rsi14", float("nan"))
+    if rsi > 70:
+        events.append("rsi_overbought")
+    elif rsi < 30:
+        events.append("rsi_oversold")
+    hist = summary.get("macd_hist", float("nan"))
+    if hist > 0:
+        events.append("macd_bullish")
+    elif hist < 0:
+        events.append("macd_bearish")
+    if summary.get("drawdown", 0.0) < -0.2:
+        events.append("deep_drawdown")
+    return events
+
+
+def update_graph_from_docs(
+    graph: KnowledgeGraph,
+    docs,
+    indicator_summary: Optional[Dict[str, Dict[str, float]]] = None,
+    today: Optional[dt.date] = None,
+) -> int:
+    """
+    Инкрементально добавляет в граф тикеры, новости, документы,
+    секторы/компании (если есть в metadata) и технические события.
+    Возвращает число новых рёбер.
+    """
+    today = today or dt.date.today()
+    before = graph.edge_count
+    tickers = {d.metadata["ticker"] for d in docs if d.metadata.get("ticker") not in (None, "UNKNOWN")}
+    for t in tickers:
+        graph.add_node("ticker", t)
+
+    for d in docs:
+        meta = d.metadata
+        ticker = meta.get("ticker")
+        date = meta.get("date") or today
+        digest = hashlib.sha256(d.page_content.encode("utf-8")).hexdigest()[:16]
+
+        if ticker in tickers:
+            if meta.get("sector"):
+                graph.link("ticker", ticker, "in_sector", "sector", meta["sector"])
+            if meta.get("company"):
+                graph.link("ticker", ticker, "issued_by", "company", meta["company"])
+
+        if meta.get("source") == "news":
+            node_name = digest
+            graph.link("ticker", ticker, "has_news", "news", node_name, dst_date=date)
+            kind = "news"
+        elif ticker not in tickers or meta.get("source") == "pdf":
+            # PDF и прочие документы; с тикером — привязаны к нему
+            node_name = f"{meta.get('source', 'doc')}#{meta.get('page', '')}:{digest}"
+            graph.add_node("document", node_name, date)
+            if ticker in tickers:
+                graph.link("ticker", ticker, "has_document", "document", node_name, dst_date=date)
+            kind = "document"
+        else:
+            continue  # снимки цен/индикаторов/подписи — не узлы графа
+
+        src = graph.find(kind, node_name)
+        for symbol in set(_SYMBOL.findall(d.page_content)) & tickers:
+            graph.add_edge(src, graph.find("ticker", symbol), "mentions")
+
+    for t, s in (indicator_summary or {}).items():
+        for event in _signal_events(s):
+            graph.link("ticker", t, "signal", "event", f"{t}:{event}:{today}", dst_date=today)
+
+    return graph.edge_count - before
+
+
+def _benchmark(n_tickers: int = 2000, n_news: int = 100_000, n_edges: int = 300_000) -> None:
+    rng = np.random.default_rng(0)
+    graph = KnowledgeGraph()
+    started = time.perf_counter()
+    tickers = [f"T{i:04d}" for i in range(n_tickers)]
+    for i, t in enumerate(tickers):
+        graph.link("ticker", t, "in_sector", "sector", f"S{i % 11}")
+    for i in range(n_news):
+        graph.add_node("news", f"n{i}", 19000 + i % 1000)
+    ticker_ids = [graph.find("ticker", t) for t in tickers]
+    for _ in range(n_edges):
+        graph.add_edge(ticker_ids[rng.integers(n_tickers)], n_tickers + 11 + int(rng.integers(n_news)), "has_news")
+    print(f"build {len(graph)} nodes / {graph.edge_count} edges: {time.perf_counter() - started:.2f} s")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = graph.save(Path(tmp) / "kg.npz")
+        started = time.perf_counter()
+        loaded = KnowledgeGraph.load(path)
+        print(f"load: {(time.perf_counter() - started) * 1000:.1f} ms "
+              f"({path.stat().st_size / 2 ** 20:.1f} MB)")
+
+    started = time.perf_counter()
+    for t in tickers[:1000]:
+        loaded.context_for(t)
+    print(f"k-hop context: {(time.perf_counter() - started):.3f} ms per ticker")
+
+    started = time.perf_counter()
+    found = loaded.nodes_between(19000 + 10, 19000 + 20, kind="news")
+    print(f"date range query: {len(found)} nodes in {(time.perf_counter() - started) * 1000:.1f} ms")
+
+    started = time.perf_counter()
+    loaded.link("ticker", tickers[0], "signal", "event", "T0000:rsi_overbought", dst_date=dt.date.today())
+    print(f"first incremental insert after load: {(time.perf_counter() - started) * 1000:.1f} ms")
+    print(loaded.context_for(tickers[0], k=1, max_nodes=5))
+
+
+if __name__ == "__main__":
+    _benchmark()
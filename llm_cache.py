@@ -0,0 +1,205 @@
+# llm_cache.py
+
+"""
+Контент-адресуемый кэш ответов LLM на SQLite.
+
+Ключ — sha256 от (model, temperature, max_tokens, текст промпта),
+поэтому повторный запуск после падения ниже по пайплайну или прогон
+оценки на тех же промптах не трогает локальную модель.
+
+- LRU-вытеснение по числу записей (last_access): число записей ведётся
+  в памяти, точный COUNT(*) — только при переполнении, и вытесняется
+  сразу пачка (до max_entries - evict_batch), а не по записи на put
+- опциональный TTL
+- флаг bypass (глобально через settings или на отдельный вызов)
+- метрики hit rate
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Optional
+
+from . import streaming
+from .config import settings
+
+
+@dataclass
+class LLMCacheStats:
+    hits: int = 0
+    misses: int = 0
+    bypassed: int = 0
+    evictions: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def report(self) -> str:
+        return (
+            f"llm cache: {self.hits} hits, {self.misses} misses "
+            f"(hit rate {self.hit_rate:.0%}), {self.bypassed} bypassed, "
+            f"{self.evictions} evicted"
+        )
+
+
+class LLMCache:
+    def __init__(
+        self,
+        path: Optional[Path] = None,
+        max_entries: Optional[int] = None,
+        ttl: Optional[float] = None,
+        enabled: Optional[bool] = None,
+    ) -> None:
+        self.path = Path(path or settings.LLM_CACHE_PATH)
+        self.max_entries = max_entries or settings.LLM_CACHE_MAX_ENTRIES
+        self.ttl = ttl if ttl is not None else settings.LLM_CACHE_TTL
+        self.enabled = settings.LLM_CACHE_ENABLED if enabled is None else enabled
+        # 5% ёмкости: на полном кэше COUNT(*) и DELETE раз в evict_batch вставок
+        self.evict_batch = max(1, self.max_entries // 20)
+        self.stats = LLMCacheStats()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " response TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS responses_lru ON responses(last_access)"
+        )
+        self._conn.commit()
+        # оценка сверху: REPLACE существующего ключа тоже +1, а записи других
+        # процессов видны только при пересчёте на переполнении
+        self._count = self._exact_count()
+
+    def _exact_count(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    @staticmethod
+    def key(model: str, temperature: Any, max_tokens: Any, prompt: str) -> str:
+        payload = json.dumps(
+            [str(model), temperature, max_tokens, prompt],
+            ensure_ascii=False,
+            separators=(",", ":"),
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str, bypass: bool = False) -> Optional[str]:
+        if bypass or not self.enabled:
+            self.stats.bypassed += 1
+            return None
+
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and self.ttl and now - row[1] > self.ttl:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                self._count -= 1
+                row = None
+            if row is None:
+                self.stats.misses += 1
+                return None
+            self._conn.execute(
+                "UPDATE responses SET last_access = ? WHERE key = ?", (now, key)
+            )
+            self._conn.commit()
+        self.stats.hits += 1
+        return row[0]
+
+    def put(self, key: str, response: str, bypass: bool = False) -> None:
+        if bypass or not self.enabled:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses(key, response, created_at, last_access)"
+                " VALUES (?, ?, ?, ?)",
+                (key, response, now, now),
+            )
+            self._count += 1
+            if self._count > self.max_entries:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        """Пересчитывает записи и, если их больше max_entries, вытесняет пачку LRU."""
+        count = self._exact_count()
+        if count > self.max_entries:
+            excess = count - max(self.max_entries - self.evict_batch, 0)
+            self._conn.execute(
+                "DELETE FROM responses WHERE key IN ("
+                " SELECT key FROM responses ORDER BY last_access ASC LIMIT ?)",
+                (excess,),
+            )
+            self.stats.evictions += excess
+            count -= excess
+        self._count = count
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+            self._count = 0
+
+
+_cache: Optional[LLMCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_llm_cache() -> LLMCache:
+    """Общий на процесс экземпляр кэша."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = LLMCache()
+        return _cache
+
+
+def llm_cache_key(llm: Any, prompt: str) -> str:
+    """Ключ по параметрам конкретной модели (crewai LLM или langchain)."""
+    model = getattr(llm, "model", None) or getattr(llm, "model_name", None) or type(llm).__name__
+    return LLMCache.key(
+        model,
+        getattr(llm, "temperature", None),
+        getattr(llm, "max_tokens", None) or getattr(llm, "num_predict", None),
+        prompt,
+    )
+
+
+def cached_invoke(llm: Any, prompt: str, bypass: bool = False) -> str:
+    """
+    llm.invoke(prompt).content через кэш (для langchain-цепочек); внутри
+    streaming.stage() модель вызывается через .stream() с токен-событиями.
+    """
+    cache = get_llm_cache()
+    key = llm_cache_key(llm, prompt)
+    cached = cache.get(key, bypass=bypass)
+    if cached is not None:
+        streaming.emit(cached)
+        return cached
+
+    if streaming.active() and hasattr(llm, "stream"):
+        content = streaming.stream_langchain(llm, prompt)
+    else:
+        result = llm.invoke(prompt)
+        content = getattr(result, "content", result)
+        if not isinstance(content, str):
+            content = str(content)
+    cache.put(key, content, bypass=bypass)
+    return content
@@ -1,39 +1,81 @@
 from __future__ import annotations
 
+import argparse
 import asyncio
-from typing import List
+from typing import List, Optional
 
-from .crew_setup import build_crew, parallel_data_collection, prepare_docs
+from .config import settings
+from .chains import rag_contexts
+from .crew_setup import compute_technical_summary, parallel_data_collection, prepare_docs, run_analysis_dag
+from .context_budget import get_budgeter
+from .embeddings import embedding_report
+from .indicators import format_summary
+from .llm_cache import get_llm_cache
+from .rag_kg import knowledge_graph_contexts
+from .structured_output import structured_stats
 from .report_exporter import save_markdown_report  # если есть; иначе можно удалить импорт
 
 
-TICKERS: List[str] = ["AAPL", "MSFT", "TSLA"]
+TICKERS: List[str] = list(settings.DEFAULT_TICKERS)
 
 
-async def run_pipeline(tickers: List[str]) -> None:
+async def run_pipeline(
+    tickers: List[str],
+    output_dir: Optional[str] = None,
+    run_id: Optional[str] = None,
+) -> None:
     print("📡 Collecting multimodal data...")
     samples = await parallel_data_collection(tickers)
 
+    # синхронные фазы — в потоках: event loop остаётся свободным и отмена
+    # запуска (warm worker) срабатывает сразу, а не после их окончания
+    summary = await asyncio.to_thread(compute_technical_summary, samples)
+
     print("📚 Preparing RAG resources...")
-    docs = prepare_docs(samples)
+    docs = await asyncio.to_thread(prepare_docs, samples, summary)
     print(f"Prepared {len(docs)} documents for RAG/Knowledge Graph.")
+    print(f"🧠 {embedding_report()}")
+
+    technical_contexts = {t: format_summary({t: s}) for t, s in summary.items()}
+    graph_contexts = knowledge_graph_contexts(tickers)
+    # документы тикера (новости, PDF) для fundamental/risk — эмбеддинг запроса, тоже в потоке
+    retrieved = await asyncio.to_thread(rag_contexts, tickers)
+
+    print("🚀 Running multi-agent analysis DAG (per-ticker, parallel)...")
+    results = await run_analysis_dag(tickers, technical_contexts, graph_contexts, retrieved)
 
-    print("🤖 Creating multi-agent crew...")
-    crew = build_crew(tickers)
+    print(f"💾 {get_llm_cache().stats.report()}")
+    print(f"✂️ {get_budgeter().stats.report()}")
+    if settings.STRUCTURED_OUTPUT:
+        print(f"🧩 {structured_stats().report()}")
 
-    print("🚀 Running full multi-agent analysis pipeline...")
-    result = crew.kickoff()  # синхронный запуск
+    report = results["report"]
+    if not report.ok:
+        failed = {name: r.error for name, r in results.items() if not r.ok}
+        print(f"❌ Report was not produced: {failed}")
+        # ненулевой код: дашборд (jobs / worker) помечает запуск как failed
+        raise SystemExit(1)
 
-    # result обычно = финальный output последней задачи (evaluation_task или report_task)
-    if isinstance(result, str):
-        final_report_md = result
-    else:
-        # на всякий случай приводим к строке
-        final_report_md = str(result)
+    failed = [name for name, r in results.items() if not r.ok and name != "evaluation"]
+    if failed:
+        print(f"⚠️ Report covers only successful tickers; failed nodes: {', '.join(failed)}")
+
+    final_report_md = str(report.output)
+    charts = [(item["ticker"], item["image_path"]) for item in samples if item.get("image_path")]
+    if charts:
+        # графики цен попадают в отчёт (и в PDF через pdf_renderer)
+        final_report_md += "\n\n## Price charts\n\n" + "\n\n".join(
+            f"![{ticker} adjusted close]({path})" for ticker, path in charts
+        )
+    evaluation = results["evaluation"]
+    if evaluation.ok:
+        print(f"🧪 Evaluation:\n{evaluation.output}")
 
     # Сохраняем отчёт (если у тебя есть такая функция)
     try:
-        output_path = save_markdown_report(final_report_md, "final_investment_report.md")
+        output_path = save_markdown_report(
+            final_report_md, "final_investment_report.md", output_dir, run_id=run_id, tickers=tickers
+        )
         print(f"✅ Final report saved to: {output_path}")
     except Exception:
         # если нет report_exporter или он другой — просто выведем
@@ -41,5 +83,27 @@ async def run_pipeline(tickers: List[str]) -> None:
         print(final_report_md)
 
 
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Multi-agent investment analysis pipeline")
+    parser.add_argument(
+        "--tickers",
+        default=",".join(TICKERS),
+        help="comma-separated tickers (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--output-dir",
+        default=None,
+        help="where to write the final report (default: the package directory)",
+    )
+    parser.add_argument(
+        "--run-id",
+        default=None,
+        help="ID of the report in the report store (default: generated)",
+    )
+    return parser.parse_args(argv)
+
+
 if __name__ == "__main__":
-    asyncio.run(run_pipeline(TICKERS))
\ No newline at end of file
+    args = parse_args()
+    tickers = [t.strip().upper() for t in args.tickers.split(",") if t.strip()]
+    asyncio.run(run_pipeline(tickers, args.output_dir, args.run_id))
\ No newline at end of file
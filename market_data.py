@@ -0,0 +1,369 @@
+# market_data.py
+
+"""
+Асинхронный движок сбора рыночных данных.
+
+- TokenBucket          – ограничение частоты запросов к провайдеру цен
+- PriceProvider        – интерфейс источника цен (yfinance или синтетика)
+- MarketDataCollector  – батчи тикеров, ограниченный параллелизм, ретраи
+                         с джиттером и изоляция ошибок по каждому тикеру
+
+Тикеры группируются в чанки: один запрос к провайдеру на чанк,
+а не на тикер. Время сбора определяется лимитом провайдера,
+а не фиксированными sleep-ами.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import inspect
+import random
+import threading
+import time
+import zlib
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Protocol
+
+import numpy as np
+import pandas as pd
+import yfinance as yf
+
+from .config import settings
+
+
+# ============================
+# Интерфейс провайдера цен
+# ============================
+
+class PriceProvider(Protocol):
+    """
+    Источник дневных баров. Один вызов fetch_batch = один запрос
+    к провайдеру на несколько тикеров. Может быть как обычной функцией,
+    так и корутиной — коллектор поддерживает оба варианта.
+    Тикеры, по которым данных нет, в ответ просто не попадают.
+    Если задан start, возвращаются только бары начиная с него
+    (нужно для инкрементального обновления кэша).
+    """
+
+    def fetch_batch(
+        self, tickers: List[str], start: Optional[pd.Timestamp] = None
+    ) -> Dict[str, pd.DataFrame]: ...
+
+
+def chunked(items: List[str], size: int) -> Iterator[List[str]]:
+    for i in range(0, len(items), max(1, size)):
+        yield items[i:i + size]
+
+
+def split_grouped_frame(df: pd.DataFrame, tickers: List[str]) -> Dict[str, pd.DataFrame]:
+    """
+    Разбивает ответ yf.download по нескольким тикерам (MultiIndex-колонки)
+    на отдельные фреймы. Уровень с тикерами ищется автоматически, поэтому
+    работают и group_by="ticker", и group_by="column".
+    """
+    if df is None or df.empty:
+        return {}
+
+    if not isinstance(df.columns, pd.MultiIndex):
+        # плоские колонки возможны только для одиночного тикера
+        return {tickers[0]: df} if len(tickers) == 1 else {}
+
+    wanted = set(tickers)
+    level = next(
+        (i for i in range(df.columns.nlevels)
+         if wanted & set(df.columns.get_level_values(i))),
+        None,
+    )
+    if level is None:
+        return {}
+
+    frames = {}
+    present = set(df.columns.get_level_values(level))
+    for t in tickers:
+        if t not in present:
+            continue
+        part = df.xs(t, axis=1, level=level).dropna(how="all")
+        if not part.empty:
+            frames[t] = part
+    return frames
+
+
+class YFinanceProvider:
+    """Провайдер на yfinance (блокирующий вызов уходит в thread pool)."""
+
+    def __init__(self, period: str = "6mo", interval: str = "1d") -> None:
+        self.period = period
+        self.interval = interval
+
+    def fetch_batch(
+        self, tickers: List[str], start: Optional[pd.Timestamp] = None
+    ) -> Dict[str, pd.DataFrame]:
+        window = {"start": start} if start is not None else {"period": self.period}
+        df = yf.download(
+            tickers,
+            interval=self.interval,
+            group_by="ticker",
+            threads=True,
+            progress=False,
+            **window,
+        )
+        return split_grouped_frame(df, tickers)
+
+
+class FakePriceProvider:
+    """
+    Локальный синтетический провайдер для тестов и бенчмарков:
+    random walk по каждому тикеру, задержка на запрос (+ немного на тикер)
+    и настраиваемая доля ошибок.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.05,
+        per_ticker_latency: float = 0.001,
+        failure_rate: float = 0.0,
+        periods: int = 126,
+        seed: int = 42,
+    ) -> None:
+        self.latency = latency
+        self.per_ticker_latency = per_ticker_latency
+        self.failure_rate = failure_rate
+        self.periods = periods
+        self.calls = 0
+        self._rng = random.Random(seed)
+
+    async def fetch_batch(
+        self, tickers: List[str], start: Optional[pd.Timestamp] = None
+    ) -> Dict[str, pd.DataFrame]:
+        self.calls += 1
+        await asyncio.sleep(self.latency + self.per_ticker_latency * len(tickers))
+        if self._rng.random() < self.failure_rate:
+            raise ConnectionError(f"fake provider failure for {len(tickers)} tickers")
+        frames = {t: synthetic_prices(t, self.periods) for t in tickers}
+        if start is not None:
+            frames = {t: df[df.index >= start] for t, df in frames.items()}
+        return frames
+
+
+def synthetic_prices(ticker: str, periods: int = 126) -> pd.DataFrame:
+    """Детерминированный (по тикеру) OHLCV random walk."""
+    rng = np.random.default_rng(zlib.crc32(ticker.encode()))
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.015, periods)))
+    spread = np.abs(rng.normal(0, 0.01, periods)) * close
+    dates = pd.bdate_range(end=pd.Timestamp.today().normalize(), periods=periods)
+    return pd.DataFrame(
+        {
+            "Open": close + rng.normal(0, 0.3, periods),
+            "High": close + spread,
+            "Low": close - spread,
+            "Close": close,
+            "Volume": rng.integers(1_000_000, 5_000_000, periods).astype(float),
+        },
+        index=dates,
+    )
+
+
+# ============================
+# Rate limiter
+# ============================
+
+class TokenBucket:
+    """
+    Token bucket: rate токенов в секунду, не больше capacity в запасе.
+
+    acquire() резервирует токен сразу (баланс может уйти в минус),
+    поэтому ожидающие обслуживаются в порядке очереди. Резервирование
+    не привязано к конкретному event loop и защищено обычным локом.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None) -> None:
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self, tokens: float) -> float:
+        with self._lock:
+            now = time.monotonic()
+            elapsed = now - self._updated
+            self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+            self._updated = now
+            self._tokens -= tokens
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    async def acquire(self, tokens: float = 1.0) -> None:
+        delay = self._reserve(tokens)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+# ============================
+# Коллектор
+# ============================
+
+@dataclass
+class FetchResult:
+    ticker: str
+    frame: Optional[pd.DataFrame] = None
+    error: Optional[str] = None
+    attempts: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return self.frame is not None
+
+
+class MarketDataCollector:
+    """
+    Параллельный сбор цен по множеству тикеров.
+
+    - тикеры группируются в чанки по batch_size, один запрос на чанк;
+    - не более max_concurrency запросов одновременно;
+    - каждый запрос (включая ретраи) проходит через TokenBucket;
+    - ошибки ретраятся с экспоненциальным backoff и full jitter,
+      повторно запрашиваются только тикеры, которых ещё нет;
+    - ошибка по одному тикеру не влияет на остальные.
+    """
+
+    def __init__(
+        self,
+        provider: Optional[PriceProvider] = None,
+        rate_per_sec: Optional[float] = None,
+        burst: Optional[float] = None,
+        max_concurrency: Optional[int] = None,
+        max_retries: Optional[int] = None,
+        batch_size: Optional[int] = None,
+        backoff_base: float = 0.5,
+        backoff_max: float = 8.0,
+    ) -> None:
+        self.provider = provider or YFinanceProvider()
+        self.bucket = TokenBucket(
+            rate_per_sec or settings.MARKET_RATE_LIMIT,
+            burst,
+        )
+        self.max_concurrency = max_concurrency or settings.MARKET_MAX_CONCURRENCY
+        self.max_retries = (
+            max_retries if max_retries is not None else settings.MARKET_MAX_RETRIES
+        )
+        self.batch_size = batch_size or settings.MARKET_BATCH_SIZE
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+    async def _call_provider(self, tickers: List[str]) -> Dict[str, pd.DataFrame]:
+        fetch = self.provider.fetch_batch
+        if inspect.iscoroutinefunction(fetch):
+            return await fetch(tickers)
+        return await asyncio.to_thread(fetch, tickers)
+
+    def _backoff(self, attempt: int) -> float:
+        cap = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        return random.uniform(0, cap)
+
+    async def fetch_chunk(
+        self, chunk: List[str], semaphore: asyncio.Semaphore
+    ) -> List[FetchResult]:
+        results = {t: FetchResult(ticker=t) for t in chunk}
+        pending = list(chunk)
+        started = time.perf_counter()
+
+        for attempt in range(self.max_retries + 1):
+            for t in pending:
+                results[t].attempts = attempt + 1
+            try:
+                async with semaphore:
+                    await self.bucket.acquire()
+                    frames = await self._call_provider(pending)
+                for t in pending:
+                    df = frames.get(t)
+                    if df is None or df.empty:
+                        results[t].error = "ValueError: Empty dataframe"
+                    else:
+                        results[t].frame = df
+                        results[t].error = None
+            except Exception as e:
+                for t in pending:
+                    results[t].error = f"{type(e).__name__}: {e}"
+
+            pending = [t for t in pending if not results[t].ok]
+            if not pending:
+                break
+            if attempt < self.max_retries:
+                await asyncio.sleep(self._backoff(attempt))
+
+        elapsed = time.perf_counter() - started
+        for r in results.values():
+            r.elapsed = elapsed
+        return list(results.values())
+
+    async def collect(self, tickers: List[str]) -> Dict[str, FetchResult]:
+        # семафор создаём на каждый вызов, чтобы не привязываться к event loop
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        unique = list(dict.fromkeys(tickers))
+        chunks = await asyncio.gather(
+            *(self.fetch_chunk(c, semaphore) for c in chunked(unique, self.batch_size))
+        )
+        return {r.ticker: r for chunk in chunks for r in chunk}
+
+
+def fetch_prices_batch(
+    tickers: List[str],
+    provider: Optional[PriceProvider] = None,
+    batch_size: Optional[int] = None,
+) -> Dict[str, pd.DataFrame]:
+    """
+    Синхронный батч-доступ (для MCP-сервера и скриптов):
+    возвращает только успешно скачанные тикеры.
+    """
+    collector = MarketDataCollector(provider, batch_size=batch_size)
+    results = asyncio.run(collector.collect(tickers))
+    return {t: r.frame for t, r in results.items() if r.ok}
+
+
+async def fetch_prices_batch_async(
+    tickers: List[str],
+    provider: Optional[PriceProvider] = None,
+    batch_size: Optional[int] = None,
+) -> Dict[str, pd.DataFrame]:
+    """То же, что fetch_prices_batch, для вызова изнутри event loop."""
+    collector = MarketDataCollector(provider, batch_size=batch_size)
+    results = await collector.collect(tickers)
+    return {t: r.frame for t, r in results.items() if r.ok}
+
+
+# ============================
+# Бенчмарк на синтетическом провайдере
+# ============================
+
+async def _benchmark(n_tickers: int = 300, rate: float = 5.0) -> None:
+    tickers = [f"T{i:04d}" for i in range(n_tickers)]
+
+    for batch_size in (1, 50):
+        provider = FakePriceProvider(latency=0.2, failure_rate=0.05)
+        collector = MarketDataCollector(
+            provider,
+            rate_per_sec=rate,
+            max_concurrency=16,
+            batch_size=batch_size,
+            backoff_base=0.05,
+        )
+
+        started = time.perf_counter()
+        results = await collector.collect(tickers)
+        elapsed = time.perf_counter() - started
+
+        failed = [r for r in results.values() if not r.ok]
+        print(
+            f"batch_size={batch_size:>3}: {n_tickers} tickers in {elapsed:.2f}s "
+            f"(rate limit {rate}/s), provider calls: {provider.calls}, "
+            f"failed: {len(failed)}"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(_benchmark())
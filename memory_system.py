@@ -1,14 +1,27 @@
 # memory_system.py
 
 from __future__ import annotations
-from typing import List, Dict
+import atexit
+import json
+import queue
+import re
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Deque, List, Dict, Optional, Tuple
+
+import numpy as np
 
 from langchain_core.documents import Document
 from langchain_chroma import Chroma
-from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain_core.prompts import PromptTemplate
 
+from .ann_index import load_index, make_index, normalize, save_index
 from .config import settings
+from .context_budget import count_tokens, get_budgeter, truncate_tokens
+from .embeddings import get_embeddings
 
 
 # ===============================
@@ -16,22 +29,71 @@ from .config import settings
 # ===============================
 
 class ShortTermMemory:
-    """Простое хранение диалога в списке строк."""
+    """
+    Кольцевой буфер реплик (deque) с текущими счётчиками символов и токенов.
 
-    def __init__(self) -> None:
-        self._buffer: List[Dict[str, str]] = []
+    - append и вытеснение старых реплик — O(1) (без учёта рендера);
+    - отрендеренный текст кэшируется и дописывается инкрементально,
+      повторный load() без изменений ничего не пересобирает;
+    - при превышении max_tokens вытесняются самые старые реплики
+      (save_context возвращает их, чтобы менеджер сжал их в long-term).
+    """
 
-    def save_context(self, user_msg: str, assistant_msg: str) -> None:
-        self._buffer.append({"user": user_msg, "assistant": assistant_msg})
+    def __init__(self, max_tokens: Optional[int] = None) -> None:
+        self.max_tokens = max_tokens or settings.SHORT_TERM_MAX_TOKENS
+        self._buffer: Deque[Tuple[str, int]] = deque()
+        self._chars = 0
+        self._tokens = 0
+        self._rendered: Optional[str] = None
+
+    @property
+    def char_count(self) -> int:
+        """Длина load() без его вызова."""
+        return self._chars + max(len(self._buffer) - 1, 0)
+
+    @property
+    def token_count(self) -> int:
+        return self._tokens
+
+    def __len__(self) -> int:
+        return len(self._buffer)
+
+    def save_context(self, user_msg: str, assistant_msg: str) -> List[str]:
+        turn = f"User: {user_msg}\nAssistant: {assistant_msg}"
+        tokens = count_tokens(turn)
+        self._buffer.append((turn, tokens))
+        self._chars += len(turn)
+        self._tokens += tokens
+        if self._rendered is not None:
+            self._rendered = f"{self._rendered}\n{turn}" if len(self._buffer) > 1 else turn
+        return self.evict_until(max_tokens=self.max_tokens)
+
+    def evict_until(self, max_tokens: Optional[int] = None, max_chars: Optional[int] = None) -> List[str]:
+        """Вытесняет самые старые реплики, пока память не уложится в лимиты."""
+        evicted: List[str] = []
+        while len(self._buffer) > 1 and (
+            (max_tokens is not None and self._tokens > max_tokens)
+            or (max_chars is not None and self.char_count > max_chars)
+        ):
+            turn, tokens = self._buffer.popleft()
+            self._chars -= len(turn)
+            self._tokens -= tokens
+            evicted.append(turn)
+        if evicted and self._rendered is not None:
+            cut = sum(len(t) + 1 for t in evicted)
+            self._rendered = self._rendered[cut:]
+        return evicted
 
     def load(self) -> str:
-        return "\n".join(
-            f"User: {m['user']}\nAssistant: {m['assistant']}"
-            for m in self._buffer
-        )
+        if self._rendered is None:
+            self._rendered = "\n".join(turn for turn, _ in self._buffer)
+        return self._rendered
 
     def clear(self) -> None:
-        self._buffer = []
+        self._buffer.clear()
+        self._chars = 0
+        self._tokens = 0
+        self._rendered = None
 
 
 # =======================================
@@ -40,48 +102,413 @@ class ShortTermMemory:
 
 class LongTermVectorMemory:
     """
-    Векторное хранилище на Chroma для длинной истории,
-    id — просто "mem_X".
+    Векторное хранилище для длинной истории.
+
+    backend="chroma" — коллекция Chroma (HNSW с параметрами из settings);
+    "exact" / "hnswlib" / "faiss" — свой индекс из ann_index: тексты
+    дописываются в memories.jsonl, индекс сохраняется persist().
+    Если индекс отстал от jsonl (упали до persist), хвост доиндексируется
+    при открытии — векторы берутся из кэша эмбеддингов.
     """
 
-    def __init__(self) -> None:
-        self._emb = HuggingFaceEmbeddings(model_name=settings.HF_EMBEDDING_MODEL)
-        self._store = Chroma(
-            collection_name="mas_long_term_memory_v2",
-            embedding_function=self._emb,
-            persist_directory=str(settings.VECTOR_DB_DIR),
-        )
+    def __init__(
+        self,
+        backend: Optional[str] = None,
+        directory: Optional[Path] = None,
+        embeddings=None,
+    ) -> None:
+        self._emb = embeddings or get_embeddings("memory_system")
+        self.backend = backend or settings.MEMORY_ANN_BACKEND
+        # запись идёт из фонового писателя, поиск — из потока агента
+        self._lock = threading.RLock()
+        if self.backend == "chroma":
+            self._store = Chroma(
+                collection_name="mas_long_term_memory_v2",
+                embedding_function=self._emb,
+                persist_directory=str(settings.VECTOR_DB_DIR),
+                collection_metadata={
+                    "hnsw:space": "cosine",
+                    "hnsw:M": settings.MEMORY_HNSW_M,
+                    "hnsw:construction_ef": settings.MEMORY_HNSW_EF_CONSTRUCTION,
+                    "hnsw:search_ef": settings.MEMORY_HNSW_EF_SEARCH,
+                },
+            )
+            return
+
+        self._dir = Path(directory or settings.MEMORY_INDEX_DIR)
+        self._dir.mkdir(parents=True, exist_ok=True)
+        self._log_path = self._dir / "memories.jsonl"
+        self._docs: List[Document] = []
+        if self._log_path.exists():
+            with open(self._log_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    record = json.loads(line)
+                    self._docs.append(Document(page_content=record["text"], metadata=record["metadata"]))
+        self._index = load_index(self._dir)
+        indexed = len(self._index) if self._index is not None else 0
+        if indexed < len(self._docs):
+            tail = self._docs[indexed:]
+            self._index_vectors(range(indexed, len(self._docs)), [d.page_content for d in tail])
+
+    def _index_vectors(self, ids, texts: List[str]) -> None:
+        vectors = np.asarray(self._emb.embed_documents(texts), dtype=np.float32)
+        if self._index is None:
+            self._index = make_index(self.backend, vectors.shape[1])
+        self._index.add(list(ids), vectors)
+
+    def add_memories(self, texts: List[str], metadatas: Optional[List[Dict]] = None) -> None:
+        metadatas = metadatas or [{} for _ in texts]
+        docs = [Document(page_content=t, metadata=m or {}) for t, m in zip(texts, metadatas)]
+        if not docs:
+            return
+        if self.backend == "chroma":
+            self._store.add_documents(docs)
+            return
+        # эмбеддинг батча — вне блокировки, чтобы не держать поиск
+        vectors = np.asarray(self._emb.embed_documents(texts), dtype=np.float32)
+        with self._lock:
+            with open(self._log_path, "a", encoding="utf-8") as f:
+                for d in docs:
+                    f.write(json.dumps({"text": d.page_content, "metadata": d.metadata}, ensure_ascii=False) + "\n")
+            start = len(self._docs)
+            self._docs.extend(docs)
+            if self._index is None:
+                self._index = make_index(self.backend, vectors.shape[1])
+            self._index.add(list(range(start, len(self._docs))), vectors)
 
     def add_memory(self, text: str, metadata: Dict | None = None) -> None:
-        doc = Document(page_content=text, metadata=metadata or {})
-        self._store.add_documents([doc])
+        self.add_memories([text], [metadata or {}])
 
     def search(self, query: str, k: int = 5) -> List[Document]:
-        return self._store.similarity_search(query, k=k)
+        if self.backend == "chroma":
+            return self._store.similarity_search(query, k=k)
+        q = np.asarray(self._emb.embed_query(query), dtype=np.float32)
+        with self._lock:
+            if self._index is None or not len(self._index):
+                return []
+            ids, _ = self._index.search(q, k)
+            return [self._docs[i] for i in ids[0] if i >= 0]
+
+    def persist(self) -> None:
+        """Сохраняет ANN-индекс (для chroma — no-op, она пишет сама)."""
+        if self.backend != "chroma" and self._index is not None:
+            with self._lock:
+                save_index(self._index, self._dir)
+
+
+# ======================
+# Отложенная запись в долгосрочную память
+# ======================
+
+@dataclass
+class WriteBehindStats:
+    submitted: int = 0
+    written: int = 0
+    batches: int = 0
+    failed: int = 0  # ждут повторной записи
+    dropped: int = 0  # не записаны и больше не повторяются
+    blocked_seconds: float = 0.0
+
+    def report(self) -> str:
+        avg = self.written / self.batches if self.batches else 0.0
+        return (
+            f"memory writer: {self.written}/{self.submitted} written in {self.batches} batches "
+            f"(avg {avg:.1f}), {self.failed} pending retry, {self.dropped} dropped, "
+            f"producers blocked {self.blocked_seconds:.2f} s"
+        )
+
+
+_STOP = object()
+_FLUSH = object()
+
+
+class MemoryWriteQueue:
+    """
+    Write-behind для LongTermVectorMemory: submit() кладёт запись в
+    ограниченную очередь и сразу возвращается; фоновый поток копит батч
+    (до batch_size записей или flush_interval секунд) и пишет его одним
+    add_memories — один батч эмбеддингов и одна запись в хранилище.
+
+    preprocess (например, MemoryCompressor.compress_batch) тоже
+    выполняется в фоне. Очередь заполнена -> submit() ждёт (backpressure).
+
+    Неудачный батч не теряется: записи остаются в очереди повторов
+    (не больше max_queue) и пишутся снова со следующим батчем и на
+    flush()/close(). flush() — дождаться записи всего отправленного,
+    если что-то так и не записалось — поднимает last_error; close() —
+    то же и остановка потока (вызывается и через atexit).
+    """
+
+    def __init__(
+        self,
+        target: LongTermVectorMemory,
+        batch_size: Optional[int] = None,
+        flush_interval: Optional[float] = None,
+        max_queue: Optional[int] = None,
+        preprocess: Optional[Callable[[List[Tuple[str, Dict]]], List[Tuple[str, Dict]]]] = None,
+    ) -> None:
+        self.target = target
+        self.preprocess = preprocess
+        self.batch_size = batch_size or settings.MEMORY_WRITE_BATCH_SIZE
+        self.flush_interval = flush_interval or settings.MEMORY_WRITE_FLUSH_INTERVAL
+        self.stats = WriteBehindStats()
+        self.last_error: Optional[BaseException] = None
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_queue or settings.MEMORY_WRITE_QUEUE_SIZE)
+        self._retry: List[Tuple[str, Dict]] = []  # только поток писателя
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="memory-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)  # снимается в close(): закрытые очереди не копятся в atexit
+
+    def submit(self, text: str, metadata: Dict | None = None, timeout: Optional[float] = None) -> None:
+        if self._closed:
+            raise RuntimeError("memory writer is closed")
+        started = time.perf_counter()
+        # при полной очереди блокируемся (queue.Full, если истёк timeout)
+        self._queue.put((text, metadata or {}), timeout=timeout)
+        self.stats.blocked_seconds += time.perf_counter() - started
+        self.stats.submitted += 1
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            marker = item if item is _FLUSH or item is _STOP else None
+            batch: List[Tuple[str, Dict]] = []
+            if marker is None:
+                batch.append(item)
+                deadline = time.monotonic() + self.flush_interval
+                while len(batch) < self.batch_size:
+                    try:
+                        item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                    except queue.Empty:
+                        break
+                    if item is _FLUSH or item is _STOP:
+                        # маркер закрывает батч досрочно, не дожидаясь flush_interval
+                        marker = item
+                        break
+                    batch.append(item)
+            # на flush/close повторяем и неудачные записи, даже без новых
+            if batch or (marker is not None and self._retry):
+                self._write(batch)
+            for _ in batch:
+                self._queue.task_done()
+            if marker is not None:
+                self._queue.task_done()  # после записи: flush() ждёт и повтор
+            if marker is _STOP:
+                return
+
+    def _write(self, batch: List[Tuple[str, Dict]]) -> None:
+        pending = self._retry + batch
+        try:
+            records = self.preprocess(pending) if self.preprocess else pending
+            self.target.add_memories([t for t, _ in records], [m for _, m in records])
+            self._retry = []
+            self.stats.written += len(pending)
+            self.stats.batches += 1
+        except Exception as e:
+            # агент не должен падать из-за записи памяти: записи ждут повтора
+            limit = self._queue.maxsize or len(pending)
+            self._retry = pending[-limit:]
+            self.stats.dropped += len(pending) - len(self._retry)
+            self.last_error = e
+            print(f"⚠️ memory writer: failed to write {len(pending)} memories, will retry: {e}")
+        self.stats.failed = len(self._retry)
+
+    def flush(self) -> None:
+        """
+        Блокирует, пока всё отправленное не записано, и сохраняет индекс.
+        Если часть записей так и не записалась, поднимает last_error
+        (записи остаются в очереди повторов).
+        """
+        self._queue.put(_FLUSH)
+        self._queue.join()
+        self.target.persist()
+        if self.stats.failed:
+            raise self.last_error
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        atexit.unregister(self.close)
+        self._queue.put(_STOP)
+        self._thread.join()
+        self.target.persist()
+        if self._retry:
+            self.stats.dropped += len(self._retry)
+            self.stats.failed = 0
+            print(f"⚠️ memory writer: {len(self._retry)} memories lost on close: {self.last_error}")
+            self._retry = []
 
 
 # ======================
 # Компрессор памяти
 # ======================
 
+MemoryRecord = Tuple[str, Dict]
+
+_TURN_START = re.compile(r"^(?=User: )", re.MULTILINE)
+_SENTENCE = re.compile(r"(?<=[.!?])\s+|\n+")
+_SYMBOL = re.compile(r"\$?\b[A-Z]{2,5}\b")
+_NUMBER = re.compile(r"[-+]?\d+(?:[.,]\d+)?%?")
+_RECOMMENDATION = re.compile(
+    r"\b(buy|sell|hold|overweight|underweight|target|stop[- ]loss|upgrade|downgrade|"
+    r"покупать|продавать|держать|рекоменд\w*)\b",
+    re.IGNORECASE,
+)
+# аббревиатуры, похожие на тикеры
+_NOT_TICKERS = {
+    "RSI", "MACD", "EMA", "SMA", "ATR", "USD", "EPS", "CEO", "GDP", "ETF", "AI", "OK", "PE",
+    "BUY", "SELL", "HOLD",
+}
+
+# сводки сессий длинные — в контекст берём их только при явном преимуществе
+LEVEL_WEIGHTS = {"ticker": 1.0, "session": 0.6, "turn": 1.0}
+
+
+@dataclass
+class TurnScore:
+    text: str
+    salience: float
+    novelty: float
+    tickers: List[str]
+    numbers: int
+    recommendation: bool
+
+
 class MemoryCompressor:
     """
-    Упрощённый компрессор: вместо LLM делаем простое суммирование —
-    берём первые N и последние N строк.
+    Иерархическое сжатие без LLM.
+
+    История режется на реплики (User/Assistant), каждая получает
+    salience: новизна эмбеддинга относительно предыдущих реплик сессии +
+    упоминания тикеров, чисел и рекомендаций. Из реплики остаются только
+    «фактовые» предложения. Результат — дерево записей:
+
+      turn    — самые значимые реплики (keep_ratio), коротко;
+      session — сводка сессии из лучших фактов;
+      ticker  — факты сессии по каждому тикеру.
+
+    Записи маленькие и размечены (level, session, tickers, salience),
+    поэтому поиск достаёт компактные факты, а не огромный кусок диалога.
     """
 
-    def __init__(self, keep_head: int = 6, keep_tail: int = 6) -> None:
-        self.keep_head = keep_head
-        self.keep_tail = keep_tail
+    def __init__(
+        self,
+        embeddings=None,
+        keep_ratio: float = 0.3,
+        max_turn_tokens: int = 80,
+        max_summary_tokens: int = 120,
+        weights: Tuple[float, float, float, float] = (0.4, 0.25, 0.15, 0.2),
+    ) -> None:
+        self._emb = embeddings
+        self.keep_ratio = keep_ratio
+        self.max_turn_tokens = max_turn_tokens
+        self.max_summary_tokens = max_summary_tokens
+        self.weights = weights
+
+    @property
+    def embeddings(self):
+        if self._emb is None:
+            self._emb = get_embeddings("memory_system")
+        return self._emb
+
+    @staticmethod
+    def segment(conversation_text: str) -> List[str]:
+        return [t.strip() for t in _TURN_START.split(conversation_text) if t.strip()]
+
+    @staticmethod
+    def _tickers(text: str) -> List[str]:
+        found = (m.lstrip("$") for m in _SYMBOL.findall(text))
+        return list(dict.fromkeys(t for t in found if t not in _NOT_TICKERS))
+
+    def score(self, turns: List[str]) -> List[TurnScore]:
+        if not turns:
+            return []
+        vectors = normalize(self.embeddings.embed_documents(turns))
+        w_novelty, w_tickers, w_numbers, w_rec = self.weights
+        scored: List[TurnScore] = []
+        for i, turn in enumerate(turns):
+            novelty = 1.0 - float(np.max(vectors[:i] @ vectors[i])) if i else 1.0
+            tickers = self._tickers(turn)
+            numbers = len(_NUMBER.findall(turn))
+            rec = bool(_RECOMMENDATION.search(turn))
+            salience = (
+                w_novelty * max(novelty, 0.0)
+                + w_tickers * min(len(tickers), 3) / 3
+                + w_numbers * min(numbers, 5) / 5
+                + w_rec * rec
+            )
+            scored.append(TurnScore(turn, salience, novelty, tickers, numbers, rec))
+        return scored
+
+    def _compact(self, text: str) -> str:
+        """
+        Оставляет предложения с тикерами, числами или рекомендациями;
+        вопросы пользователя отбрасываются, если есть что-то кроме них.
+        """
+        body = re.sub(r"^(User|Assistant): ", "", text, flags=re.MULTILINE)
+        sentences = [s.strip() for s in _SENTENCE.split(body) if s.strip()]
+        facts = [
+            s for s in sentences
+            if self._tickers(s) or _NUMBER.search(s) or _RECOMMENDATION.search(s)
+        ]
+        statements = [s for s in facts if not s.endswith("?")]
+        chosen = statements or facts or sentences[:1]
+        return truncate_tokens(" ".join(chosen), self.max_turn_tokens)
+
+    def build_tree(self, conversation_text: str, session: str = "") -> List[MemoryRecord]:
+        scored = self.score(self.segment(conversation_text))
+        if not scored:
+            return []
+        n_keep = max(1, round(len(scored) * self.keep_ratio))
+        top = sorted(scored, key=lambda t: -t.salience)[:n_keep]
+
+        compact = {id(t): self._compact(t.text) for t in top}
+        records: List[MemoryRecord] = []
+        for t in top:
+            records.append((
+                compact[id(t)],
+                {"type": "memory", "level": "turn", "session": session,
+                 "tickers": ",".join(t.tickers), "salience": round(t.salience, 3)},
+            ))
+
+        tickers = list(dict.fromkeys(x for t in top for x in t.tickers))
+        summary = f"Session {session} ({', '.join(tickers) or 'no tickers'}):\n" + "\n".join(
+            f"- {compact[id(t)]}" for t in top
+        )
+        records.append((
+            truncate_tokens(summary, self.max_summary_tokens),
+            {"type": "memory", "level": "session", "session": session,
+             "tickers": ",".join(tickers), "salience": round(max(t.salience for t in top), 3)},
+        ))
+
+        # узел тикера нужен, только если он собирает несколько реплик
+        for ticker in tickers:
+            turns = [t for t in top if ticker in t.tickers]
+            if len(turns) < 2:
+                continue
+            records.append((
+                truncate_tokens(f"{ticker}:\n" + "\n".join(f"- {compact[id(t)]}" for t in turns), self.max_summary_tokens),
+                {"type": "memory", "level": "ticker", "session": session, "tickers": ticker,
+                 "salience": round(max(t.salience for t in turns), 3)},
+            ))
+        return records
 
     def compress(self, conversation_text: str) -> str:
-        lines = [line for line in conversation_text.splitlines() if line.strip()]
-        if len(lines) <= self.keep_head + self.keep_tail:
-            return conversation_text
+        """Сводка уровня session (одной строкой-блоком)."""
+        records = self.build_tree(conversation_text)
+        return next((text for text, meta in records if meta["level"] == "session"), conversation_text)
 
-        head = lines[: self.keep_head]
-        tail = lines[-self.keep_tail:]
-        return "\n".join(head + ["\n... [compressed middle] ...\n"] + tail)
+    def compress_batch(self, items: List[MemoryRecord]) -> List[MemoryRecord]:
+        """Препроцессор для MemoryWriteQueue: сырые диалоги -> дерево записей."""
+        records: List[MemoryRecord] = []
+        for text, meta in items:
+            if meta.get("type") == "dialog":
+                records.extend(self.build_tree(text, session=meta.get("session", "")))
+            else:
+                records.append((text, meta))
+        return records
 
 
 # ======================
@@ -90,26 +517,194 @@ class MemoryCompressor:
 
 class MemoryManager:
     """
-    Управляет короткой и длинной памятью, автоматически
-    сжимает историю при превышении порога символов.
+    Управляет короткой и длинной памятью: реплики, вытесненные из
+    короткой памяти (по бюджету токенов или порогу символов), сжимаются
+    и уходят в долгосрочную; свежий хвост диалога остаётся.
     """
 
     def __init__(self) -> None:
         self.short_term = ShortTermMemory()
         self.long_term = LongTermVectorMemory()
         self.compressor = MemoryCompressor()
+        # сжатие (эмбеддинги реплик) тоже уходит в фоновый поток писателя
+        self.writer = MemoryWriteQueue(self.long_term, preprocess=self.compressor.compress_batch)
+        self.session = f"s{int(time.time())}"
+        self._episodes = 0
+        self._evicted: List[str] = []
 
     def save_interaction(self, user_msg: str, assistant_msg: str) -> None:
-        self.short_term.save_context(user_msg, assistant_msg)
+        self._evicted.extend(self.short_term.save_context(user_msg, assistant_msg))
 
     def maybe_compress(self, threshold_chars: int = 2000) -> None:
-        history_text = self.short_term.load()
-        if len(history_text) < threshold_chars:
+        # длина берётся из счётчика, а не из load(): O(1) на вызов
+        if self.short_term.char_count >= threshold_chars:
+            self._evicted.extend(self.short_term.evict_until(max_chars=threshold_chars // 2))
+        if not self._evicted:
             return
-        summary = self.compressor.compress(history_text)
-        self.long_term.add_memory(summary, metadata={"type": "compressed-dialog"})
-        self.short_term.clear()
+        self._episodes += 1
+        # сжатие, эмбеддинг и запись — в фоне, ход агента не ждёт
+        self.writer.submit(
+            "\n".join(self._evicted),
+            metadata={"type": "dialog", "session": f"{self.session}-{self._episodes}"},
+        )
+        self._evicted = []
+
+    def retrieve_context(self, query: str, k: int = 5, max_tokens: Optional[int] = None) -> str:
+        return rank_memories(self.long_term.search(query, k=3 * k), k, max_tokens)
+
+    def flush(self) -> None:
+        self.writer.flush()
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+def rank_memories(docs: List[Document], k: int = 5, max_tokens: Optional[int] = None) -> str:
+    """
+    Переранжирует кандидатов из поиска: ранг * вес уровня * salience,
+    затем укладывает в бюджет токенов (с удалением почти-дубликатов).
+    """
+    scored = []
+    for rank, d in enumerate(docs):
+        level = LEVEL_WEIGHTS.get(d.metadata.get("level"), 1.0)
+        salience = float(d.metadata.get("salience", 0.5))
+        scored.append((d.page_content, level * (0.5 + salience) / (1 + rank)))
+    top = sorted(scored, key=lambda x: -x[1])[:k]
+    return get_budgeter().fit(
+        {"memory": top},
+        max_tokens=max_tokens or settings.MEMORY_CONTEXT_TOKENS,
+        name="memory",
+    )["memory"]
+
+
+# ======================
+# Микробенчмарк короткой памяти
+# ======================
+
+class _ListShortTermMemory:
+    """Прежняя реализация: список + полный рендер на каждый load()."""
+
+    def __init__(self) -> None:
+        self._buffer: List[Dict[str, str]] = []
+
+    def save_context(self, user_msg: str, assistant_msg: str) -> None:
+        self._buffer.append({"user": user_msg, "assistant": assistant_msg})
+
+    def load(self) -> str:
+        return "\n".join(f"User: {m['user']}\nAssistant: {m['assistant']}" for m in self._buffer)
+
+
+def _benchmark(n: int = 10_000, threshold_chars: int = 2000) -> None:
+    turns = [(f"What about ticker T{i % 50} today? ({i})", f"Trend is up, RSI {40 + i % 30}. " * 3) for i in range(n)]
+
+    # прежний maybe_compress: load() только чтобы измерить длину; без
+    # сброса (как между порогами) стоимость растёт квадратично
+    old = _ListShortTermMemory()
+    started = time.perf_counter()
+    for user, assistant in turns:
+        old.save_context(user, assistant)
+        len(old.load())
+    old_elapsed = time.perf_counter() - started
+
+    new = ShortTermMemory(max_tokens=10 ** 9)
+    started = time.perf_counter()
+    for user, assistant in turns:
+        new.save_context(user, assistant)
+        new.char_count
+    new_elapsed = time.perf_counter() - started
+    assert new.char_count == len(old.load()) == len(new.load())
+
+    bounded = ShortTermMemory(max_tokens=1000)
+    started = time.perf_counter()
+    evicted = 0
+    for user, assistant in turns:
+        evicted += len(bounded.save_context(user, assistant))
+        bounded.load()
+    bounded_elapsed = time.perf_counter() - started
+
+    print(f"{n} interactions, length check after each:")
+    print(f"  list + full render : {old_elapsed * 1000:.0f} ms")
+    print(f"  ring buffer        : {new_elapsed * 1000:.0f} ms (incl. token counting)")
+    print(f"  bounded, load() each turn: {bounded_elapsed * 1000:.0f} ms, "
+          f"{len(bounded)} turns / {bounded.token_count} tokens kept, {evicted} evicted")
+
+
+# ======================
+# Оценка сжатия на фиксированном eval-наборе
+# ======================
+
+class _HeadTailCompressor:
+    """Прежний компрессор: первые и последние 6 строк."""
+
+    def compress(self, conversation_text: str) -> str:
+        lines = [line for line in conversation_text.splitlines() if line.strip()]
+        if len(lines) <= 12:
+            return conversation_text
+        return "\n".join(lines[:6] + ["\n... [compressed middle] ...\n"] + lines[-6:])
+
+
+def _eval_sessions(n_sessions: int = 6, turns: int = 40, seed: int = 7):
+    """Сессии, где факты (тикер, RSI, рекомендация, цель) разбросаны по середине."""
+    rng = np.random.default_rng(seed)
+    filler_q = ["Can you format that as a table?", "Thanks, what else?", "Explain that in simpler words.",
+                "Ok, and how should I read this chart?", "Let's continue."]
+    filler_a = ["Sure, here is the same information formatted more clearly for you.",
+                "Of course. In short, the picture is the same as before, nothing new to add.",
+                "Charts like this show how the price moved over the selected period of time."]
+    sessions, queries = [], []
+    symbols = iter(f"{a}{b}{c}X" for a in "ABCDEFGH" for b in "KLMNOP" for c in "QRSTUV")
+    for s_id in range(n_sessions):
+        lines = []
+        for t in range(turns):
+            if rng.random() < 0.3:
+                ticker = next(symbols)
+                rsi = round(float(rng.uniform(20, 80)), 1)
+                target = int(rng.integers(50, 400))
+                action = ["BUY", "HOLD", "SELL"][int(rng.integers(3))]
+                lines.append(
+                    f"User: What do you think about {ticker}?\n"
+                    f"Assistant: {ticker} trades with RSI {rsi} and a mixed trend. "
+                    f"Recommendation: {action} with target {target}. Volume was average."
+                )
+                queries.append((f"What did we conclude about {ticker}? recommendation target", f"target {target}"))
+            else:
+                lines.append(f"User: {rng.choice(filler_q)}\nAssistant: {rng.choice(filler_a)}")
+        sessions.append("\n".join(lines))
+    return sessions, queries
+
+
+def _benchmark_compression(k: int = 5) -> None:
+    import tempfile
+    from .embeddings import HashingEmbeddings
+
+    emb = HashingEmbeddings(dim=512)
+    sessions, queries = _eval_sessions()
+
+    def evaluate(name: str, records: List[MemoryRecord], hierarchical: bool) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            store = LongTermVectorMemory(backend="exact", directory=Path(tmp), embeddings=emb)
+            store.add_memories([t for t, _ in records], [m for _, m in records])
+            stored = sum(count_tokens(t) for t, _ in records)
+            hits, context_tokens = 0, 0
+            for query, answer in queries:
+                if hierarchical:
+                    context = rank_memories(store.search(query, k=3 * k), k, max_tokens=10 ** 6)
+                else:
+                    context = "\n\n".join(d.page_content for d in store.search(query, k=k))
+                hits += answer in context
+                context_tokens += count_tokens(context)
+        print(f"  {name:22s} stored {stored:6d} tokens in {len(records):4d} records, "
+              f"hit rate {hits / len(queries):.2f}, context {context_tokens / len(queries):.0f} tokens/query")
+
+    print(f"{len(sessions)} sessions, {len(queries)} eval queries:")
+    raw = [(turn, {"level": "turn"}) for text in sessions for turn in MemoryCompressor.segment(text)]
+    evaluate("raw turns (no compr.)", raw, hierarchical=False)
+    evaluate("head/tail blob", [(_HeadTailCompressor().compress(t), {}) for t in sessions], hierarchical=False)
+    compressor = MemoryCompressor(embeddings=emb)
+    tree = [r for i, text in enumerate(sessions) for r in compressor.build_tree(text, session=f"eval-{i}")]
+    evaluate("salience tree", tree, hierarchical=True)
+
 
-    def retrieve_context(self, query: str) -> str:
-        docs = self.long_term.search(query, k=5)
-        return "\n\n".join(d.page_content for d in docs)
\ No newline at end of file
+if __name__ == "__main__":
+    _benchmark()
+    _benchmark_compression()
@@ -1,6 +1,188 @@
+"""
+Инжест PDF: парсинг один раз, кэш извлечённого текста, чанкинг.
+
+- страницы читаются потоково (PyPDFLoader.lazy_load), без удержания
+  всего документа в памяти;
+- каждая страница режется на перекрывающиеся чанки с метаданными
+  (source="pdf", file, page, chunk) и тикером документа, если он известен
+  (pdf_ticker: каталог или слово в имени файла) — иначе ретривер,
+  который фильтрует по тикеру, чанки PDF не увидит;
+- чанки кэшируются в DATA_DIR/pdf_cache по sha256 файла; пока mtime
+  и размер не изменились, файл даже не хэшируется заново;
+- каталог с PDF разбирается в пуле процессов.
+"""
+
+import hashlib
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional
+
 from langchain_community.document_loaders import PyPDFLoader
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from .config import settings
+
+
+CACHE_DIR = settings.DATA_DIR / "pdf_cache"
+MANIFEST_PATH = CACHE_DIR / "manifest.json"
+
+
+def _file_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _read_manifest() -> dict:
+    try:
+        with open(MANIFEST_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def _write_manifest(manifest: dict) -> None:
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = MANIFEST_PATH.with_name(f"{MANIFEST_PATH.name}.{os.getpid()}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(tmp, MANIFEST_PATH)
+
+
+def file_fingerprint(path: Path) -> str:
+    """sha256 файла; пересчитывается только при смене mtime/размера."""
+    path = Path(path).resolve()
+    stat = path.stat()
+    manifest = _read_manifest()
+    entry = manifest.get(str(path))
+    if entry and entry["mtime"] == stat.st_mtime and entry["size"] == stat.st_size:
+        return entry["sha256"]
+
+    sha = _file_sha256(path)
+    manifest[str(path)] = {"mtime": stat.st_mtime, "size": stat.st_size, "sha256": sha}
+    _write_manifest(manifest)
+    return sha
+
+
+def pdf_ticker(pdf_path: str, tickers: Iterable[str]) -> Optional[str]:
+    """
+    Тикер документа по пути: каталог (pdfs/AAPL/10-K.pdf) или слово имени
+    файла (AAPL_10-K.pdf). Сравнение с учётом регистра: «a» в названии
+    статьи — не тикер A.
+    """
+    known = set(tickers)
+    path = Path(pdf_path)
+    for part in reversed(path.parent.parts):
+        if part in known:
+            return part
+    for word in re.split(r"[^\w.]+|_", path.stem):
+        if word in known:
+            return word
+    return None
+
+
+def _cache_path(sha: str, chunk_size: int, chunk_overlap: int) -> Path:
+    return CACHE_DIR / f"{sha}_{chunk_size}_{chunk_overlap}.jsonl"
+
+
+def _parse_chunks(pdf_path: Path, chunk_size: int, chunk_overlap: int) -> Iterator[Document]:
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    for page in PyPDFLoader(str(pdf_path)).lazy_load():
+        base = {
+            "source": "pdf",
+            "file": str(pdf_path),
+            "page": page.metadata.get("page", 0),
+        }
+        for i, text in enumerate(splitter.split_text(page.page_content)):
+            yield Document(page_content=text, metadata={**base, "chunk": i})
+
+
+def _tagged(doc: Document, ticker: Optional[str]) -> Document:
+    if ticker:
+        doc.metadata["ticker"] = ticker
+    return doc
+
+
+def iter_pdf_chunks(
+    pdf_path: str,
+    chunk_size: Optional[int] = None,
+    chunk_overlap: Optional[int] = None,
+    ticker: Optional[str] = None,
+) -> Iterator[Document]:
+    """
+    Потоково отдаёт чанки PDF. При первом проходе чанки пишутся во
+    временный файл кэша, который становится постоянным только после
+    полного разбора документа. Тикер в кэш не пишется (кэш — по
+    содержимому файла), а проставляется при выдаче.
+    """
+    chunk_size = chunk_size or settings.PDF_CHUNK_SIZE
+    chunk_overlap = chunk_overlap if chunk_overlap is not None else settings.PDF_CHUNK_OVERLAP
+    path = Path(pdf_path)
+    cache_file = _cache_path(file_fingerprint(path), chunk_size, chunk_overlap)
+
+    if cache_file.exists():
+        with open(cache_file, "r", encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                # путь мог поменяться, а содержимое — нет (старый кэш хранил путь в source)
+                record["metadata"].update(source="pdf", file=str(path))
+                yield _tagged(Document(page_content=record["text"], metadata=record["metadata"]), ticker)
+        return
+
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = cache_file.with_name(f"{cache_file.name}.{os.getpid()}.tmp")
+    completed = False
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            for doc in _parse_chunks(path, chunk_size, chunk_overlap):
+                f.write(json.dumps({"text": doc.page_content, "metadata": doc.metadata}, ensure_ascii=False))
+                f.write("\n")
+                yield _tagged(doc, ticker)
+        completed = True
+    finally:
+        if completed:
+            os.replace(tmp, cache_file)
+        else:
+            tmp.unlink(missing_ok=True)
+
+
+def load_pdf_as_documents(pdf_path: str, ticker: Optional[str] = None) -> List[Document]:
+    return list(iter_pdf_chunks(pdf_path, ticker=ticker))
+
+
+def _ingest_to_cache(pdf_path: str) -> int:
+    """Воркер пула процессов: разбирает PDF и заполняет кэш."""
+    return sum(1 for _ in iter_pdf_chunks(pdf_path))
+
+
+def load_pdf_directory(
+    directory: str,
+    max_workers: Optional[int] = None,
+    tickers: Iterable[str] = (),
+) -> List[Document]:
+    """
+    Все PDF каталога: ещё не закэшированные разбираются параллельно
+    в пуле процессов, затем чанки читаются из кэша. Тикер каждого
+    файла — pdf_ticker() среди tickers.
+    """
+    tickers = list(tickers)
+    paths = sorted(str(p) for p in Path(directory).glob("**/*.pdf"))
+    # кэш сверяем в главном процессе: заодно прогреваем manifest и не гоняем воркеры зря
+    todo = [
+        p for p in paths
+        if not _cache_path(file_fingerprint(Path(p)), settings.PDF_CHUNK_SIZE, settings.PDF_CHUNK_OVERLAP).exists()
+    ]
+    if len(todo) > 1:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            list(pool.map(_ingest_to_cache, todo))
 
-def load_pdf_as_documents(pdf_path: str):
-    loader = PyPDFLoader(pdf_path)
-    documents = loader.load()
-    return documents
\ No newline at end of file
+    docs: List[Document] = []
+    for p in paths:
+        docs.extend(iter_pdf_chunks(p, ticker=pdf_ticker(p, tickers)))
+    return docs
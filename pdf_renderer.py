@@ -0,0 +1,611 @@
+# pdf_renderer.py
+
+"""
+Markdown → PDF для отчётов (ReportLab), с кэшем.
+
+- разбираются заголовки, абзацы, маркированные/нумерованные (в т.ч.
+  вложенные) списки, таблицы, цитаты, блоки кода, разделители и
+  картинки ![подпись](путь) — графики цен из visualization.py;
+  в тексте — **жирный**, *курсив*, `код`, [ссылки](url);
+- шрифт с кириллицей (DejaVu Sans из matplotlib или PDF_FONT_PATH),
+  иначе русский текст превращается в квадраты;
+- готовый PDF кэшируется по хэшу содержимого Markdown (и картинок),
+  повторное скачивание не рендерит заново;
+- запись — во временный файл и os.replace: параллельные скачивания не
+  видят недописанный файл и не пишут в один и тот же PDF;
+- рендер идёт в отдельном пуле потоков, один и тот же отчёт не
+  рендерится дважды одновременно (блокировка по ключу).
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from reportlab.lib import colors
+from reportlab.lib.enums import TA_CENTER
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import ParagraphStyle, StyleSheet1, getSampleStyleSheet
+from reportlab.lib.units import cm
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.platypus import (
+    Flowable,
+    HRFlowable,
+    Image,
+    ListFlowable,
+    ListItem,
+    Paragraph,
+    Preformatted,
+    SimpleDocTemplate,
+    Spacer,
+    Table,
+    TableStyle,
+)
+
+from .config import settings
+
+
+# Меняется при изменении вёрстки — старые PDF в кэше перестают совпадать
+RENDERER_VERSION = "2"
+
+PAGE_SIZE = A4
+MARGIN = 2 * cm
+CONTENT_WIDTH = PAGE_SIZE[0] - 2 * MARGIN
+
+
+# ============================
+# Шрифты и стили
+# ============================
+
+@dataclass(frozen=True)
+class _Fonts:
+    regular: str = "Helvetica"
+    bold: str = "Helvetica-Bold"
+    italic: str = "Helvetica-Oblique"
+    mono: str = "Courier"
+
+
+_fonts: Optional[_Fonts] = None
+_fonts_lock = threading.Lock()
+
+
+def _font_files() -> Dict[str, Path]:
+    if settings.PDF_FONT_PATH:
+        path = Path(settings.PDF_FONT_PATH)
+        return {"regular": path, "bold": path, "italic": path, "mono": path}
+    try:
+        import matplotlib
+    except ImportError:
+        return {}
+    ttf = Path(matplotlib.get_data_path()) / "fonts" / "ttf"
+    return {
+        "regular": ttf / "DejaVuSans.ttf",
+        "bold": ttf / "DejaVuSans-Bold.ttf",
+        "italic": ttf / "DejaVuSans-Oblique.ttf",
+        "mono": ttf / "DejaVuSansMono.ttf",
+    }
+
+
+def get_fonts() -> _Fonts:
+    """Регистрирует TTF-шрифты один раз; без них — встроенные (только латиница)."""
+    global _fonts
+    with _fonts_lock:
+        if _fonts is None:
+            files = _font_files()
+            if files and all(p.exists() for p in files.values()):
+                names = {kind: f"Report-{kind}" for kind in files}
+                for kind, path in files.items():
+                    pdfmetrics.registerFont(TTFont(names[kind], str(path)))
+                pdfmetrics.registerFontFamily(
+                    names["regular"], normal=names["regular"], bold=names["bold"],
+                    italic=names["italic"], boldItalic=names["bold"],
+                )
+                _fonts = _Fonts(**names)
+            else:
+                print("⚠️ no TTF font for PDF found, Cyrillic text will not render")
+                _fonts = _Fonts()
+        return _fonts
+
+
+def _styles(fonts: _Fonts) -> StyleSheet1:
+    styles = getSampleStyleSheet()
+    for name in ("Normal", "BodyText", "Italic", "Bullet", "Title"):
+        styles[name].fontName = fonts.regular
+    for level in range(1, 7):
+        styles[f"Heading{level}"].fontName = fonts.bold
+    styles["Title"].fontName = fonts.bold
+    styles["Normal"].leading = 14
+    styles.add(ParagraphStyle("Cell", parent=styles["Normal"], fontSize=8.5, leading=10.5))
+    styles.add(ParagraphStyle("HeaderCell", parent=styles["Cell"], fontName=fonts.bold))
+    styles.add(ParagraphStyle(
+        "Quote", parent=styles["Normal"], leftIndent=14, textColor=colors.HexColor("#475569"),
+    ))
+    styles.add(ParagraphStyle(
+        "Caption", parent=styles["Normal"], fontName=fonts.italic, fontSize=8.5,
+        alignment=TA_CENTER, textColor=colors.HexColor("#475569"),
+    ))
+    styles.add(ParagraphStyle(
+        "CodeBlock", parent=styles["Code"], fontName=fonts.mono, fontSize=7.5, leading=9.5,
+        backColor=colors.HexColor("#f1f5f9"), borderPadding=4, leftIndent=4, rightIndent=4,
+    ))
+    return styles
+
+
+# ============================
+# Inline-разметка
+# ============================
+
+_CODE_SPAN = re.compile(r"`([^`]+)`")
+# __жирный__ — только на границах слов и не для имён вида __init__
+_BOLD = re.compile(r"\*\*(.+?)\*\*|(?<!\w)__(?![\s_])(?![a-z0-9_]+__(?!\w))(.+?)(?<!\s)__(?!\w)")
+_ITALIC = re.compile(r"(?<![\w*])\*(?!\s)(.+?)(?<!\s)\*(?![\w*])")
+_LINK = re.compile(r"\[([^\]]+)\]\(([^)\s]+)\)")
+
+
+def _escape(text: str) -> str:
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def _link(m: re.Match) -> str:
+    href = m.group(2).replace('"', "&quot;")  # кавычка закрыла бы атрибут href
+    return f'<link href="{href}" color="#2563eb">{m.group(1)}</link>'
+
+
+def inline_markup(text: str, fonts: _Fonts) -> str:
+    """Markdown-разметка строки → мини-разметка Paragraph (код не трогается)."""
+    parts = _CODE_SPAN.split(text)
+    out = []
+    for i, part in enumerate(parts):
+        if i % 2:
+            out.append(f'<font face="{fonts.mono}">{_escape(part)}</font>')
+            continue
+        part = _escape(part)
+        part = _LINK.sub(_link, part)
+        part = _BOLD.sub(lambda m: f"<b>{m.group(1) or m.group(2)}</b>", part)
+        part = _ITALIC.sub(r"<i>\1</i>", part)
+        out.append(part)
+    return "".join(out)
+
+
+# ============================
+# Блоки
+# ============================
+
+_HEADING = re.compile(r"^(#{1,6})\s+(.*?)\s*#*\s*$")
+_LIST_ITEM = re.compile(r"^(\s*)([-*+]|\d+[.)])\s+(.*)$")
+_TABLE_SEP = re.compile(r"^\s*\|?\s*:?-{2,}:?\s*(\|\s*:?-{2,}:?\s*)*\|?\s*$")
+_IMAGE = re.compile(r"^\s*!\[([^\]]*)\]\(([^)]+)\)\s*$")
+_RULE = re.compile(r"^\s*([-*_])(\s*\1){2,}\s*$")
+_FENCE = re.compile(r"^\s*(```|~~~)")
+
+
+def _split_row(line: str) -> List[str]:
+    line = line.strip()
+    if line.startswith("|"):
+        line = line[1:]
+    if line.endswith("|"):
+        line = line[:-1]
+    return [cell.strip() for cell in line.split("|")]
+
+
+def resolve_image(target: str, base_dir: Path) -> Path:
+    """Путь картинки: абсолютный, относительно отчёта или DATA_DIR (графики)."""
+    path = Path(target.strip().strip("<>"))
+    if path.is_absolute():
+        return path
+    for base in (base_dir, settings.DATA_DIR):
+        if (base / path).exists():
+            return base / path
+    return base_dir / path
+
+
+def image_targets(text: str, base_dir: Path) -> List[Path]:
+    return [resolve_image(m.group(2), base_dir) for m in map(_IMAGE.match, text.splitlines()) if m]
+
+
+class MarkdownRenderer:
+    """Разбор Markdown построчно в список flowable'ов ReportLab."""
+
+    def __init__(self, base_dir: Optional[Path] = None) -> None:
+        self.base_dir = Path(base_dir) if base_dir else Path.cwd()
+        self.fonts = get_fonts()
+        self.styles = _styles(self.fonts)
+
+    def _p(self, text: str, style: str = "Normal") -> Paragraph:
+        try:
+            return Paragraph(inline_markup(text, self.fonts), self.styles[style])
+        except ValueError:
+            # разметка не разобралась (перекрёстная вложенность и т.п.) — блок простым текстом
+            return Paragraph(_escape(text), self.styles[style])
+
+    def _image(self, alt: str, target: str) -> List[Flowable]:
+        path = resolve_image(target, self.base_dir)
+        if not path.exists():
+            return [self._p(f"*[image not found: {target}]*", "Caption")]
+        try:
+            width, height = ImageReader(str(path)).getSize()
+        except Exception:
+            width = height = 0  # не картинка (PIL: UnidentifiedImageError) или битый файл
+        if width <= 0 or height <= 0:
+            return [self._p(f"*[image unreadable: {target}]*", "Caption")]
+        scale = min(CONTENT_WIDTH / width, 12 * cm / height, 1.0)
+        flowables: List[Flowable] = [Image(str(path), width * scale, height * scale)]
+        if alt:
+            flowables.append(self._p(alt, "Caption"))
+        return flowables
+
+    def _table(self, rows: List[List[str]]) -> Table:
+        ncols = max(len(r) for r in rows)
+        rows = [r + [""] * (ncols - len(r)) for r in rows]
+        data = [
+            [self._p(cell, "HeaderCell" if i == 0 else "Cell") for cell in row]
+            for i, row in enumerate(rows)
+        ]
+        table = Table(data, colWidths=[CONTENT_WIDTH / ncols] * ncols, repeatRows=1)
+        table.setStyle(TableStyle([
+            ("GRID", (0, 0), (-1, -1), 0.4, colors.HexColor("#cbd5e1")),
+            ("BACKGROUND", (0, 0), (-1, 0), colors.HexColor("#e2e8f0")),
+            ("ROWBACKGROUNDS", (0, 1), (-1, -1), [colors.white, colors.HexColor("#f8fafc")]),
+            ("VALIGN", (0, 0), (-1, -1), "TOP"),
+        ]))
+        return table
+
+    def _list(self, items: List[Tuple[int, bool, str]]) -> ListFlowable:
+        """items: (отступ, нумерованный, текст); вложенность — по отступу."""
+        base_indent, ordered = items[0][0], items[0][1]
+        entries: List[ListItem] = []
+        i = 0
+        while i < len(items):
+            indent, _, text = items[i]
+            j = i + 1
+            while j < len(items) and items[j][0] > base_indent:
+                j += 1
+            content: List[Flowable] = [self._p(text)]
+            if j > i + 1:
+                content.append(self._list(items[i + 1:j]))
+            entries.append(ListItem(content))
+            i = j
+        return ListFlowable(
+            entries,
+            bulletType="1" if ordered else "bullet",
+            start="1" if ordered else "•",
+            bulletFormat="%s." if ordered else None,
+            bulletFontName=self.fonts.regular,
+            leftIndent=14,
+        )
+
+    def flowables(self, text: str) -> List[Flowable]:
+        story: List[Flowable] = []
+        lines = text.splitlines()
+        paragraph: List[str] = []
+
+        def flush_paragraph() -> None:
+            if paragraph:
+                story.append(self._p(" ".join(s.strip() for s in paragraph)))
+                story.append(Spacer(1, 4))
+                paragraph.clear()
+
+        i = 0
+        while i < len(lines):
+            line = lines[i]
+
+            if not line.strip():
+                flush_paragraph()
+                i += 1
+                continue
+
+            if _FENCE.match(line):
+                flush_paragraph()
+                fence = _FENCE.match(line).group(1)
+                code: List[str] = []
+                i += 1
+                while i < len(lines) and not lines[i].strip().startswith(fence):
+                    code.append(lines[i])
+                    i += 1
+                story.append(Preformatted("\n".join(code), self.styles["CodeBlock"], maxLineLength=110))
+                story.append(Spacer(1, 6))
+                i += 1
+                continue
+
+            heading = _HEADING.match(line)
+            if heading:
+                flush_paragraph()
+                story.append(self._p(heading.group(2), f"Heading{len(heading.group(1))}"))
+                i += 1
+                continue
+
+            if _RULE.match(line):
+                flush_paragraph()
+                story.append(HRFlowable(width="100%", thickness=0.5, color=colors.HexColor("#cbd5e1")))
+                i += 1
+                continue
+
+            image = _IMAGE.match(line)
+            if image:
+                flush_paragraph()
+                story.extend(self._image(image.group(1), image.group(2)))
+                story.append(Spacer(1, 6))
+                i += 1
+                continue
+
+            if "|" in line and i + 1 < len(lines) and _TABLE_SEP.match(lines[i + 1]):
+                flush_paragraph()
+                rows = [_split_row(line)]
+                i += 2
+                while i < len(lines) and "|" in lines[i] and lines[i].strip():
+                    rows.append(_split_row(lines[i]))
+                    i += 1
+                story.append(self._table(rows))
+                story.append(Spacer(1, 6))
+                continue
+
+            if _LIST_ITEM.match(line):
+                flush_paragraph()
+                items: List[Tuple[int, bool, str]] = []
+                while i < len(lines):
+                    match = _LIST_ITEM.match(lines[i])
+                    if match:
+                        indent = len(match.group(1).expandtabs(4))
+                        ordered = match.group(2)[0].isdigit()
+                        if items and indent <= items[0][0] and ordered != items[0][1]:
+                            break  # смена маркера — начинается новый список
+                        items.append((indent, ordered, match.group(3)))
+                    elif lines[i].strip() and lines[i].startswith((" ", "\t")) and items:
+                        # продолжение пункта на следующей строке
+                        indent, ordered, text_ = items[-1]
+                        items[-1] = (indent, ordered, f"{text_} {lines[i].strip()}")
+                    else:
+                        break
+                    i += 1
+                story.append(self._list(items))
+                story.append(Spacer(1, 4))
+                continue
+
+            if line.lstrip().startswith(">"):
+                flush_paragraph()
+                quote: List[str] = []
+                while i < len(lines) and lines[i].lstrip().startswith(">"):
+                    quote.append(lines[i].lstrip()[1:].strip())
+                    i += 1
+                story.append(self._p(" ".join(quote), "Quote"))
+                story.append(Spacer(1, 4))
+                continue
+
+            paragraph.append(line)
+            i += 1
+
+        flush_paragraph()
+        return story
+
+
+def _atomic_build(story: List[Flowable], pdf_path: Path, title: str) -> None:
+    pdf_path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=f".{pdf_path.stem}.", suffix=".tmp", dir=str(pdf_path.parent))
+    os.close(fd)
+    try:
+        doc = SimpleDocTemplate(
+            tmp, pagesize=PAGE_SIZE, title=title,
+            leftMargin=MARGIN, rightMargin=MARGIN, topMargin=MARGIN, bottomMargin=MARGIN,
+        )
+        doc.build(story)
+        os.replace(tmp, pdf_path)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+
+def markdown_to_pdf(text: str, pdf_path: Path, base_dir: Optional[Path] = None, title: str = "Investment Report") -> Path:
+    """Рендерит Markdown в pdf_path (атомарно: temp-файл + os.replace)."""
+    story = MarkdownRenderer(base_dir).flowables(text)
+    _atomic_build(story, Path(pdf_path), title)
+    return Path(pdf_path)
+
+
+# ============================
+# Кэш и пул рендеринга
+# ============================
+
+@dataclass
+class PdfStats:
+    hits: int = 0
+    renders: int = 0
+    render_seconds: float = 0.0
+
+    def report(self) -> str:
+        return (
+            f"pdf: {self.renders} renders ({self.render_seconds:.2f}s), {self.hits} cache hits"
+        )
+
+
+class PdfRenderer:
+    """
+    PDF по содержимому Markdown: <cache_dir>/<sha256>.pdf. submit() отдаёт
+    Future — Flask ждёт его в своём потоке, ASGI — через asyncio.wrap_future.
+    """
+
+    def __init__(
+        self,
+        cache_dir: Optional[Path] = None,
+        max_workers: Optional[int] = None,
+        max_files: Optional[int] = None,
+    ) -> None:
+        self.cache_dir = Path(cache_dir or settings.PDF_CACHE_DIR)
+        self.max_files = max_files or settings.PDF_CACHE_FILES
+        self.stats = PdfStats()
+        self._pool = ThreadPoolExecutor(
+            max_workers=max_workers or settings.PDF_RENDER_WORKERS, thread_name_prefix="pdf-render"
+        )
+        self._locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def cache_key(self, text: str, base_dir: Path) -> str:
+        h = hashlib.sha256(f"v{RENDERER_VERSION}\x1f".encode("utf-8"))
+        h.update(text.encode("utf-8"))
+        # график мог перерисоваться под тем же именем — учитываем и картинки
+        for path in image_targets(text, base_dir):
+            h.update(str(path).encode("utf-8"))
+            if path.exists():
+                h.update(path.read_bytes())
+        return h.hexdigest()
+
+    def _key_lock(self, key: str) -> threading.Lock:
+        with self._lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def _get(self, md_path: Path) -> Path:
+        return self._get_text(md_path.read_text(encoding="utf-8"), md_path.parent, md_path.stem)
+
+    def _get_text(self, text: str, base_dir: Path, title: str) -> Path:
+        key = self.cache_key(text, base_dir)
+        pdf_path = self.cache_dir / f"{key}.pdf"
+        with self._key_lock(key):
+            # одновременные запросы одного отчёта ждут первый рендер
+            if pdf_path.exists():
+                self.stats.hits += 1
+                os.utime(pdf_path)  # LRU-порядок для _prune
+                return pdf_path
+            started = time.perf_counter()
+            markdown_to_pdf(text, pdf_path, base_dir=base_dir, title=title)
+            self.stats.renders += 1
+            self.stats.render_seconds += time.perf_counter() - started
+        with self._lock:
+            self._locks.pop(key, None)
+        self._prune()
+        return pdf_path
+
+    def _prune(self) -> None:
+        files = sorted(self.cache_dir.glob("*.pdf"), key=lambda p: p.stat().st_mtime, reverse=True)
+        for stale in files[self.max_files:]:
+            stale.unlink(missing_ok=True)
+
+    def submit(self, md_path: Path) -> "Future[Path]":
+        """Чтение, хэш и рендер — в пуле, не в потоке запроса."""
+        return self._pool.submit(self._get, Path(md_path))
+
+    def submit_text(self, text: str, base_dir: Optional[Path] = None, title: str = "report") -> "Future[Path]":
+        """То же для текста, которого нет в файле (отчёт из report_store)."""
+        return self._pool.submit(self._get_text, text, Path(base_dir or settings.DATA_DIR), title)
+
+    def render(self, md_path: Path) -> Path:
+        return self.submit(md_path).result()
+
+
+_renderer: Optional[PdfRenderer] = None
+_renderer_lock = threading.Lock()
+
+
+def get_pdf_renderer() -> PdfRenderer:
+    global _renderer
+    with _renderer_lock:
+        if _renderer is None:
+            _renderer = PdfRenderer()
+        return _renderer
+
+
+# ============================
+# Бенчмарк
+# ============================
+
+def _synthetic_report(tickers: int, chart: Optional[Path]) -> str:
+    parts = ["# Final Investment Report", "", "Generated: 2025-01-01 00:00:00", ""]
+    for t in range(tickers):
+        name = f"TCK{t}"
+        parts += [
+            f"## {name}",
+            "",
+            f"**Рекомендация:** *Hold* на горизонте 6–12 месяцев; `RSI=54.2`. "
+            "Компания показывает устойчивый рост выручки, маржа стабильна, но оценка "
+            "уже учитывает большую часть позитивных ожиданий рынка.",
+            "",
+            "### Key metrics",
+            "",
+            "| Metric | Value | Comment |",
+            "|---|---:|---|",
+            "| P/E | 28.4 | выше среднего по сектору |",
+            "| Revenue growth | 12.5% | стабильный рост |",
+            "| Max drawdown | -18.2% | за последний год |",
+            "",
+            "### Risks",
+            "",
+            "1. Регуляторные изменения",
+            "2. Концентрация выручки",
+            "   - крупнейший клиент — 30% выручки",
+            "   - валютный риск",
+            "3. Цепочки поставок",
+            "",
+        ]
+        if chart is not None:
+            parts += [f"![{name} adjusted close]({chart})", ""]
+    return "\n".join(parts)
+
+
+def _legacy_pdf(md_path: Path, pdf_path: Path) -> None:
+    """Прежний create_pdf_from_md: Paragraph на строку, без разметки."""
+    styles = getSampleStyleSheet()
+    story = []
+    with open(md_path, "r", encoding="utf-8") as f:
+        for line in f:
+            story.append(Paragraph(line.replace("&", "&amp;"), styles["Normal"]))
+    SimpleDocTemplate(str(pdf_path), pagesize=A4).build(story)
+
+
+def _benchmark(tickers: int = 30, concurrent: int = 8) -> None:
+    import matplotlib
+    matplotlib.use("Agg")
+    from matplotlib.figure import Figure
+    import numpy as np
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        fig = Figure(figsize=(8, 3.5))
+        fig.add_subplot(111).plot(np.cumsum(np.random.default_rng(0).normal(size=250)))
+        chart = tmp / "chart.png"
+        fig.savefig(chart, dpi=100)
+
+        md_path = tmp / "final_investment_report.md"
+        md_path.write_text(_synthetic_report(tickers, chart), encoding="utf-8")
+
+        started = time.perf_counter()
+        _legacy_pdf(md_path, tmp / "legacy.pdf")
+        legacy = time.perf_counter() - started
+
+        renderer = PdfRenderer(cache_dir=tmp / "cache")
+        started = time.perf_counter()
+        pdf_path = renderer.render(md_path)
+        cold = time.perf_counter() - started
+
+        started = time.perf_counter()
+        renderer.render(md_path)
+        cached = time.perf_counter() - started
+
+        # одновременные скачивания нового отчёта: один рендер на всех
+        md_path.write_text(_synthetic_report(tickers, chart) + "\nupdated\n", encoding="utf-8")
+        renders_before = renderer.stats.renders
+        started = time.perf_counter()
+        futures = [renderer.submit(md_path) for _ in range(concurrent)]
+        paths = {f.result() for f in futures}
+        burst = time.perf_counter() - started
+
+        print(f"📄 report: {len(md_path.read_text(encoding='utf-8').splitlines())} lines, {tickers} tickers, "
+              f"PDF {pdf_path.stat().st_size / 1024:.0f} KB")
+        print(f"🐢 legacy (paragraph per line): {legacy * 1000:.0f} ms, plain text only")
+        print(f"🖨️ renderer, cold: {cold * 1000:.0f} ms (headings, tables, lists, {tickers} charts)")
+        print(f"⚡ renderer, cache hit: {cached * 1000:.1f} ms")
+        print(f"👥 {concurrent} concurrent downloads of a new report: {burst * 1000:.0f} ms, "
+              f"{renderer.stats.renders - renders_before} render(s), {len(paths)} file(s)")
+        leftovers = list((tmp / "cache").glob("*.tmp"))
+        print(f"🧹 temp files left: {len(leftovers)}")
+
+
+if __name__ == "__main__":
+    _benchmark()
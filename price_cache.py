@@ -0,0 +1,334 @@
+# price_cache.py
+
+"""
+Локальный колоночный кэш OHLCV под settings.DATA_DIR/price_cache.
+
+Раскладка: <interval>/<TICKER>.idx   – int64 timestamps (ns, UTC)
+           <interval>/<TICKER>.f8    – float64 матрица rows x columns
+           <interval>/<TICKER>.json  – метаданные (колонки, число строк, tz,
+                                        время последнего обновления)
+
+Данные читаются через np.memmap, новые бары дописываются в конец файлов.
+Коммит-точка — атомарная запись .json: всё, что лежит в файлах дальше
+meta["rows"], считается мусором и обрезается при следующей записи.
+Чтение и запись ключа идут под межпроцессной блокировкой (file_lock):
+кэш общий для параллельных запусков дашборда.
+
+CachedPriceProvider оборачивает любой PriceProvider: свежие тикеры
+отдаются из кэша, устаревшие докачиваются только с последнего бара.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import inspect
+import json
+import os
+import re
+import shutil
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from .config import settings
+from .file_lock import atomic_file, file_lock
+
+
+# ============================
+# Статистика
+# ============================
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    stale: int = 0
+    bars_from_cache: int = 0
+    bars_fetched: int = 0
+
+    def report(self) -> str:
+        total = self.hits + self.misses + self.stale
+        hit_rate = self.hits / total if total else 0.0
+        return (
+            f"price cache: {self.hits} hits, {self.stale} delta refreshes, "
+            f"{self.misses} misses (hit rate {hit_rate:.0%}); "
+            f"bars from cache: {self.bars_from_cache}, fetched: {self.bars_fetched}"
+        )
+
+
+# ============================
+# Хранилище
+# ============================
+
+def _safe_name(ticker: str) -> str:
+    return re.sub(r"[^A-Za-z0-9._-]", "_", ticker)
+
+
+def _atomic_write_json(path: Path, payload: dict) -> None:
+    with atomic_file(path) as f:
+        f.write(json.dumps(payload).encode("utf-8"))
+
+
+class PriceCache:
+    """Кэш баров по ключу (ticker, interval) с TTL и инвалидацией."""
+
+    def __init__(self, root: Optional[Path] = None, ttl: Optional[float] = None) -> None:
+        self.root = Path(root or settings.DATA_DIR / "price_cache")
+        self.ttl = ttl if ttl is not None else settings.PRICE_CACHE_TTL
+        self.stats = CacheStats()
+
+    def _paths(self, ticker: str, interval: str):
+        base = self.root / interval / _safe_name(ticker)
+        return base.with_suffix(".json"), base.with_suffix(".idx"), base.with_suffix(".f8")
+
+    # ---------- чтение ----------
+
+    def meta(self, ticker: str, interval: str) -> Optional[dict]:
+        meta_path, _, _ = self._paths(ticker, interval)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def is_fresh(self, meta: dict) -> bool:
+        return time.time() - meta.get("fetched_at", 0) < self.ttl
+
+    def last_timestamp(self, meta: dict) -> Optional[pd.Timestamp]:
+        if not meta.get("rows"):
+            return None
+        return self._to_index(np.array([meta["last_ts"]], dtype=np.int64), meta.get("tz"))[0]
+
+    @staticmethod
+    def _to_index(ns: np.ndarray, tz: Optional[str]) -> pd.DatetimeIndex:
+        idx = pd.DatetimeIndex(ns.view("datetime64[ns]"), name="Date")
+        if tz:
+            idx = idx.tz_localize("UTC").tz_convert(tz)
+        return idx
+
+    def read(self, ticker: str, interval: str) -> Optional[pd.DataFrame]:
+        meta_path, idx_path, val_path = self._paths(ticker, interval)
+        with file_lock(meta_path):
+            meta = self.meta(ticker, interval)
+            if meta is None:
+                return None
+            rows, cols = meta["rows"], meta["columns"]
+            if rows == 0:
+                return pd.DataFrame(columns=cols)
+
+            # копия, а не view: другой процесс может обрезать файлы после выхода из блокировки
+            idx = np.array(np.memmap(idx_path, dtype=np.int64, mode="r", shape=(rows,)))
+            values = np.array(np.memmap(val_path, dtype=np.float64, mode="r", shape=(rows, len(cols))))
+        return pd.DataFrame(values, index=self._to_index(idx, meta.get("tz")), columns=cols)
+
+    # ---------- запись ----------
+
+    @staticmethod
+    def _encode(df: pd.DataFrame):
+        index = pd.DatetimeIndex(df.index).as_unit("ns")
+        tz = str(index.tz) if index.tz is not None else None
+        ns = index.tz_convert("UTC").asi8 if tz else index.asi8
+        values = df.to_numpy(dtype=np.float64, na_value=np.nan)
+        return np.ascontiguousarray(ns, dtype=np.int64), np.ascontiguousarray(values), tz
+
+    def write(self, ticker: str, interval: str, df: pd.DataFrame) -> None:
+        """Полная перезапись ключа."""
+        meta_path, idx_path, val_path = self._paths(ticker, interval)
+        with file_lock(meta_path):
+            self._write(ticker, interval, df)
+
+    def _write(self, ticker: str, interval: str, df: pd.DataFrame) -> None:
+        meta_path, idx_path, val_path = self._paths(ticker, interval)
+        df = df[~df.index.duplicated(keep="last")].sort_index()
+        ns, values, tz = self._encode(df)
+
+        for path, arr in ((idx_path, ns), (val_path, values)):
+            with atomic_file(path) as f:
+                f.write(arr.tobytes())
+
+        _atomic_write_json(meta_path, {
+            "ticker": ticker,
+            "interval": interval,
+            "columns": [str(c) for c in df.columns],
+            "rows": int(len(ns)),
+            "tz": tz,
+            "last_ts": int(ns[-1]) if len(ns) else None,
+            "fetched_at": time.time(),
+        })
+
+    def append(self, ticker: str, interval: str, df: pd.DataFrame) -> int:
+        """
+        Дописывает бары начиная с первого таймстемпа df. Уже закэшированные
+        бары с таймстемпом >= него заменяются (последний дневной бар мог
+        быть неполным). Возвращает число записанных строк.
+        """
+        with file_lock(self._paths(ticker, interval)[0]):
+            return self._append(ticker, interval, df)
+
+    def _append(self, ticker: str, interval: str, df: pd.DataFrame) -> int:
+        meta = self.meta(ticker, interval)
+        if meta is None:
+            self.write(ticker, interval, df)
+            return len(df)
+        if df.empty:
+            self.touch(ticker, interval)
+            return 0
+
+        df = df[~df.index.duplicated(keep="last")].sort_index()
+        df.columns = [str(c) for c in df.columns]
+        if list(df.columns) != meta["columns"]:
+            extra = [c for c in df.columns if c not in meta["columns"]]
+            if extra:
+                # новые колонки: история получает NaN в них и переписывается целиком
+                columns = meta["columns"] + extra
+                old = self.read(ticker, interval)
+                merged = pd.concat([
+                    old[old.index < df.index[0]].reindex(columns=columns),
+                    df.reindex(columns=columns),
+                ])
+                self.write(ticker, interval, merged)
+                return len(df)
+            # другой порядок (или часть колонок) — приводим дельту к сохранённым
+            df = df.reindex(columns=meta["columns"])
+
+        meta_path, idx_path, val_path = self._paths(ticker, interval)
+        ns, values, _ = self._encode(df)
+
+        rows = meta["rows"]
+        if rows:
+            old_idx = np.memmap(idx_path, dtype=np.int64, mode="r", shape=(rows,))
+            keep = int(np.searchsorted(old_idx, ns[0], side="left"))
+            del old_idx
+        else:
+            keep = 0
+
+        ncols = len(meta["columns"])
+        with open(idx_path, "r+b") as f:
+            f.truncate(keep * 8)
+            f.seek(0, os.SEEK_END)
+            f.write(ns.tobytes())
+        with open(val_path, "r+b") as f:
+            f.truncate(keep * ncols * 8)
+            f.seek(0, os.SEEK_END)
+            f.write(values.tobytes())
+
+        meta.update(rows=keep + len(ns), last_ts=int(ns[-1]), fetched_at=time.time())
+        _atomic_write_json(meta_path, meta)
+        return len(ns)
+
+    def touch(self, ticker: str, interval: str) -> None:
+        meta_path = self._paths(ticker, interval)[0]
+        with file_lock(meta_path):
+            meta = self.meta(ticker, interval)
+            if meta is not None:
+                meta["fetched_at"] = time.time()
+                _atomic_write_json(meta_path, meta)
+
+    def invalidate(self, ticker: Optional[str] = None, interval: Optional[str] = None) -> int:
+        """
+        Удаляет записи кэша: конкретный ключ, все интервалы тикера,
+        весь интервал или (без аргументов) весь кэш. Возвращает число ключей.
+        """
+        if ticker is None and interval is None:
+            removed = len(list(self.root.glob("*/*.json")))
+            shutil.rmtree(self.root, ignore_errors=True)
+            return removed
+
+        intervals = [interval] if interval else [p.name for p in self.root.glob("*") if p.is_dir()]
+        removed = 0
+        for iv in intervals:
+            if ticker is None:
+                removed += len(list((self.root / iv).glob("*.json")))
+                shutil.rmtree(self.root / iv, ignore_errors=True)
+                continue
+            paths = self._paths(ticker, iv)
+            if paths[0].exists():
+                removed += 1
+            for p in paths:
+                p.unlink(missing_ok=True)
+        return removed
+
+
+# ============================
+# Провайдер поверх кэша
+# ============================
+
+class CachedPriceProvider:
+    """
+    PriceProvider с кэшем:
+    - свежий ключ (моложе TTL) – отдаём из кэша без сети;
+    - устаревший – докачиваем бары начиная с последнего закэшированного;
+    - отсутствующий – полная загрузка через внутренний провайдер.
+    Тикеры с одинаковой точкой старта докачиваются одним батчем.
+    """
+
+    def __init__(self, inner, cache: Optional[PriceCache] = None, interval: str = "1d") -> None:
+        self.inner = inner
+        self.cache = cache or PriceCache()
+        self.interval = getattr(inner, "interval", interval)
+
+    async def _fetch_inner(self, tickers: List[str], start=None) -> Dict[str, pd.DataFrame]:
+        fetch = self.inner.fetch_batch
+        if inspect.iscoroutinefunction(fetch):
+            return await fetch(tickers, start=start)
+        return await asyncio.to_thread(fetch, tickers, start=start)
+
+    async def fetch_batch(self, tickers: List[str], start=None) -> Dict[str, pd.DataFrame]:
+        cache, stats = self.cache, self.cache.stats
+        result: Dict[str, pd.DataFrame] = {}
+        missing: List[str] = []
+        delta: Dict[pd.Timestamp, List[str]] = defaultdict(list)
+
+        for t in tickers:
+            meta = cache.meta(t, self.interval)
+            if meta is None or not meta.get("rows"):
+                missing.append(t)
+            elif cache.is_fresh(meta):
+                result[t] = cache.read(t, self.interval)
+                stats.hits += 1
+                stats.bars_from_cache += len(result[t])
+            else:
+                delta[cache.last_timestamp(meta)].append(t)
+
+        for since, group in delta.items():
+            stats.stale += len(group)
+            try:
+                frames = await self._fetch_inner(group, start=since)
+                fetched = True
+            except Exception as e:
+                # сеть недоступна – лучше устаревшие бары, чем никаких; свежесть
+                # не обновляем, чтобы следующий запуск снова попробовал докачать
+                print(f"⚠️ Delta refresh failed, serving stale cache for {group}: {e}")
+                frames, fetched = {}, False
+            for t in group:
+                new_bars = frames.get(t)
+                appended = 0
+                if new_bars is None:
+                    if fetched:
+                        cache.touch(t, self.interval)  # новых баров нет — кэш актуален
+                else:
+                    appended = cache.append(t, self.interval, new_bars)
+                    stats.bars_fetched += appended
+                result[t] = cache.read(t, self.interval)
+                stats.bars_from_cache += len(result[t]) - appended
+
+        if missing:
+            stats.misses += len(missing)
+            try:
+                frames = await self._fetch_inner(missing)
+            except Exception:
+                # без частичного результата пусть коллектор ретраит весь чанк
+                if not result:
+                    raise
+                frames = {}
+            for t, df in frames.items():
+                cache.write(t, self.interval, df)
+                stats.bars_fetched += len(df)
+                result[t] = df
+
+        return result
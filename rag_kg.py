@@ -1,43 +1,179 @@
+import hashlib
+from dataclasses import dataclass
 from pathlib import Path
-from typing import List
+from typing import Dict, List, Optional, Set, Tuple
 
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_community.vectorstores import Chroma
+from langchain_chroma import Chroma
 from langchain_core.documents import Document
 
 from .config import settings
-from .pdf_loader import load_pdf_as_documents
+from .embeddings import get_embeddings
+from .file_lock import file_lock
+from .knowledge_graph import KnowledgeGraph, update_graph_from_docs
+from .retrieval import HybridRetriever, get_retriever
+from .pdf_loader import load_pdf_as_documents, load_pdf_directory, pdf_ticker
 
 
 PDF_PATH = "/Users/nurseiitzhuzbay/PycharmProjects/PythonProject/Publications_Article_232_29_03_12_The_phenomenal_rise_in_Apple’s.pdf"
+# статья про Apple; для каталога PDF тикер берётся из пути (pdf_ticker)
+PDF_TICKER = "AAPL"
 
+COLLECTION_NAME = "mas_documents_v2"
 
-def build_vector_store(docs: List[Document]):
-    if Path(PDF_PATH).exists():
-        pdf_docs = load_pdf_as_documents(PDF_PATH)
-        all_docs = docs + pdf_docs
-    else:
-        print("⚠️ PDF not found, continuing without article")
-        all_docs = docs
-
-    embeddings = HuggingFaceEmbeddings(
-        model_name=settings.HF_EMBEDDING_MODEL
-    )
+# Источники-«снимки»: новая версия полностью заменяет старую для тикера
+SNAPSHOT_SOURCES = ("price_table", "technical_indicators", "image_caption")
+
+
+@dataclass
+class UpsertReport:
+    embedded: int = 0
+    skipped: int = 0
+    deleted: int = 0
+
+    def __str__(self) -> str:
+        return (
+            f"vector store: embedded {self.embedded}, "
+            f"skipped {self.skipped} unchanged, deleted {self.deleted} superseded"
+        )
+
+
+def document_id(doc: Document) -> str:
+    """
+    Детерминированный id: ticker/source (+ page для PDF) и хэш содержимого.
+    Один и тот же документ всегда получает один и тот же id.
+    """
+    meta = doc.metadata
+    parts = [
+        str(meta.get("ticker", "UNKNOWN")),
+        str(meta.get("source", "")),
+        str(meta.get("page", "")),
+        doc.page_content,
+    ]
+    digest = hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+    return f"{meta.get('ticker', 'UNKNOWN')}:{meta.get('source', 'doc')}:{digest[:32]}"
 
-    vectordb = Chroma.from_documents(
-        documents=all_docs,
-        embedding=embeddings,
+
+def open_vector_store(embeddings=None) -> Chroma:
+    return Chroma(
+        collection_name=COLLECTION_NAME,
+        embedding_function=embeddings or get_embeddings("rag_kg"),
         persist_directory=str(settings.VECTOR_DB_DIR),
     )
 
-    return vectordb
 
+_vector_store: Optional[Chroma] = None
+
+
+def get_vector_store() -> Chroma:
+    """Коллекция, открытая один раз на процесс (прогретый воркер не переоткрывает её)."""
+    global _vector_store
+    if _vector_store is None:
+        _vector_store = open_vector_store()
+    return _vector_store
 
-def build_knowledge_graph(docs: List[Document]):
-    graph = {}
 
+def upsert_documents(
+    vectordb: Chroma,
+    docs: List[Document],
+    retriever: Optional[HybridRetriever] = None,
+) -> UpsertReport:
+    """
+    Эмбеддит только новые/изменённые документы; устаревшие снимки
+    (price_table и т.п.) по тикеру удаляются.
+    retriever (если передан) синхронизируется и сбрасывает мемоизацию.
+    """
+    report = UpsertReport()
+
+    unique: Dict[str, Document] = {}
     for d in docs:
-        ticker = d.metadata.get("ticker", "UNKNOWN")
-        graph.setdefault(ticker, []).append(d.page_content)
+        unique.setdefault(document_id(d), d)
+    report.skipped += len(docs) - len(unique)
+
+    ids = list(unique)
+    existing: Set[str] = set(vectordb.get(ids=ids, include=[])["ids"]) if ids else set()
+    new_ids = [i for i in ids if i not in existing]
+    report.skipped += len(existing)
+
+    if new_ids:
+        vectordb.add_documents([unique[i] for i in new_ids], ids=new_ids)
+        report.embedded = len(new_ids)
+    if retriever is not None:
+        # векторы уже в Chroma — обновляем только лексический индекс; коллекция
+        # общая для прогретых воркеров, поэтому «существующие» id, вставленные
+        # другим процессом, этому ретриверу тоже могут быть неизвестны
+        unknown = retriever.missing(ids)
+        if unknown:
+            retriever.add(unknown, [unique[i] for i in unknown], embed=False)
+
+    # удаляем устаревшие снимки тех тикеров/источников, что пришли в этом батче
+    current: Dict[Tuple[str, str], Set[str]] = {}
+    for i, d in unique.items():
+        source = d.metadata.get("source")
+        if source in SNAPSHOT_SOURCES:
+            current.setdefault((d.metadata.get("ticker", "UNKNOWN"), source), set()).add(i)
+
+    stale: List[str] = []
+    for (ticker, source), keep in current.items():
+        found = vectordb.get(
+            where={"$and": [{"ticker": ticker}, {"source": source}]}, include=[]
+        )["ids"]
+        stale.extend(i for i in found if i not in keep)
+    if stale:
+        vectordb.delete(ids=stale)
+        report.deleted = len(stale)
+    if retriever is not None:
+        # снимки, уже удалённые из Chroma другим воркером, остаются только здесь
+        forgotten = set(stale)
+        for (ticker, source), keep in current.items():
+            forgotten.update(i for i in retriever.ids_for(ticker, source) if i not in keep)
+        if forgotten:
+            retriever.remove(sorted(forgotten))
+
+    return report
+
+
+def load_pdf_documents(docs: List[Document]) -> List[Document]:
+    """Чанки PDF_PATH (файл или каталог) с тикерами из docs текущего прогона."""
+    tickers = {d.metadata["ticker"] for d in docs if d.metadata.get("ticker")}
+    if Path(PDF_PATH).is_dir():
+        return load_pdf_directory(PDF_PATH, tickers=tickers)
+    if Path(PDF_PATH).exists():
+        return load_pdf_as_documents(PDF_PATH, ticker=PDF_TICKER or pdf_ticker(PDF_PATH, tickers))
+    print("⚠️ PDF not found, continuing without article")
+    return []
+
+
+def build_vector_store(docs: List[Document], pdf_docs: Optional[List[Document]] = None):
+    if pdf_docs is None:
+        pdf_docs = load_pdf_documents(docs)
+    all_docs = docs + pdf_docs
+
+    vectordb = get_vector_store()
+    report = upsert_documents(vectordb, all_docs, retriever=get_retriever(vectordb))
+    print(f"🧮 {report}")
+
+    return vectordb
+
+
+def build_knowledge_graph(
+    docs: List[Document],
+    indicator_summary: Optional[Dict[str, Dict[str, float]]] = None,
+) -> KnowledgeGraph:
+    """
+    Дополняет персистентный граф знаний документами текущего прогона
+    (новые узлы/рёбра добавляются инкрементально) и сохраняет его.
+    """
+    # load -> update -> save под межпроцессной блокировкой: параллельные
+    # запуски дашборда иначе теряли бы узлы друг друга
+    with file_lock(settings.KG_STORE_PATH):
+        graph = KnowledgeGraph.load()
+        added = update_graph_from_docs(graph, docs, indicator_summary)
+        graph.save()
+    print(f"🕸️ knowledge graph: {len(graph)} nodes, {graph.edge_count} edges (+{added})")
+    return graph
+
 
-    return graph
\ No newline at end of file
+def knowledge_graph_contexts(tickers: List[str]) -> Dict[str, str]:
+    """k-hop окружение каждого тикера из сохранённого графа."""
+    graph = KnowledgeGraph.load()
+    return {t: graph.context_for(t) for t in tickers}
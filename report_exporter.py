@@ -1,27 +1,43 @@
 from pathlib import Path
 from datetime import datetime
+from typing import Iterable, Optional
 
+from .report_store import atomic_write_bytes, get_report_store
 
-def save_markdown_report(text: str, filename: str = "final_investment_report.md") -> str:
+
+def save_markdown_report(
+    text: str,
+    filename: str = "final_investment_report.md",
+    output_dir: Optional[str] = None,
+    run_id: Optional[str] = None,
+    tickers: Iterable[str] = (),
+) -> str:
     """
-    Saves the final investment report as a Markdown file inside the project directory.
-    Creates the file if it doesn't exist and overwrites previous content.
+    Saves the final investment report into the versioned report store
+    (keyed by run ID, tickers and timestamp) and refreshes the "latest"
+    copy at output_dir/filename. Both writes are atomic, so readers never
+    see a half-written file.
 
     :param text: Report text in Markdown format
     :param filename: Output file name (default: final_investment_report.md)
-    :return: Full path to the file
+    :param output_dir: Target directory (default: the project directory)
+    :param run_id: Run ID for the store (default: generated)
+    :param tickers: Tickers covered by the report (for querying the store)
+    :return: Full path to the "latest" file
     """
-    # Determine path relative to current file
-    base_dir = Path(__file__).resolve().parent
+    # Determine path relative to current file (or the per-job directory)
+    base_dir = Path(output_dir) if output_dir else Path(__file__).resolve().parent
+    base_dir.mkdir(parents=True, exist_ok=True)
     output_path = base_dir / filename
 
     # Add automatic timestamp to the top of report
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     full_text = f"# Final Investment Report\n\nGenerated: {timestamp}\n\n{text}"
 
-    # Write to file
-    with open(output_path, "w", encoding="utf-8") as f:
-        f.write(full_text)
+    # Versioned copy + index entry, then the "latest" file
+    record = get_report_store().save(full_text, tickers, run_id=run_id)
+    print(f"🗄️ report {record.run_id} stored ({record.stored_size} bytes, {record.compression})")
+    atomic_write_bytes(output_path, full_text.encode("utf-8"))
 
     return str(output_path)
 
@@ -36,4 +52,18 @@ def save_txt_report(text: str, filename: str = "final_investment_report.txt") ->
     with open(output_path, "w", encoding="utf-8") as f:
         f.write(text)
 
-    return str(output_path)
\ No newline at end of file
+    return str(output_path)
+
+
+def create_pdf_from_md(md_path: Path, pdf_path: Path) -> None:
+    """
+    Renders a Markdown report into a PDF (headings, lists, tables, charts).
+    The file is written atomically; see pdf_renderer for the cached variant
+    used by the dashboards.
+    """
+    from .pdf_renderer import markdown_to_pdf
+
+    md_path = Path(md_path)
+    if not md_path.exists():
+        return
+    markdown_to_pdf(md_path.read_text(encoding="utf-8"), Path(pdf_path), base_dir=md_path.parent)
@@ -0,0 +1,385 @@
+# report_store.py
+
+"""
+Версионированное хранилище отчётов.
+
+- каждый прогон — отдельный файл <REPORT_STORE_DIR>/YYYY/MM/<run_id>.md
+  (или .md.zst при REPORT_COMPRESSION="zstd"); старые отчёты больше
+  не затираются;
+- запись атомарная: временный файл в том же каталоге, fsync, os.replace —
+  читатель видит либо старую, либо полную новую версию;
+- SQLite-индекс (run_id, время, тикеры, размер, sha256): список и поиск
+  по тикеру / диапазону дат без обхода файловой системы;
+- политика хранения: не старше REPORT_RETENTION_DAYS и не больше
+  REPORT_MAX_COUNT последних отчётов;
+- diff двух отчётов (unified diff) для дашборда.
+"""
+
+from __future__ import annotations
+
+import difflib
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Iterable, List, Optional, Sequence
+
+from .config import settings
+
+
+try:
+    import zstandard
+except ImportError:  # сжатие опционально
+    zstandard = None
+
+
+def new_run_id() -> str:
+    """Сортируется по времени: 20250101-120000-<8 hex>."""
+    return f"{datetime.now():%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:8]}"
+
+
+def parse_time(value: Optional[str]) -> Optional[float]:
+    """Параметр запроса: unix-время или ISO-дата (2025-01-31, 2025-01-31T12:00)."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def query_filters(params) -> dict:
+    """Фильтры для ReportStore.list из параметров запроса (Flask и ASGI)."""
+    return {
+        "ticker": params.get("ticker") or None,
+        "since": parse_time(params.get("since")),
+        "until": parse_time(params.get("until")),
+        "limit": min(int(params.get("limit") or 50), 500),
+        "offset": int(params.get("offset") or 0),
+    }
+
+
+def atomic_write_bytes(path: Path, data: bytes) -> None:
+    """Запись через временный файл + os.replace (атомарно в пределах ФС)."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=f".{path.name}.", suffix=".tmp", dir=str(path.parent))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+
+@dataclass
+class ReportRecord:
+    run_id: str
+    created: float
+    tickers: List[str]
+    path: str
+    compression: str
+    size: int
+    stored_size: int
+    sha256: str
+
+    def to_dict(self) -> dict:
+        data = asdict(self)
+        data["created_iso"] = datetime.fromtimestamp(self.created).isoformat(timespec="seconds")
+        return data
+
+
+class ReportStore:
+    def __init__(
+        self,
+        root: Optional[Path] = None,
+        compression: Optional[str] = None,
+        retention_days: Optional[float] = None,
+        max_count: Optional[int] = None,
+    ) -> None:
+        self.root = Path(root or settings.REPORT_STORE_DIR)
+        self.root.mkdir(parents=True, exist_ok=True)
+        compression = compression or settings.REPORT_COMPRESSION
+        if compression == "zstd" and zstandard is None:
+            print("⚠️ zstandard is not installed, reports are stored uncompressed")
+            compression = "none"
+        self.compression = compression
+        self.retention_days = settings.REPORT_RETENTION_DAYS if retention_days is None else retention_days
+        self.max_count = settings.REPORT_MAX_COUNT if max_count is None else max_count
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.root / "index.sqlite3"), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS reports (
+                run_id TEXT PRIMARY KEY,
+                created REAL NOT NULL,
+                tickers TEXT NOT NULL,
+                path TEXT NOT NULL,
+                compression TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                stored_size INTEGER NOT NULL,
+                sha256 TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS reports_created ON reports(created);
+            CREATE TABLE IF NOT EXISTS report_tickers (
+                run_id TEXT NOT NULL REFERENCES reports(run_id) ON DELETE CASCADE,
+                ticker TEXT NOT NULL,
+                PRIMARY KEY (ticker, run_id)
+            );
+            """
+        )
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.commit()
+
+    # ---------- запись ----------
+
+    def _encode(self, data: bytes) -> bytes:
+        if self.compression == "zstd":
+            return zstandard.ZstdCompressor(level=10).compress(data)
+        return data
+
+    def save(
+        self,
+        text: str,
+        tickers: Iterable[str] = (),
+        run_id: Optional[str] = None,
+        created: Optional[float] = None,
+    ) -> ReportRecord:
+        run_id = run_id or new_run_id()
+        created = time.time() if created is None else created
+        tickers = sorted({t.strip().upper() for t in tickers if t.strip()})
+        data = text.encode("utf-8")
+        stored = self._encode(data)
+
+        stamp = datetime.fromtimestamp(created)
+        suffix = ".md.zst" if self.compression == "zstd" else ".md"
+        rel = Path(f"{stamp:%Y}") / f"{stamp:%m}" / f"{run_id}{suffix}"
+        atomic_write_bytes(self.root / rel, stored)
+
+        record = ReportRecord(
+            run_id=run_id,
+            created=created,
+            tickers=tickers,
+            path=str(rel),
+            compression=self.compression,
+            size=len(data),
+            stored_size=len(stored),
+            sha256=hashlib.sha256(data).hexdigest(),
+        )
+        with self._lock:
+            # файл уже на месте — в индекс попадает только целый отчёт
+            with self._conn:
+                old = self._conn.execute("SELECT path FROM reports WHERE run_id = ?", (run_id,)).fetchone()
+                self._conn.execute("DELETE FROM reports WHERE run_id = ?", (run_id,))
+                self._conn.execute(
+                    "INSERT INTO reports VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (run_id, created, ",".join(tickers), record.path, record.compression,
+                     record.size, record.stored_size, record.sha256),
+                )
+                self._conn.executemany(
+                    "INSERT INTO report_tickers(run_id, ticker) VALUES (?, ?)",
+                    [(run_id, t) for t in tickers],
+                )
+        if old and old[0] != record.path:
+            (self.root / old[0]).unlink(missing_ok=True)  # перезапись того же run_id
+        self.apply_retention()
+        return record
+
+    # ---------- чтение ----------
+
+    @staticmethod
+    def _record(row: Sequence) -> ReportRecord:
+        run_id, created, tickers, path, compression, size, stored_size, sha = row
+        return ReportRecord(run_id, created, [t for t in tickers.split(",") if t], path,
+                            compression, size, stored_size, sha)
+
+    def get(self, run_id: str) -> Optional[ReportRecord]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM reports WHERE run_id = ?", (run_id,)).fetchone()
+        return self._record(row) if row else None
+
+    def read(self, run_id: str) -> Optional[str]:
+        record = self.get(run_id)
+        if record is None:
+            return None
+        data = (self.root / record.path).read_bytes()
+        if record.compression == "zstd":
+            if zstandard is None:
+                raise RuntimeError(f"report {run_id} is zstd-compressed, install zstandard")
+            data = zstandard.ZstdDecompressor().decompress(data)
+        return data.decode("utf-8")
+
+    def list(
+        self,
+        ticker: Optional[str] = None,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+        limit: int = 50,
+        offset: int = 0,
+    ) -> List[ReportRecord]:
+        """Новые первыми; фильтр по тикеру и по времени [since, until)."""
+        sql = "SELECT r.* FROM reports r"
+        where, args = [], []
+        if ticker:
+            sql += " JOIN report_tickers t ON t.run_id = r.run_id"
+            where.append("t.ticker = ?")
+            args.append(ticker.strip().upper())
+        if since is not None:
+            where.append("r.created >= ?")
+            args.append(since)
+        if until is not None:
+            where.append("r.created < ?")
+            args.append(until)
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY r.created DESC LIMIT ? OFFSET ?"
+        args += [limit, offset]
+        with self._lock:
+            rows = self._conn.execute(sql, args).fetchall()
+        return [self._record(row) for row in rows]
+
+    def latest(self, ticker: Optional[str] = None) -> Optional[ReportRecord]:
+        found = self.list(ticker=ticker, limit=1)
+        return found[0] if found else None
+
+    def diff(self, old_run_id: str, new_run_id: str, context: int = 3) -> Optional[str]:
+        old, new = self.read(old_run_id), self.read(new_run_id)
+        if old is None or new is None:
+            return None
+        # без завершающего \n последние строки склеились бы в выводе diff
+        old, new = old.rstrip("\n") + "\n", new.rstrip("\n") + "\n"
+        return "".join(difflib.unified_diff(
+            old.splitlines(keepends=True), new.splitlines(keepends=True),
+            fromfile=old_run_id, tofile=new_run_id, n=context,
+        ))
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM reports").fetchone()[0]
+
+    # ---------- хранение ----------
+
+    def delete(self, run_ids: Sequence[str]) -> int:
+        if not run_ids:
+            return 0
+        with self._lock:
+            paths = []
+            with self._conn:
+                for i in range(0, len(run_ids), 500):
+                    part = list(run_ids[i:i + 500])
+                    marks = ",".join("?" * len(part))
+                    paths += [r[0] for r in self._conn.execute(
+                        f"SELECT path FROM reports WHERE run_id IN ({marks})", part
+                    )]
+                    self._conn.execute(f"DELETE FROM reports WHERE run_id IN ({marks})", part)
+        # сначала индекс, потом файлы: список никогда не ссылается на удалённое
+        for path in paths:
+            (self.root / path).unlink(missing_ok=True)
+        return len(paths)
+
+    def apply_retention(self, now: Optional[float] = None) -> int:
+        now = time.time() if now is None else now
+        expired: List[str] = []
+        with self._lock:
+            if self.retention_days:
+                expired += [r[0] for r in self._conn.execute(
+                    "SELECT run_id FROM reports WHERE created < ?",
+                    (now - self.retention_days * 86400,),
+                )]
+            if self.max_count:
+                expired += [r[0] for r in self._conn.execute(
+                    "SELECT run_id FROM reports ORDER BY created DESC LIMIT -1 OFFSET ?",
+                    (self.max_count,),
+                )]
+        return self.delete(list(dict.fromkeys(expired)))
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+_store: Optional[ReportStore] = None
+_store_lock = threading.Lock()
+
+
+def get_report_store() -> ReportStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ReportStore()
+        return _store
+
+
+# ============================
+# Бенчмарк: индекс против обхода каталога
+# ============================
+
+def _benchmark(reports: int = 2000) -> None:
+    import json
+    import random
+
+    rng = random.Random(0)
+    universe = ["AAPL", "MSFT", "TSLA", "NVDA", "AMZN", "GOOG", "META", "NFLX"]
+    body = "\n".join(
+        f"## Section {i}\n\nThe outlook remains constructive; risk is moderate. | P/E | {20 + i} |"
+        for i in range(40)
+    )
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for compression in ("none", "zstd"):
+            store = ReportStore(Path(tmp) / compression, compression=compression,
+                                retention_days=0, max_count=0)
+            now = time.time()
+            started = time.perf_counter()
+            for i in range(reports):
+                tickers = rng.sample(universe, 3)
+                store.save(f"# Report {i}\n\n{body}", tickers, created=now - i * 3600)
+            saved = time.perf_counter() - started
+            stored = sum(r.stored_size for r in store.list(limit=reports))
+            raw = sum(r.size for r in store.list(limit=reports))
+            print(f"🗄️ {compression}: {reports} reports saved in {saved:.2f}s "
+                  f"({saved / reports * 1000:.2f} ms each), {stored / 2 ** 20:.1f} MB on disk "
+                  f"({raw / max(stored, 1):.1f}x)")
+
+        store = ReportStore(Path(tmp) / "none", compression="none", retention_days=0, max_count=0)
+        week = time.time() - 7 * 86400
+        started = time.perf_counter()
+        for _ in range(100):
+            hits = store.list(ticker="NVDA", since=week, limit=reports)
+        indexed = (time.perf_counter() - started) / 100
+
+        # без индекса: обойти каталог и прочитать метаданные каждого файла
+        meta = {r.run_id: r for r in store.list(limit=reports)}
+        started = time.perf_counter()
+        scanned = []
+        for path in (Path(tmp) / "none").rglob("*.md"):
+            record = meta[path.name[:-3]]
+            path.read_bytes()
+            if "NVDA" in record.tickers and record.created >= week:
+                scanned.append(record)
+        scan = time.perf_counter() - started
+        print(f"🔎 ticker+date query: index {indexed * 1000:.2f} ms vs directory scan "
+              f"{scan * 1000:.1f} ms ({len(hits)} == {len(scanned)} reports)")
+
+        diff = store.diff(hits[-1].run_id, hits[0].run_id)
+        print(f"🧾 diff of two reports: {len(diff.splitlines())} lines")
+
+        store.max_count = 500
+        removed = store.apply_retention()
+        files = sum(1 for _ in (Path(tmp) / "none").rglob("*.md"))
+        print(f"🧹 retention (keep 500): removed {removed}, {len(store)} indexed, {files} files")
+        print(json.dumps(store.latest("AAPL").to_dict())[:120] + " ...")
+
+
+if __name__ == "__main__":
+    _benchmark()
@@ -0,0 +1,400 @@
+# retrieval.py
+
+"""
+Гибридный поиск контекста для агентов: BM25 + векторный поиск.
+
+- кандидаты сначала фильтруются по metadata (ticker, source) и только
+  потом ранжируются — контекст AAPL не может содержать новости TSLA;
+- лексический (BM25) и векторный списки объединяются через reciprocal
+  rank fusion (RRF);
+- qtype (technical/fundamental/risk) задаёт набор источников и
+  формулировку запроса;
+- результаты мемоизируются по (ticker, qtype, k, версия индекса);
+  версия растёт при каждом изменении корпуса.
+"""
+
+from __future__ import annotations
+
+import math
+import re
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Protocol, Sequence, Set, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+
+@dataclass(frozen=True)
+class QueryProfile:
+    sources: Tuple[str, ...]
+    query: str
+
+
+QUERY_PROFILES: Dict[str, QueryProfile] = {
+    "technical": QueryProfile(
+        ("technical_indicators", "price_table", "image_caption"),
+        "{ticker} price trend momentum volatility support resistance RSI MACD moving average",
+    ),
+    "fundamental": QueryProfile(
+        ("news", "pdf", "price_table"),
+        "{ticker} revenue earnings growth margin guidance product business valuation",
+    ),
+    "risk": QueryProfile(
+        ("news", "pdf", "technical_indicators", "price_table"),
+        "{ticker} risk drawdown volatility lawsuit regulation debt downgrade decline",
+    ),
+}
+
+RRF_K = 60
+
+_TOKEN = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN.findall(text.lower())
+
+
+def metadata_filter(ticker: str, sources: Sequence[str]) -> dict:
+    """Фильтр в формате Chroma where."""
+    return {"$and": [{"ticker": ticker}, {"source": {"$in": list(sources)}}]}
+
+
+def reciprocal_rank_fusion(rankings: Iterable[List[str]], k: int = RRF_K) -> List[str]:
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+# ============================
+# Лексический индекс
+# ============================
+
+class BM25Index:
+    """Инкрементальный BM25 (Okapi) с индексом (ticker, source) -> документы."""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75) -> None:
+        self.k1 = k1
+        self.b = b
+        self._ids: List[str] = []
+        self._slot: Dict[str, int] = {}
+        self._tf: List[Optional[Counter]] = []
+        self._lengths: List[int] = []
+        self._total_length = 0
+        self._live = 0
+        self._postings: Dict[str, Dict[int, int]] = {}
+        self._by_key: Dict[Tuple[str, str], Set[int]] = {}
+        self._keys: List[Tuple[str, str]] = []
+
+    def __len__(self) -> int:
+        return self._live
+
+    def add(self, doc_id: str, doc: Document) -> None:
+        if doc_id in self._slot:
+            return
+        slot = len(self._ids)
+        tf = Counter(tokenize(doc.page_content))
+        key = (str(doc.metadata.get("ticker", "UNKNOWN")), str(doc.metadata.get("source", "")))
+
+        self._ids.append(doc_id)
+        self._slot[doc_id] = slot
+        self._tf.append(tf)
+        self._lengths.append(sum(tf.values()))
+        self._keys.append(key)
+        self._total_length += self._lengths[slot]
+        self._live += 1
+        for term, count in tf.items():
+            self._postings.setdefault(term, {})[slot] = count
+        self._by_key.setdefault(key, set()).add(slot)
+
+    def remove(self, doc_id: str) -> None:
+        slot = self._slot.pop(doc_id, None)
+        if slot is None:
+            return
+        for term in self._tf[slot]:
+            self._postings[term].pop(slot, None)
+        self._by_key[self._keys[slot]].discard(slot)
+        self._total_length -= self._lengths[slot]
+        self._live -= 1
+        self._tf[slot] = None
+
+    def candidates(self, ticker: str, sources: Sequence[str]) -> Set[int]:
+        found: Set[int] = set()
+        for source in sources:
+            found |= self._by_key.get((ticker, source), set())
+        return found
+
+    def search(self, query: str, k: int, ticker: str, sources: Sequence[str]) -> List[str]:
+        allowed = self.candidates(ticker, sources)
+        if not allowed:
+            return []
+        avg_len = self._total_length / max(self._live, 1)
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (self._live - len(postings) + 0.5) / (len(postings) + 0.5))
+            # обходим меньшее из множеств: кандидаты по фильтру или posting list
+            if len(allowed) < len(postings):
+                hits = ((s, postings[s]) for s in allowed if s in postings)
+            else:
+                hits = ((s, c) for s, c in postings.items() if s in allowed)
+            for slot, tf in hits:
+                norm = self.k1 * (1 - self.b + self.b * self._lengths[slot] / avg_len)
+                scores[slot] = scores.get(slot, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        best = sorted(scores, key=scores.get, reverse=True)[:k]
+        return [self._ids[s] for s in best]
+
+
+# ============================
+# Векторный поиск
+# ============================
+
+class VectorSearch(Protocol):
+    def add(self, ids: List[str], docs: List[Document]) -> None: ...
+
+    def remove(self, ids: List[str]) -> None: ...
+
+    def search(self, query: str, k: int, ticker: str, sources: Sequence[str]) -> List[str]: ...
+
+
+class ChromaVectorSearch:
+    """Векторный поиск в Chroma с фильтром where (коллекция ведётся rag_kg)."""
+
+    def __init__(self, vectordb) -> None:
+        self.vectordb = vectordb
+
+    def add(self, ids: List[str], docs: List[Document]) -> None:
+        pass
+
+    def remove(self, ids: List[str]) -> None:
+        pass
+
+    def search(self, query: str, k: int, ticker: str, sources: Sequence[str]) -> List[str]:
+        from .rag_kg import document_id
+
+        docs = self.vectordb.similarity_search(query, k=k, filter=metadata_filter(ticker, sources))
+        return [getattr(d, "id", None) or document_id(d) for d in docs]
+
+
+class InMemoryVectorSearch:
+    """Точный косинусный поиск в numpy с предфильтром по metadata."""
+
+    def __init__(self, embeddings: Embeddings) -> None:
+        self.embeddings = embeddings
+        self._ids: List[str] = []
+        self._vectors: List[np.ndarray] = []
+        self._keys: List[Tuple[str, str]] = []
+        self._alive: List[bool] = []
+        self._slot: Dict[str, int] = {}
+        self._matrix: Optional[np.ndarray] = None
+
+    def add(self, ids: List[str], docs: List[Document]) -> None:
+        fresh = [(i, d) for i, d in zip(ids, docs) if i not in self._slot]
+        if not fresh:
+            return
+        vectors = self.embeddings.embed_documents([d.page_content for _, d in fresh])
+        for (doc_id, doc), vec in zip(fresh, vectors):
+            self._slot[doc_id] = len(self._ids)
+            self._ids.append(doc_id)
+            self._vectors.append(np.asarray(vec, dtype=np.float32))
+            self._keys.append((str(doc.metadata.get("ticker", "UNKNOWN")), str(doc.metadata.get("source", ""))))
+            self._alive.append(True)
+        self._matrix = None
+
+    def remove(self, ids: List[str]) -> None:
+        for doc_id in ids:
+            slot = self._slot.pop(doc_id, None)
+            if slot is not None:
+                self._alive[slot] = False
+
+    def search(self, query: str, k: int, ticker: str, sources: Sequence[str]) -> List[str]:
+        wanted = set(sources)
+        slots = np.array(
+            [i for i, (t, s) in enumerate(self._keys) if t == ticker and s in wanted and self._alive[i]],
+            dtype=np.int64,
+        )
+        if not len(slots):
+            return []
+        if self._matrix is None:
+            self._matrix = np.vstack(self._vectors)
+        q = np.asarray(self.embeddings.embed_query(query), dtype=np.float32)
+        scores = self._matrix[slots] @ q
+        top = slots[np.argsort(-scores)[:k]]
+        return [self._ids[i] for i in top]
+
+
+# ============================
+# Гибридный поиск
+# ============================
+
+class HybridRetriever:
+    def __init__(self, vector: VectorSearch, fetch_k: int = 20) -> None:
+        self.vector = vector
+        self.fetch_k = fetch_k
+        self.lexical = BM25Index()
+        self.version = 0
+        self._docs: Dict[str, Document] = {}
+        self._memo: Dict[Tuple[str, str, int, int], List[Document]] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_vector_store(cls, vectordb) -> "HybridRetriever":
+        """Поднимает лексический индекс по уже сохранённой коллекции Chroma."""
+        retriever = cls(ChromaVectorSearch(vectordb))
+        stored = vectordb.get(include=["documents", "metadatas"])
+        docs = [
+            Document(page_content=text or "", metadata=meta or {})
+            for text, meta in zip(stored["documents"], stored["metadatas"])
+        ]
+        retriever.add(stored["ids"], docs, embed=False)
+        return retriever
+
+    def add(self, ids: List[str], docs: List[Document], embed: bool = True) -> None:
+        with self._lock:
+            for doc_id, doc in zip(ids, docs):
+                self._docs[doc_id] = doc
+                self.lexical.add(doc_id, doc)
+            if embed:
+                self.vector.add(ids, docs)
+            self._bump()
+
+    def remove(self, ids: List[str]) -> None:
+        with self._lock:
+            for doc_id in ids:
+                self._docs.pop(doc_id, None)
+                self.lexical.remove(doc_id)
+            self.vector.remove(ids)
+            self._bump()
+
+    def missing(self, ids: Iterable[str]) -> List[str]:
+        """id, которых нет в лексическом индексе этого процесса."""
+        with self._lock:
+            return [i for i in ids if i not in self._docs]
+
+    def ids_for(self, ticker: str, source: str) -> List[str]:
+        """id известных процессу документов тикера из данного источника."""
+        with self._lock:
+            return [
+                i for i, d in self._docs.items()
+                if d.metadata.get("ticker", "UNKNOWN") == ticker and d.metadata.get("source") == source
+            ]
+
+    def _bump(self) -> None:
+        self.version += 1
+        self._memo.clear()
+
+    def retrieve(self, ticker: str, qtype: str, k: int = 6) -> List[Document]:
+        profile = QUERY_PROFILES.get(qtype, QUERY_PROFILES["fundamental"])
+        memo_key = (ticker, qtype, k, self.version)
+        cached = self._memo.get(memo_key)
+        if cached is not None:
+            return cached
+
+        query = profile.query.format(ticker=ticker)
+        fused = reciprocal_rank_fusion([
+            self.lexical.search(query, self.fetch_k, ticker, profile.sources),
+            self.vector.search(query, self.fetch_k, ticker, profile.sources),
+        ])
+        result = [self._docs[i] for i in fused if i in self._docs][:k]
+        self._memo[memo_key] = result
+        return result
+
+
+_retriever: Optional[HybridRetriever] = None
+_retriever_lock = threading.Lock()
+
+
+def get_retriever(vectordb=None) -> HybridRetriever:
+    """Общий на процесс ретривер поверх коллекции rag_kg."""
+    global _retriever
+    with _retriever_lock:
+        if _retriever is None:
+            if vectordb is None:
+                from .rag_kg import get_vector_store
+                vectordb = get_vector_store()
+            _retriever = HybridRetriever.from_vector_store(vectordb)
+        return _retriever
+
+
+# ============================
+# Бенчмарк на синтетическом корпусе
+# ============================
+
+_TOPIC_WORDS = {
+    "technical": ["momentum", "RSI", "resistance", "trend"],
+    "fundamental": ["revenue", "earnings", "guidance", "margin"],
+    "risk": ["lawsuit", "downgrade", "debt", "drawdown"],
+}
+
+
+def _synthetic_corpus(n_tickers: int, docs_per_ticker: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    filler = [f"w{i}" for i in range(2000)]
+    sources = ["news", "news", "news", "technical_indicators", "price_table", "image_caption"]
+    ids, docs, relevant = [], [], {}
+    for t in range(n_tickers):
+        ticker = f"T{t:03d}"
+        for j in range(docs_per_ticker):
+            source = sources[j % len(sources)]
+            topic = list(_TOPIC_WORDS)[int(rng.integers(3))]
+            words = list(rng.choice(filler, 40)) + [ticker]
+            if rng.random() < 0.5:
+                words += list(rng.choice(_TOPIC_WORDS[topic], 3))
+                if source in QUERY_PROFILES[topic].sources:
+                    relevant.setdefault((ticker, topic), set()).add(f"{ticker}-{j}")
+            ids.append(f"{ticker}-{j}")
+            docs.append(Document(page_content=" ".join(words), metadata={"ticker": ticker, "source": source}))
+    return ids, docs, relevant
+
+
+def _benchmark(n_tickers: int = 200, docs_per_ticker: int = 60, k: int = 6) -> None:
+    from .embeddings import HashingEmbeddings
+
+    ids, docs, relevant = _synthetic_corpus(n_tickers, docs_per_ticker)
+    doc_ids = {id(d): i for i, d in zip(ids, docs)}
+    embeddings = HashingEmbeddings()
+    retriever = HybridRetriever(InMemoryVectorSearch(embeddings))
+    started = time.perf_counter()
+    retriever.add(ids, docs)
+    print(f"indexed {len(ids)} docs in {time.perf_counter() - started:.2f} s")
+
+    # старое поведение: similarity по строке тикера без фильтра
+    plain = np.vstack([np.asarray(v, dtype=np.float32) for v in embeddings.embed_documents([d.page_content for d in docs])])
+
+    def recall(found: List[str], ticker: str, qtype: str) -> float:
+        truth = relevant.get((ticker, qtype), set())
+        return len(truth & set(found)) / min(len(truth), k) if truth else 1.0
+
+    hybrid_r, plain_r, leaked = [], [], 0
+    latency = []
+    queries = [(f"T{t:03d}", q) for t in range(n_tickers) for q in QUERY_PROFILES]
+    for ticker, qtype in queries:
+        started = time.perf_counter()
+        found = retriever.retrieve(ticker, qtype, k)
+        latency.append(time.perf_counter() - started)
+        hybrid_r.append(recall([doc_ids[id(d)] for d in found], ticker, qtype))
+
+        top = np.argsort(-(plain @ np.asarray(embeddings.embed_query(ticker), dtype=np.float32)))[:k]
+        plain_r.append(recall([ids[i] for i in top], ticker, qtype))
+        leaked += sum(1 for i in top if docs[i].metadata["ticker"] != ticker)
+
+    started = time.perf_counter()
+    for ticker, qtype in queries:
+        retriever.retrieve(ticker, qtype, k)
+    memo = (time.perf_counter() - started) / len(queries)
+
+    print(f"recall@{k}: hybrid {np.mean(hybrid_r):.2f} vs unfiltered similarity {np.mean(plain_r):.2f}")
+    print(f"unfiltered search leaked {leaked} foreign-ticker docs over {len(queries)} queries")
+    print(f"latency: p50 {np.median(latency) * 1000:.2f} ms, p95 {np.percentile(latency, 95) * 1000:.2f} ms, "
+          f"memoized {memo * 1e6:.1f} us")
+
+
+if __name__ == "__main__":
+    _benchmark()
@@ -0,0 +1,288 @@
+# streaming.py
+
+"""
+Потоковая выдача токенов LLM из пайплайна в дашборд.
+
+- стадия (task + ticker) лежит в contextvar: узел DAG / цепочка ставит её
+  через stage(...), LLM-слой (agents.CachedLLM, chains, structured_output)
+  шлёт токены, не зная, чей он вызов; исполнитель DAG копирует контекст в
+  поток узла, поэтому параллельные стадии не путаются;
+- токен-события — строки stdout с префиксом TOKEN_PREFIX и JSON: и
+  subprocess-, и warm-worker-исполнитель уже передают stdout в лог
+  запуска построчно, так что события идут тем же путём и переживают
+  переподключение (Last-Event-ID);
+- токены склеиваются по стадии и сбрасываются не чаще TOKEN_FLUSH_INTERVAL,
+  чтобы не вытеснять лог из буфера запуска;
+- в SSE такие строки уходят как `event: token` (sse_frame), обычные —
+  как раньше, data-строками.
+"""
+
+from __future__ import annotations
+
+import contextvars
+import json
+import sys
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from .config import settings
+
+
+# только ASCII: управляющие символы (\x1e и т.п.) str.splitlines() считает концом строки
+TOKEN_PREFIX = "@@token "
+
+Stage = Tuple[str, Optional[str]]
+
+_stage: contextvars.ContextVar[Optional[Stage]] = contextvars.ContextVar("token_stage", default=None)
+
+
+@dataclass
+class TokenEvent:
+    task: str
+    ticker: Optional[str]
+    text: str
+    done: bool = False
+
+    def to_line(self) -> str:
+        return TOKEN_PREFIX + json.dumps(asdict(self), ensure_ascii=False, separators=(",", ":"))
+
+    @classmethod
+    def from_line(cls, line: str) -> Optional["TokenEvent"]:
+        if not line.startswith(TOKEN_PREFIX):
+            return None
+        return cls(**json.loads(line[len(TOKEN_PREFIX):]))
+
+
+# ============================
+# Эмиттер
+# ============================
+
+class TokenEmitter:
+    """Копит токены по стадиям и печатает их пачками (одна строка — одна пачка)."""
+
+    def __init__(self, interval: Optional[float] = None) -> None:
+        self.interval = settings.TOKEN_FLUSH_INTERVAL if interval is None else interval
+        self._buffers: Dict[Stage, List[str]] = {}
+        self._flushed: Dict[Stage, float] = {}
+        self._lock = threading.Lock()
+        self.events = 0
+
+    def _write(self, event: TokenEvent) -> None:
+        # одна запись на строку: строки параллельных стадий не перемешиваются
+        sys.stdout.write(event.to_line() + "\n")
+        sys.stdout.flush()
+        self.events += 1
+
+    def emit(self, stage: Stage, text: str) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self._buffers.setdefault(stage, []).append(text)
+            if now - self._flushed.get(stage, 0.0) < self.interval:
+                return
+            self._flushed[stage] = now
+            text = "".join(self._buffers.pop(stage))
+            self._write(TokenEvent(stage[0], stage[1], text))
+
+    def close(self, stage: Stage) -> None:
+        with self._lock:
+            text = "".join(self._buffers.pop(stage, []))
+            self._flushed.pop(stage, None)
+            self._write(TokenEvent(stage[0], stage[1], text, done=True))
+
+
+_emitter: Optional[TokenEmitter] = None
+_emitter_lock = threading.Lock()
+
+
+def get_emitter() -> TokenEmitter:
+    global _emitter
+    with _emitter_lock:
+        if _emitter is None:
+            _emitter = TokenEmitter()
+        return _emitter
+
+
+def active() -> bool:
+    """Стримить ли сейчас: включено (TOKEN_EVENTS) и вызов идёт внутри stage()."""
+    return settings.TOKEN_EVENTS and _stage.get() is not None
+
+
+def emit(text: str) -> None:
+    current = _stage.get()
+    if text and settings.TOKEN_EVENTS and current is not None:
+        get_emitter().emit(current, text)
+
+
+@contextmanager
+def stage(task: str, ticker: Optional[str] = None) -> Iterator[None]:
+    """Все токены LLM внутри блока помечаются task/ticker; на выходе — done."""
+    token = _stage.set((task, ticker))
+    try:
+        yield
+    finally:
+        _stage.reset(token)
+        if settings.TOKEN_EVENTS:
+            get_emitter().close((task, ticker))
+
+
+def node_stage(name: str) -> Stage:
+    """Имя узла DAG -> стадия: "AAPL:technical" -> ("technical", "AAPL")."""
+    ticker, _, task = name.rpartition(":")
+    return task, ticker or None
+
+
+# ============================
+# Источники токенов
+# ============================
+
+def ollama_stream(url: str, body: Dict[str, Any], timeout: Optional[float] = None) -> str:
+    """
+    POST в Ollama со stream=True: NDJSON-чанки (/api/generate — "response",
+    /api/chat — "message.content") уходят токен-событиями; возвращает весь текст.
+    """
+    request = urllib.request.Request(
+        url, data=json.dumps({**body, "stream": True}).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+    )
+    parts: List[str] = []
+    with urllib.request.urlopen(request, timeout=timeout or settings.STRUCTURED_TIMEOUT) as resp:
+        for raw in resp:
+            if not raw.strip():
+                continue
+            chunk = json.loads(raw)
+            text = chunk.get("response") or (chunk.get("message") or {}).get("content") or ""
+            if text:
+                parts.append(text)
+                emit(text)
+            if chunk.get("done"):
+                break
+    return "".join(parts)
+
+
+def ollama_chat(llm: Any, messages: Any) -> str:
+    """Чат-вызов crewai-LLM вида "ollama/<model>" напрямую в Ollama, потоково."""
+    if isinstance(messages, str):
+        messages = [{"role": "user", "content": messages}]
+    options: Dict[str, Any] = {}
+    if getattr(llm, "temperature", None) is not None:
+        options["temperature"] = llm.temperature
+    if getattr(llm, "max_tokens", None):
+        options["num_predict"] = llm.max_tokens
+    if getattr(llm, "stop", None):
+        options["stop"] = list(llm.stop)
+    base_url = (getattr(llm, "base_url", None) or "http://localhost:11434").rstrip("/")
+    return ollama_stream(
+        base_url + "/api/chat",
+        {"model": llm.model[len("ollama/"):], "messages": messages, "options": options},
+    )
+
+
+def stream_langchain(llm: Any, prompt: str) -> str:
+    """langchain-модель через .stream(): чанки -> токен-события, возвращает текст."""
+    parts: List[str] = []
+    for chunk in llm.stream(prompt):
+        text = getattr(chunk, "content", chunk)
+        if not isinstance(text, str):
+            text = str(text)
+        parts.append(text)
+        emit(text)
+    return "".join(parts)
+
+
+# ============================
+# SSE
+# ============================
+
+def sse_frame(seq: int, line: str) -> str:
+    """Строка лога -> SSE-кадр: токены — `event: token` с JSON, прочее — data."""
+    if line.startswith(TOKEN_PREFIX):
+        return f"id: {seq}\nevent: token\ndata: {line[len(TOKEN_PREFIX):]}\n\n"
+    return f"id: {seq}\ndata: {line}\n\n"
+
+
+# ============================
+# Бенчмарк
+# ============================
+
+def _benchmark(tokens: int = 60, delay: float = 0.02) -> None:
+    """
+    Фейковая Ollama отдаёт NDJSON с задержкой на токен; DAG из двух стадий
+    (technical ∥ fundamental -> report) с двумя LLM-слотами. Сравниваем
+    время до первого токена и до конца запуска (раньше это был
+    единственный момент, когда что-то видно).
+    """
+    import asyncio
+    import io
+    from contextlib import redirect_stdout
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    from .dag_scheduler import DagExecutor, TaskNode
+
+    class FakeOllama(BaseHTTPRequestHandler):
+        def do_POST(self) -> None:
+            self.rfile.read(int(self.headers["Content-Length"]))
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.end_headers()
+            for i in range(tokens):
+                time.sleep(delay)
+                self.wfile.write((json.dumps({"response": f"tok{i} "}) + "\n").encode())
+                self.wfile.flush()
+            self.wfile.write(b'{"response": "", "done": true}\n')
+
+        def log_message(self, *args: Any) -> None:
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeOllama)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/api/generate"
+
+    def llm_node(name: str):
+        def run(inputs: Dict[str, Any]) -> str:
+            with stage(*node_stage(name)):
+                return ollama_stream(url, {"model": "fake", "prompt": name})
+        return run
+
+    nodes = [
+        TaskNode("AAPL:technical", llm_node("AAPL:technical")),
+        TaskNode("AAPL:fundamental", llm_node("AAPL:fundamental")),
+        TaskNode("AAPL:report", llm_node("AAPL:report"),
+                 depends_on=["AAPL:technical", "AAPL:fundamental"]),
+    ]
+
+    class Capture(io.TextIOBase):
+        def __init__(self) -> None:
+            self.lines: List[Tuple[float, str]] = []
+            self.origin = time.perf_counter()
+
+        def write(self, text: str) -> int:
+            for line in text.splitlines():
+                self.lines.append((time.perf_counter() - self.origin, line))
+            return len(text)
+
+    settings.TOKEN_EVENTS = True
+    out = Capture()
+    with redirect_stdout(out):
+        asyncio.run(DagExecutor(max_llm_concurrency=2).run(nodes))
+    server.shutdown()
+
+    events = [(t, TokenEvent.from_line(line)) for t, line in out.lines]
+    events = [(t, e) for t, e in events if e is not None]
+    total = out.lines[-1][0]
+    first = events[0][0]
+    fundamental_start = next(t for t, e in events if e.task == "fundamental")
+    technical_done = next(t for t, e in events if e.task == "technical" and e.done)
+    print(f"⏱️ first token after {first * 1000:.0f} ms, whole run {total * 1000:.0f} ms")
+    print(f"📺 technical finished streaming at {technical_done * 1000:.0f} ms, "
+          f"fundamental streamed from {fundamental_start * 1000:.0f} ms")
+    print(f"📦 {sum(1 for _, e in events)} SSE token events for {3 * tokens} tokens "
+          f"(flush every {settings.TOKEN_FLUSH_INTERVAL * 1000:.0f} ms)")
+    print(sse_frame(1, events[0][1].to_line()).rstrip())
+
+
+if __name__ == "__main__":
+    _benchmark()
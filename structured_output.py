@@ -0,0 +1,378 @@
+# structured_output.py
+
+"""
+Структурированные ответы агентов по Pydantic-схемам (chains.py).
+
+- JSON Schema модели уходит в Ollama как `format` — constrained decoding:
+  модель физически не может выдать невалидный JSON; для прочих LLM схема
+  (компактная подсказка полей) кладётся в промпт, а JSON вырезается из ответа;
+- ответ валидируется; дешёвые расхождения (строка вместо списка, регистр
+  в enum) чинятся локально, без LLM;
+- оставшиеся невалидные поля перезапрашиваются точечно: повторный вызов
+  просит только их (короткий ответ), остальное берётся из первого ответа;
+- между стадиями DAG передаётся компактный JSON объекта, а не проза —
+  промпты risk/report заметно короче.
+"""
+
+from __future__ import annotations
+
+import json
+import re
+import threading
+import typing
+import urllib.request
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Type
+
+from pydantic import BaseModel, ValidationError
+
+from . import streaming
+from .config import settings
+from .context_budget import count_tokens
+from .llm_cache import LLMCache, cached_invoke, get_llm_cache
+
+
+# complete(prompt, json_schema) -> сырой текст ответа
+Complete = Callable[[str, Optional[Dict[str, Any]]], str]
+
+
+class StructuredOutputError(ValueError):
+    """Ответ так и не прошёл валидацию после всех повторов."""
+
+
+@dataclass
+class StructuredStats:
+    calls: int = 0
+    llm_calls: int = 0
+    repairs: int = 0
+    repaired_fields: int = 0
+    local_fixes: int = 0
+    failures: int = 0
+
+    def report(self) -> str:
+        return (
+            f"structured output: {self.calls} objects, {self.llm_calls} LLM calls "
+            f"({self.repairs} repairs for {self.repaired_fields} fields), "
+            f"{self.local_fixes} fixed locally, {self.failures} failed"
+        )
+
+
+# ============================
+# Схемы
+# ============================
+
+def _type_hint(annotation: Any) -> Any:
+    origin = typing.get_origin(annotation)
+    if origin is typing.Literal:
+        return "|".join(str(a) for a in typing.get_args(annotation))
+    if origin in (list, List):
+        args = typing.get_args(annotation)
+        return [_type_hint(args[0]) if args else "string"]
+    if annotation in (int, float):
+        return "number"
+    if annotation is bool:
+        return "boolean"
+    return "string"
+
+
+def schema_hint(model: Type[BaseModel], fields: Optional[List[str]] = None) -> str:
+    """Компактное описание полей для промпта: в разы короче JSON Schema."""
+    names = fields or list(model.model_fields)
+    return json.dumps(
+        {name: _type_hint(model.model_fields[name].annotation) for name in names},
+        ensure_ascii=False,
+    )
+
+
+def json_schema(model: Type[BaseModel], fields: Optional[List[str]] = None) -> Dict[str, Any]:
+    """JSON Schema модели (или только части полей — для точечного повтора)."""
+    schema = model.model_json_schema()
+    if fields is None:
+        return schema
+    return {
+        "type": "object",
+        "properties": {f: schema["properties"][f] for f in fields},
+        "required": list(fields),
+        **({"$defs": schema["$defs"]} if "$defs" in schema else {}),
+    }
+
+
+def compact(value: Any) -> str:
+    """Объект стадии -> текст для следующей стадии (модели — компактным JSON)."""
+    if isinstance(value, BaseModel):
+        return value.model_dump_json()
+    return str(value)
+
+
+# ============================
+# Разбор и валидация
+# ============================
+
+_FENCE = re.compile(r"```(?:json)?\s*(.*?)```", re.S)
+
+
+def extract_json(text: str) -> Optional[Dict[str, Any]]:
+    """Первый JSON-объект в ответе (в т.ч. внутри ```json ... ``` и прозы)."""
+    fenced = _FENCE.search(text)
+    if fenced:
+        text = fenced.group(1)
+    decoder = json.JSONDecoder()
+    for match in re.finditer(r"\{", text):
+        try:
+            value, _ = decoder.raw_decode(text, match.start())
+        except json.JSONDecodeError:
+            continue
+        if isinstance(value, dict):
+            return value
+    return None
+
+
+def coerce(model: Type[BaseModel], data: Dict[str, Any]) -> int:
+    """
+    Локальные исправления без LLM: строка -> список строк, регистр и
+    пробелы в enum-полях. Возвращает число исправленных полей.
+    """
+    fixed = 0
+    for name, field in model.model_fields.items():
+        value = data.get(name)
+        origin = typing.get_origin(field.annotation)
+        if origin in (list, List) and isinstance(value, str):
+            parts = [p.strip(" -•*\t") for p in re.split(r"[\n;]+", value)]
+            data[name] = [p for p in parts if p]
+            fixed += 1
+        elif origin is typing.Literal and isinstance(value, str):
+            options = {str(a).lower(): a for a in typing.get_args(field.annotation)}
+            normalized = options.get(value.strip().lower())
+            if normalized is not None and normalized != value:
+                data[name] = normalized
+                fixed += 1
+        elif field.annotation is str and isinstance(value, (list, dict)):
+            data[name] = "; ".join(map(str, value)) if isinstance(value, list) else json.dumps(value)
+            fixed += 1
+    return fixed
+
+
+def invalid_fields(model: Type[BaseModel], data: Dict[str, Any]) -> Dict[str, str]:
+    """{поле: ошибка} — пусто, если данные проходят валидацию."""
+    try:
+        model.model_validate(data)
+    except ValidationError as e:
+        errors: Dict[str, str] = {}
+        for err in e.errors():
+            field = str(err["loc"][0]) if err["loc"] else "__root__"
+            errors.setdefault(field, err["msg"])
+        return errors
+    return {}
+
+
+# ============================
+# Бэкенды
+# ============================
+
+def _schema_prompt(prompt: str, schema_text: str) -> str:
+    return f"{prompt}\n\nRespond with a single JSON object only, no prose. Fields: {schema_text}"
+
+
+def ollama_complete(
+    model: str,
+    base_url: str,
+    temperature: Optional[float] = None,
+    max_tokens: Optional[int] = None,
+    timeout: Optional[float] = None,
+) -> Complete:
+    """
+    Прямой вызов Ollama /api/generate с format=<JSON Schema> (constrained
+    decoding, Ollama >= 0.5). Ответы кэшируются вместе со схемой.
+    """
+    url = base_url.rstrip("/") + "/api/generate"
+    timeout = timeout or settings.STRUCTURED_TIMEOUT
+
+    def complete(prompt: str, schema: Optional[Dict[str, Any]]) -> str:
+        cache = get_llm_cache()
+        key = LLMCache.key(
+            f"ollama/{model}", temperature, max_tokens,
+            prompt + "\n#format " + json.dumps(schema, sort_keys=True),
+        )
+        cached = cache.get(key)
+        if cached is not None:
+            streaming.emit(cached)
+            return cached
+
+        options: Dict[str, Any] = {}
+        if temperature is not None:
+            options["temperature"] = temperature
+        if max_tokens:
+            options["num_predict"] = max_tokens
+        body = {"model": model, "prompt": prompt, "format": schema or "json", "options": options}
+        if streaming.active():
+            text = streaming.ollama_stream(url, body, timeout)
+        else:
+            request = urllib.request.Request(
+                url, data=json.dumps({**body, "stream": False}).encode("utf-8"),
+                headers={"Content-Type": "application/json"},
+            )
+            with urllib.request.urlopen(request, timeout=timeout) as resp:
+                text = json.loads(resp.read())["response"]
+        cache.put(key, text)
+        return text
+
+    return complete
+
+
+def complete_for(llm: Any) -> Complete:
+    """
+    Бэкенд под конкретную LLM: Ollama-модели (crewai "ollama/..." или
+    langchain ChatOllama) — с constrained decoding, прочие — схема в промпте.
+    """
+    model = str(getattr(llm, "model", "") or "")
+    if settings.STRUCTURED_CONSTRAINED and model.startswith("ollama/"):
+        return ollama_complete(
+            model[len("ollama/"):],
+            getattr(llm, "base_url", None) or "http://localhost:11434",
+            getattr(llm, "temperature", None),
+            getattr(llm, "max_tokens", None),
+        )
+    if settings.STRUCTURED_CONSTRAINED and type(llm).__name__ in ("ChatOllama", "OllamaLLM", "Ollama"):
+        return ollama_complete(
+            model, getattr(llm, "base_url", None) or "http://localhost:11434",
+            getattr(llm, "temperature", None), getattr(llm, "num_predict", None),
+        )
+
+    def complete(prompt: str, schema: Optional[Dict[str, Any]]) -> str:
+        # crewai LLM (call, кэш в CachedLLM) или langchain-модель (invoke)
+        if hasattr(llm, "call"):
+            return str(llm.call(prompt))
+        return cached_invoke(llm, prompt)
+
+    return complete
+
+
+# ============================
+# Генератор
+# ============================
+
+_stats = StructuredStats()
+
+
+def structured_stats() -> StructuredStats:
+    """Статистика на процесс (печатается в конце пайплайна)."""
+    return _stats
+
+
+class StructuredGenerator:
+    def __init__(self, complete: Complete, max_repairs: Optional[int] = None) -> None:
+        self.complete = complete
+        self.max_repairs = settings.STRUCTURED_MAX_REPAIRS if max_repairs is None else max_repairs
+
+    def _ask(self, model: Type[BaseModel], prompt: str, fields: Optional[List[str]]) -> Dict[str, Any]:
+        _stats.llm_calls += 1
+        text = self.complete(_schema_prompt(prompt, schema_hint(model, fields)), json_schema(model, fields))
+        return extract_json(text) or {}
+
+    def generate(
+        self,
+        model: Type[BaseModel],
+        prompt: str,
+        known: Optional[Dict[str, Any]] = None,
+    ) -> BaseModel:
+        """
+        Объект model по промпту. known — поля, известные заранее (ticker):
+        их не спрашиваем у LLM и не чиним.
+        """
+        known = known or {}
+        _stats.calls += 1
+        data = {**self._ask(model, prompt, None), **known}
+        for attempt in range(self.max_repairs + 1):
+            _stats.local_fixes += coerce(model, data)
+            errors = invalid_fields(model, data)
+            if not errors:
+                return model.model_validate(data)
+            if "__root__" in errors or attempt == self.max_repairs:
+                break
+            fields = [f for f in model.model_fields if f in errors and f not in known]
+            _stats.repairs += 1
+            _stats.repaired_fields += len(fields)
+            issues = "\n".join(f"- {f}: {errors[f]} (got {json.dumps(data.get(f), ensure_ascii=False)})"
+                               for f in fields)
+            repair = (
+                f"{prompt}\n\nA previous answer had invalid fields:\n{issues}\n"
+                f"Return ONLY these fields, corrected."
+            )
+            data.update({k: v for k, v in self._ask(model, repair, fields).items() if k in fields})
+
+        _stats.failures += 1
+        raise StructuredOutputError(f"{model.__name__}: invalid fields {sorted(invalid_fields(model, data))}")
+
+
+_generators: Dict[int, StructuredGenerator] = {}
+_generators_lock = threading.Lock()
+
+
+def get_structured(llm: Any) -> StructuredGenerator:
+    """Генератор для LLM (общий на процесс, по одному на экземпляр LLM)."""
+    with _generators_lock:
+        generator = _generators.get(id(llm))
+        if generator is None:
+            generator = _generators[id(llm)] = StructuredGenerator(complete_for(llm))
+        return generator
+
+
+# ============================
+# Бенчмарк
+# ============================
+
+def _benchmark() -> None:
+    """
+    Без Ollama: «LLM» отвечает заранее заготовленными ответами с типичными
+    ошибками; сравниваем объём контекста следующей стадии (проза vs JSON).
+    """
+    from .chains import FundamentalAnalysis, RiskAssessment, TechnicalAnalysis
+
+    prose = (
+        "## Technical analysis for AAPL\n\n"
+        "Over the last quarter AAPL has been trading in a well-defined upward channel. "
+        "The 20-day simple moving average crossed above the 50-day average three weeks ago, "
+        "which is usually read as a bullish signal, and the price has held above both since. "
+        "RSI sits at 63, i.e. strong momentum without being overbought. Bollinger bands are "
+        "widening, suggesting volatility is picking up after a quiet period; the stock is "
+        "riding the upper band. Support is around 182 (the 50-day SMA) and resistance near "
+        "the previous high at 199. Volume has been slightly above average on up days.\n\n"
+        "Overall the technical picture is constructive: trend, momentum and volume agree. "
+        "A close below 182 would invalidate this view. Technical view: bullish.\n"
+    )
+    replies = iter([
+        # 1) ответ с прозой вокруг, строкой вместо списка и "Bullish" с заглавной
+        "Sure! Here is the JSON:\n```json\n"
+        '{"trend_summary": "Upward channel, SMA20 above SMA50, price above both", '
+        '"key_indicators": "SMA20 > SMA50; RSI 63; Bollinger widening", "rating": "Bullish"}\n```',
+        # 2) пропущены поля
+        '{"business_summary": "Consumer hardware and services ecosystem", '
+        '"strengths": ["services growth", "brand"], "weaknesses": "china exposure"}',
+        # 3) повтор только для недостающего поля
+        '{"valuation_view": "Premium multiple, fair given services mix"}',
+        # 4) недопустимое значение enum
+        '{"risk_factors": ["valuation", "regulation"], "overall_risk_level": "moderate", '
+        '"comments": "Trend supports upside; regulation is the main tail risk"}',
+        '{"overall_risk_level": "medium"}',
+    ])
+    prompts: List[str] = []
+
+    def fake_complete(prompt: str, schema: Optional[Dict[str, Any]]) -> str:
+        prompts.append(prompt)
+        return next(replies)
+
+    gen = StructuredGenerator(fake_complete, max_repairs=2)
+    tech = gen.generate(TechnicalAnalysis, "Technical analysis for AAPL", {"ticker": "AAPL"})
+    fund = gen.generate(FundamentalAnalysis, "Fundamental analysis for AAPL", {"ticker": "AAPL"})
+    risk = gen.generate(RiskAssessment, "Risk for AAPL", {"ticker": "AAPL"})
+    print(f"✅ {tech.rating} / {fund.valuation_view!r} / {risk.overall_risk_level}")
+    print(f"🔁 repair prompt asks only for: {prompts[2].rsplit('Fields: ', 1)[1]}")
+    print(f"🧩 {_stats.report()}")
+
+    before, after = count_tokens(prose), count_tokens(compact(tech))
+    print(f"📉 technical -> risk context: prose {before} tokens vs compact JSON {after} tokens "
+          f"({1 - after / before:.0%} fewer)")
+
+
+if __name__ == "__main__":
+    _benchmark()
@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+
+from Final_Project.ann_index import FaissIndex, _synthetic_embeddings, load_index, normalize, save_index
+
+
+def _recall(index, queries, truth, k=10) -> float:
+    labels, _ = index.search(queries, k)
+    return float(np.mean([len(set(found) & set(want)) / k for found, want in zip(labels, truth)]))
+
+
+@pytest.mark.parametrize("n", [100, 2000])
+def test_faiss_int8_recall_with_one_vector_per_add(tmp_path, n):
+    pytest.importorskip("faiss")
+    rng = np.random.default_rng(0)
+    vectors = normalize(_synthetic_embeddings(n, 128, rng))
+    queries = normalize(_synthetic_embeddings(50, 128, rng))
+    truth = np.argsort(-queries @ vectors.T, axis=1)[:, :10]
+
+    index = FaissIndex(128, quantization="int8")
+    for i, vec in enumerate(vectors):
+        index.add([i], vec[None, :])  # память пишется по одной записи
+    assert len(index) == n
+    assert _recall(index, queries, truth) > 0.9
+
+    save_index(index, tmp_path)
+    restored = load_index(tmp_path)
+    assert len(restored) == n
+    assert _recall(restored, queries, truth) > 0.9
@@ -0,0 +1,39 @@
+import asyncio
+
+from Final_Project.dag_scheduler import DagExecutor, TaskNode
+
+
+def _ok(value):
+    return lambda inputs: value
+
+
+def _fail(inputs):
+    raise RuntimeError("llm down")
+
+
+def _nodes(partial):
+    return [
+        TaskNode("A:report", _ok("a")),
+        TaskNode("B:report", _fail),
+        TaskNode("report", lambda inputs: sorted(inputs), ["A:report", "B:report"], partial=partial),
+    ]
+
+
+def test_failed_dependency_skips_node():
+    results = asyncio.run(DagExecutor(max_llm_concurrency=2).run(_nodes(partial=False)))
+    assert results["report"].error == "skipped: upstream failed (B:report)"
+
+
+def test_partial_node_runs_on_successful_dependencies():
+    results = asyncio.run(DagExecutor(max_llm_concurrency=2).run(_nodes(partial=True)))
+    assert results["report"].ok
+    assert results["report"].output == ["A:report"]
+
+
+def test_partial_node_is_skipped_when_every_dependency_failed():
+    nodes = [
+        TaskNode("B:report", _fail),
+        TaskNode("report", lambda inputs: "never", ["B:report"], partial=True),
+    ]
+    results = asyncio.run(DagExecutor(max_llm_concurrency=2).run(nodes))
+    assert not results["report"].ok
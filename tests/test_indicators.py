@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+
+from Final_Project.indicators import StreamingIndicators, indicator_summary
+
+
+def _frame(periods: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    index = pd.date_range("2024-01-01", periods=periods, freq="D", name="Date")
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, periods)))
+    spread = np.abs(rng.normal(0, 0.01, periods)) * close
+    return pd.DataFrame({"High": close + spread, "Low": close - spread, "Close": close}, index=index)
+
+
+def _assert_matches(state: StreamingIndicators, frames) -> None:
+    expected = indicator_summary(frames)
+    got = state.summary(list(frames))
+    for ticker, values in expected.items():
+        for name, value in values.items():
+            np.testing.assert_allclose(got[ticker][name], value, rtol=1e-9, err_msg=f"{ticker}.{name}")
+
+
+def test_revised_last_bar_is_reprocessed(tmp_path):
+    frames = {"AAPL": _frame(80), "MSFT": _frame(80, seed=1)}
+    state = StreamingIndicators([])
+    state.sync_frames(frames)
+
+    # незакрытый бар закрылся с другими значениями: откат и повторное применение
+    frames["AAPL"].iloc[-1] = frames["AAPL"].iloc[-1] * 1.05
+    assert state.sync_frames(frames) == 1
+    _assert_matches(state, frames)
+
+    # то же после рестарта + новый бар поверх исправленного
+    path = tmp_path / "state.npz"
+    state.snapshot(path)
+    frames["AAPL"].iloc[-1] = frames["AAPL"].iloc[-1] * 0.97
+    for ticker, df in frames.items():
+        df.loc[df.index[-1] + pd.Timedelta(days=1)] = df.iloc[-1] * 1.01
+    restored = StreamingIndicators.restore(path)
+    restored.sync_frames(frames)
+    _assert_matches(restored, frames)
+
+
+def test_unchanged_last_bar_is_not_reapplied():
+    frames = {"AAPL": _frame(40)}
+    state = StreamingIndicators([])
+    state.sync_frames(frames)
+    assert state.sync_frames(frames) == 0
+    _assert_matches(state, frames)
+
+
+def test_fallback_frame_does_not_poison_persisted_state(tmp_path):
+    from Final_Project.data_prep import fallback_prices
+    from Final_Project.indicators import persistent_summary
+
+    path = tmp_path / "state.npz"
+    real = {"AAPL": _frame(80)}
+    persistent_summary(real, path)
+
+    # сеть упала: синтетические бары со штампом «сейчас»
+    fake = {"AAPL": fallback_prices("AAPL", "network down")}
+    offline = persistent_summary(fake, path, stateless=["AAPL"])
+    assert offline["AAPL"]["close"] == fake["AAPL"]["Adj Close"].iloc[-1]
+
+    # следующий реальный бар обрабатывается, состояние не отравлено
+    real["AAPL"].loc[real["AAPL"].index[-1] + pd.Timedelta(days=1)] = real["AAPL"].iloc[-1] * 1.02
+    summary = persistent_summary(real, path)
+    assert summary["AAPL"]["close"] == real["AAPL"]["Close"].iloc[-1]
+    _assert_matches(StreamingIndicators.restore(path), real)
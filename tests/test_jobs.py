@@ -0,0 +1,113 @@
+import sys
+import time
+
+import pytest
+
+from Final_Project.jobs import JobManager, normalize_tickers
+
+
+class ScriptJobManager(JobManager):
+    """Вместо пайплайна запускает короткий python -c скрипт."""
+
+    script = "pass"
+
+    def _command(self, job):
+        return [sys.executable, "-c", self.script]
+
+
+def wait_done(job, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not job.done:
+        assert time.monotonic() < deadline, f"job {job.id} still {job.status}"
+        time.sleep(0.02)
+
+
+def test_normalize_tickers_dedupes_and_sorts():
+    assert normalize_tickers([" msft", "AAPL", "aapl", "", "BRK.B", "^GSPC"]) == ("AAPL", "BRK.B", "MSFT", "^GSPC")
+
+
+@pytest.mark.parametrize("tickers", [["<img src=x onerror=alert(1)>"], ["AAPL", 1], [None], ["A" * 16], 5])
+def test_normalize_tickers_rejects_bad_input(tickers):
+    with pytest.raises(ValueError):
+        normalize_tickers(tickers)
+
+
+@pytest.mark.parametrize("payload", [{"tickers": [1]}, {"tickers": ["<b>x</b>"]}, {"tickers": 7}])
+def test_create_job_rejects_bad_tickers_asgi(tmp_path, payload):
+    from starlette.testclient import TestClient
+
+    from Final_Project.asgi_app import create_app
+
+    client = TestClient(create_app(JobManager(root=tmp_path)))
+    resp = client.post("/jobs", json=payload)
+    assert resp.status_code == 400
+    assert "ticker" in resp.json()["error"]
+
+
+@pytest.mark.parametrize("payload", [{"tickers": [1]}, {"tickers": "AAPL,<script>"}])
+def test_create_job_rejects_bad_tickers_flask(payload):
+    from Final_Project.web_app import app
+
+    resp = app.test_client().post("/jobs", json=payload)
+    assert resp.status_code == 400
+
+
+def test_pruned_jobs_lose_their_output_dir(tmp_path):
+    jobs = ScriptJobManager(root=tmp_path, history=1)
+    first, _ = jobs.submit(["AAPL"])
+    wait_done(first)
+    second, _ = jobs.submit(["MSFT"])
+    wait_done(second)
+    third, _ = jobs.submit(["NVDA"])
+
+    assert jobs.get(first.id) is None
+    assert not first.output_dir.exists()
+    assert second.output_dir.exists() and third.output_dir.exists()
+    wait_done(third)
+
+
+class SleepJobManager(ScriptJobManager):
+    script = "import time; print('started', flush=True); time.sleep(30)"
+
+
+def test_same_tickers_join_the_running_job(tmp_path):
+    jobs = SleepJobManager(root=tmp_path)
+    first, created = jobs.submit(["msft", "AAPL"])
+    second, joined = jobs.submit(["aapl", "MSFT", "msft"])
+    try:
+        assert created and not joined
+        assert second is first
+        other, created_other = jobs.submit(["NVDA"])
+        assert created_other and other is not first
+    finally:
+        for job in jobs.list():
+            jobs.cancel(job.id)
+    for job in jobs.list():
+        wait_done(job)
+
+
+def test_cancel_running_job_terminates_process(tmp_path):
+    jobs = SleepJobManager(root=tmp_path)
+    job, _ = jobs.submit(["AAPL"])
+    for _ in job.subscribe(heartbeat=5):
+        if job.status == "running" and job._process is not None:
+            break
+    started = time.monotonic()
+    jobs.cancel(job.id)
+    wait_done(job)
+    assert job.status == "cancelled"
+    assert time.monotonic() - started < 5
+    assert jobs.submit(["AAPL"])[1]  # отменённый больше не принимает дубликаты
+    for other in jobs.list():
+        jobs.cancel(other.id)
+        wait_done(other)
+
+
+def test_cancel_queued_job_never_starts(tmp_path):
+    jobs = SleepJobManager(root=tmp_path, max_workers=1)
+    running, _ = jobs.submit(["AAPL"])
+    queued, _ = jobs.submit(["MSFT"])
+    assert jobs.cancel(queued.id).status == "cancelled"
+    jobs.cancel(running.id)
+    wait_done(running)
+    assert queued.started is None
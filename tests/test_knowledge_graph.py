@@ -0,0 +1,34 @@
+import datetime as dt
+
+from langchain_core.documents import Document
+
+from Final_Project.knowledge_graph import KnowledgeGraph, update_graph_from_docs
+
+
+def test_context_keeps_newest_events_under_node_cap(tmp_path):
+    graph = KnowledgeGraph()
+    docs = [Document(page_content="AAPL prices", metadata={"ticker": "AAPL", "source": "price_table", "sector": "Tech"})]
+    summary = {"AAPL": {"rsi14": 75.0, "macd_hist": 1.0, "drawdown": -0.3}}
+    start = dt.date(2026, 1, 1)
+    for day in range(60):
+        update_graph_from_docs(graph, docs, summary, today=start + dt.timedelta(days=day))
+    graph.save(tmp_path / "kg.npz")
+
+    for g in (graph, KnowledgeGraph.load(tmp_path / "kg.npz")):
+        context = g.context_for("AAPL", max_nodes=10)
+        last = str(start + dt.timedelta(days=59))
+        assert f"AAPL:rsi_overbought:{last}" in context
+        assert "sector:Tech" in context
+        assert "2026-01-01" not in context
+
+
+def test_pdf_chunk_with_run_ticker_links_to_ticker():
+    graph = KnowledgeGraph()
+    docs = [
+        Document(page_content="AAPL news", metadata={"ticker": "AAPL", "source": "news"}),
+        Document(page_content="Apple margins vs MSFT", metadata={"ticker": "AAPL", "source": "pdf", "page": 2}),
+        Document(page_content="MSFT news", metadata={"ticker": "MSFT", "source": "news"}),
+    ]
+    update_graph_from_docs(graph, docs, today=dt.date(2026, 1, 1))
+    context = graph.context_for("AAPL")
+    assert "-[has_document]-> document:pdf#2:" in context
@@ -0,0 +1,80 @@
+import itertools
+
+import pytest
+
+from Final_Project import llm_cache
+from Final_Project.llm_cache import LLMCache, cached_invoke
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Управляемое время: каждый вызов time.time() — следующая секунда."""
+    ticks = itertools.count(1_000_000)
+    state = {"offset": 0.0}
+    monkeypatch.setattr(llm_cache.time, "time", lambda: next(ticks) + state["offset"])
+    return state
+
+
+def make_cache(tmp_path, **kwargs):
+    return LLMCache(path=tmp_path / "llm.sqlite3", enabled=True, **kwargs)
+
+
+def test_put_get_and_stats(tmp_path):
+    cache = make_cache(tmp_path, max_entries=100, ttl=0)
+    key = LLMCache.key("ollama/llama3", 0.2, 512, "prompt")
+    assert key != LLMCache.key("ollama/llama3", 0.3, 512, "prompt")
+    assert cache.get(key) is None
+    cache.put(key, "answer")
+    assert cache.get(key) == "answer"
+    assert cache.get(key, bypass=True) is None
+    assert (cache.stats.hits, cache.stats.misses, cache.stats.bypassed) == (1, 1, 1)
+
+
+def test_expired_entry_is_a_miss_and_deleted(tmp_path, clock):
+    cache = make_cache(tmp_path, max_entries=100, ttl=60)
+    cache.put("k", "v")
+    assert cache.get("k") == "v"
+    clock["offset"] = 120
+    assert cache.get("k") is None
+    assert cache._exact_count() == 0 and cache._count == 0
+
+
+def test_eviction_drops_a_batch_of_least_recently_used(tmp_path, clock):
+    cache = make_cache(tmp_path, max_entries=40, ttl=0)
+    assert cache.evict_batch == 2
+    for i in range(40):
+        cache.put(f"k{i}", str(i))
+    assert cache.get("k0") == "0"  # k0 становится самым свежим
+    cache.put("k40", "40")
+
+    assert cache._exact_count() == 38
+    assert cache.stats.evictions == 3
+    assert cache.get("k0") == "0"
+    assert cache.get("k1") is None and cache.get("k2") is None and cache.get("k3") is None
+    assert cache.get("k4") == "4"
+
+
+def test_new_instance_starts_from_the_stored_count(tmp_path):
+    first = make_cache(tmp_path, max_entries=20, ttl=0)
+    for i in range(15):
+        first.put(f"a{i}", "x")
+    second = make_cache(tmp_path, max_entries=20, ttl=0)
+    assert second._count == 15
+    for i in range(6):
+        second.put(f"b{i}", "x")
+    assert second._exact_count() == 20 - second.evict_batch
+
+
+def test_cached_invoke_calls_model_once(tmp_path, monkeypatch):
+    class StubLLM:
+        model = "stub"
+        calls = 0
+
+        def invoke(self, prompt):
+            self.calls += 1
+            return f"echo {prompt}"
+
+    monkeypatch.setattr(llm_cache, "_cache", make_cache(tmp_path, max_entries=100, ttl=0))
+    llm = StubLLM()
+    assert cached_invoke(llm, "hi") == cached_invoke(llm, "hi") == "echo hi"
+    assert llm.calls == 1
@@ -0,0 +1,28 @@
+from reportlab.platypus import Paragraph
+
+from Final_Project.pdf_renderer import MarkdownRenderer, get_fonts, inline_markup
+
+
+def test_dunder_names_are_not_bold():
+    fonts = get_fonts()
+    assert inline_markup("call __init__ here", fonts) == "call __init__ here"
+    assert inline_markup("__Key point__ first", fonts) == "<b>Key point</b> first"
+
+
+def test_quote_in_link_url_is_escaped():
+    markup = inline_markup('[x](http://a/"b)', get_fonts())
+    assert 'href="http://a/&quot;b"' in markup
+
+
+def test_mis_nested_emphasis_falls_back_to_plain_text():
+    story = MarkdownRenderer().flowables("*a **b* c**")
+    paragraph = story[0]
+    assert isinstance(paragraph, Paragraph)
+    assert paragraph.getPlainText() == "*a **b* c**"
+
+
+def test_unreadable_image_becomes_caption(tmp_path):
+    (tmp_path / "bad.png").write_text("not an image")
+    story = MarkdownRenderer(base_dir=tmp_path).flowables("![chart](bad.png)")
+    paragraphs = [f for f in story if isinstance(f, Paragraph)]
+    assert [p.getPlainText() for p in paragraphs] == ["[image unreadable: bad.png]"]
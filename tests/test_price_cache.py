@@ -0,0 +1,60 @@
+import asyncio
+import json
+
+import numpy as np
+import pandas as pd
+
+from Final_Project.price_cache import CachedPriceProvider, PriceCache
+
+
+def _bars(start: str, periods: int, columns=("Open", "High", "Low", "Close", "Volume")) -> pd.DataFrame:
+    index = pd.date_range(start, periods=periods, freq="D", name="Date")
+    data = np.arange(periods * len(columns), dtype=np.float64).reshape(periods, len(columns))
+    return pd.DataFrame(data, index=index, columns=list(columns))
+
+
+def test_append_reordered_columns_keeps_history(tmp_path):
+    cache = PriceCache(tmp_path)
+    history = _bars("2024-01-01", 100)
+    cache.write("AAPL", "1d", history)
+
+    delta = _bars("2024-04-09", 2)[["Close", "Volume", "Open", "High", "Low"]]
+    assert cache.append("AAPL", "1d", delta) == 2
+
+    out = cache.read("AAPL", "1d")
+    assert len(out) == 101  # последний бар заменён, ещё один дописан
+    assert list(out.columns) == list(history.columns)
+    np.testing.assert_array_equal(out.to_numpy()[:99], history.to_numpy()[:99])
+    np.testing.assert_array_equal(out.to_numpy()[99:], delta[list(history.columns)].to_numpy())
+    assert out.index[-1] == delta.index[-1]
+
+
+def test_append_new_column_keeps_history(tmp_path):
+    cache = PriceCache(tmp_path)
+    cache.write("AAPL", "1d", _bars("2024-01-01", 100))
+
+    delta = _bars("2024-04-10", 2, ("Open", "High", "Low", "Close", "Volume", "Adj Close"))
+    cache.append("AAPL", "1d", delta)
+
+    out = cache.read("AAPL", "1d")
+    assert len(out) == 102
+    assert list(out.columns)[-1] == "Adj Close"
+    assert out["Adj Close"].iloc[:100].isna().all()
+    assert (out["Adj Close"].iloc[100:] == delta["Adj Close"].to_numpy()).all()
+
+
+def test_failed_delta_refresh_does_not_mark_fresh(tmp_path):
+    class Offline:
+        def fetch_batch(self, tickers, start=None):
+            raise ConnectionError("network down")
+
+    cache = PriceCache(tmp_path, ttl=60)
+    cache.write("AAPL", "1d", _bars("2024-01-01", 10))
+    meta = cache.meta("AAPL", "1d")
+    meta["fetched_at"] -= 3600
+    (tmp_path / "1d" / "AAPL.json").write_text(json.dumps(meta))
+
+    result = asyncio.run(CachedPriceProvider(Offline(), cache).fetch_batch(["AAPL"]))
+
+    assert len(result["AAPL"]) == 10  # устаревшие бары отданы
+    assert not cache.is_fresh(cache.meta("AAPL", "1d"))
@@ -0,0 +1,74 @@
+import time
+from pathlib import Path
+
+import pytest
+
+from Final_Project.report_store import ReportStore, zstandard
+
+DAY = 86400
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ReportStore(root=tmp_path, compression="none", retention_days=0, max_count=0)
+    yield store
+    store.close()
+
+
+@pytest.mark.parametrize("compression", ["none", "zstd"])
+def test_save_and_read_round_trip(tmp_path, compression):
+    if compression == "zstd" and zstandard is None:
+        pytest.skip("zstandard is not installed")
+    store = ReportStore(root=tmp_path, compression=compression, retention_days=0, max_count=0)
+    record = store.save("# Report\n\nПривет", [" aapl", "MSFT", "aapl"], run_id="r1")
+    assert record.tickers == ["AAPL", "MSFT"]
+    assert (tmp_path / record.path).exists()
+    assert store.read("r1") == "# Report\n\nПривет"
+    assert store.read("missing") is None
+    store.close()
+
+
+def test_resave_replaces_previous_version(store, tmp_path):
+    first = store.save("v1", ["AAPL"], run_id="r1", created=time.time() - 40 * DAY)
+    store.save("v2", ["AAPL"], run_id="r1")
+    assert len(store) == 1
+    assert store.read("r1") == "v2"
+    assert not (tmp_path / first.path).exists()
+
+
+def test_list_filters_by_ticker_and_time(store):
+    now = time.time()
+    store.save("a", ["AAPL"], run_id="old", created=now - 3 * DAY)
+    store.save("b", ["AAPL", "MSFT"], run_id="mid", created=now - 2 * DAY)
+    store.save("c", ["MSFT"], run_id="new", created=now - DAY)
+
+    assert [r.run_id for r in store.list()] == ["new", "mid", "old"]
+    assert [r.run_id for r in store.list(ticker="aapl")] == ["mid", "old"]
+    assert [r.run_id for r in store.list(since=now - 2.5 * DAY, until=now - 1.5 * DAY)] == ["mid"]
+    assert [r.run_id for r in store.list(limit=1, offset=1)] == ["mid"]
+    assert store.latest("MSFT").run_id == "new"
+
+
+def test_diff_shows_changed_lines(store):
+    store.save("Buy AAPL\nHold MSFT", ["AAPL"], run_id="a")
+    store.save("Buy AAPL\nSell MSFT\n", ["AAPL"], run_id="b")
+    diff = store.diff("a", "b")
+    assert "-Hold MSFT\n" in diff and "+Sell MSFT\n" in diff
+    assert " Buy AAPL\n" in diff
+    assert store.diff("a", "missing") is None
+
+
+def test_retention_by_age_and_count(tmp_path):
+    store = ReportStore(root=tmp_path, compression="none", retention_days=30, max_count=2)
+    now = time.time()
+    expired = store.save("x", ["AAPL"], run_id="expired", created=now - 31 * DAY)
+    assert store.get("expired") is None
+    assert not (tmp_path / expired.path).exists()
+
+    for i in range(3):
+        store.save(str(i), ["AAPL"], run_id=f"r{i}", created=now - (3 - i) * 60)
+    assert [r.run_id for r in store.list()] == ["r2", "r1"]
+    assert store.apply_retention(now=now + 30 * DAY) == 2
+    assert len(store) == 0
+    assert not list(Path(tmp_path).rglob("*.md"))
+    store.close()
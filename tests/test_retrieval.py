@@ -0,0 +1,72 @@
+import pytest
+from langchain_core.documents import Document
+
+from Final_Project.embeddings import HashingEmbeddings
+from Final_Project.retrieval import (
+    QUERY_PROFILES,
+    HybridRetriever,
+    InMemoryVectorSearch,
+    _synthetic_corpus,
+    reciprocal_rank_fusion,
+)
+
+
+@pytest.fixture(scope="module")
+def corpus():
+    return _synthetic_corpus(n_tickers=8, docs_per_ticker=30)
+
+
+@pytest.fixture
+def retriever(corpus):
+    ids, docs, _ = corpus
+    retriever = HybridRetriever(InMemoryVectorSearch(HashingEmbeddings()))
+    retriever.add(ids, docs)
+    return retriever
+
+
+def test_rrf_rewards_agreement_between_rankings():
+    fused = reciprocal_rank_fusion([["a", "b", "c"], ["b", "c", "a"], ["b", "d"]])
+    assert fused[0] == "b"
+    assert set(fused) == {"a", "b", "c", "d"}
+    assert fused.index("d") > fused.index("c")
+
+
+@pytest.mark.parametrize("qtype", list(QUERY_PROFILES))
+def test_results_stay_within_ticker_and_profile_sources(retriever, qtype):
+    for ticker in ("T000", "T005"):
+        found = retriever.retrieve(ticker, qtype, k=6)
+        assert found
+        assert {d.metadata["ticker"] for d in found} == {ticker}
+        assert {d.metadata["source"] for d in found} <= set(QUERY_PROFILES[qtype].sources)
+
+
+def test_hybrid_recall_on_synthetic_corpus(retriever, corpus):
+    ids, docs, relevant = corpus
+    doc_ids = {id(d): i for i, d in zip(ids, docs)}
+    hits = total = 0
+    for (ticker, qtype), truth in relevant.items():
+        found = {doc_ids[id(d)] for d in retriever.retrieve(ticker, qtype, k=6)}
+        hits += len(truth & found)
+        total += min(len(truth), 6)
+    assert hits / total > 0.8
+
+
+def test_add_and_remove_invalidate_memo(retriever):
+    before = retriever.retrieve("T001", "technical", k=3)
+    assert retriever.retrieve("T001", "technical", k=3) is before
+
+    doc = Document(
+        page_content="T001 rsi macd moving average breakout momentum",
+        metadata={"ticker": "T001", "source": "technical_indicators"},
+    )
+    retriever.add(["fresh"], [doc])
+    assert retriever.retrieve("T001", "technical", k=3)[0] is doc
+
+    retriever.remove(["fresh"])
+    assert doc not in retriever.retrieve("T001", "technical", k=3)
+
+
+def test_missing_and_ids_for(retriever):
+    assert retriever.missing(["T000-0", "unknown"]) == ["unknown"]
+    snapshot = retriever.ids_for("T000", "price_table")
+    assert snapshot and all(retriever._docs[i].metadata["source"] == "price_table" for i in snapshot)
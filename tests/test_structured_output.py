@@ -0,0 +1,79 @@
+import json
+
+import pytest
+
+from Final_Project.chains import FundamentalAnalysis, RiskAssessment, TechnicalAnalysis
+from Final_Project.structured_output import (
+    StructuredGenerator,
+    StructuredOutputError,
+    coerce,
+    extract_json,
+)
+
+
+class StubLLM:
+    """Отвечает заготовленными ответами по очереди и запоминает вызовы."""
+
+    def __init__(self, *replies):
+        self.replies = list(replies)
+        self.calls = []
+
+    def __call__(self, prompt, schema):
+        self.calls.append((prompt, schema))
+        return self.replies.pop(0)
+
+
+def test_extract_json_from_fenced_prose():
+    text = 'Sure!\n```json\n{"a": {"b": 1}}\n```\nanything else?'
+    assert extract_json(text) == {"a": {"b": 1}}
+    assert extract_json("no braces {here") is None
+
+
+def test_coerce_fixes_lists_enums_and_strings():
+    data = {
+        "ticker": "AAPL",
+        "trend_summary": ["up", "channel"],
+        "key_indicators": "- SMA20 > SMA50\n- RSI 63; Bollinger widening",
+        "rating": " Bullish ",
+    }
+    assert coerce(TechnicalAnalysis, data) == 3
+    assert data["key_indicators"] == ["SMA20 > SMA50", "RSI 63", "Bollinger widening"]
+    assert data["rating"] == "bullish"
+    assert data["trend_summary"] == "up; channel"
+    TechnicalAnalysis.model_validate(data)
+
+
+def test_local_fix_needs_no_repair_call():
+    llm = StubLLM('```json\n{"trend_summary": "up", "key_indicators": "RSI 63", "rating": "NEUTRAL"}\n```')
+    result = StructuredGenerator(llm, max_repairs=2).generate(
+        TechnicalAnalysis, "Technical analysis for AAPL", {"ticker": "AAPL"}
+    )
+    assert result.rating == "neutral" and result.ticker == "AAPL"
+    assert len(llm.calls) == 1
+
+
+def test_repair_asks_only_for_invalid_fields():
+    llm = StubLLM(
+        '{"business_summary": "Ecosystem", "strengths": ["services"], "weaknesses": "china"}',
+        '{"valuation_view": "Premium multiple", "business_summary": "ignored"}',
+    )
+    result = StructuredGenerator(llm, max_repairs=2).generate(
+        FundamentalAnalysis, "Fundamental analysis for AAPL", {"ticker": "AAPL"}
+    )
+    assert result.valuation_view == "Premium multiple"
+    assert result.business_summary == "Ecosystem"
+    assert result.weaknesses == ["china"]
+
+    repair_prompt, repair_schema = llm.calls[1]
+    assert list(repair_schema["properties"]) == ["valuation_view"]
+    assert json.loads(repair_prompt.rsplit("Fields: ", 1)[1]) == {"valuation_view": "string"}
+
+
+def test_gives_up_after_max_repairs():
+    llm = StubLLM(
+        '{"risk_factors": ["debt"], "overall_risk_level": "moderate", "comments": "x"}',
+        '{"overall_risk_level": "extreme"}',
+    )
+    with pytest.raises(StructuredOutputError, match="overall_risk_level"):
+        StructuredGenerator(llm, max_repairs=1).generate(RiskAssessment, "Risk for AAPL", {"ticker": "AAPL"})
+    assert len(llm.calls) == 2
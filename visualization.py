@@ -1,28 +1,398 @@
+# visualization.py
+
+"""
+Графики цен для multimodal-данных и отчётов.
+
+- объектный API matplotlib (Figure + FigureCanvasAgg), без pyplot и его
+  глобального состояния — безопасно из потоков;
+- шаблоны фигур: оси, линии, легенда и форматтеры создаются один раз на
+  набор панелей, между тикерами меняются только данные (set_data);
+- панели: цена (+ наложение индикаторов SMA20/SMA50 и полосы Боллинджера),
+  объём, просадка — набор задаётся CHART_PANELS;
+- цена — "Adj Close", а если его нет (yfinance с auto_adjust=True) — "Close";
+- батч тикеров рендерится в пуле процессов (мелкий батч — в текущем
+  процессе, запуск пула дороже самих графиков);
+- рядом с PNG хранится хэш данных: неизменившийся график не перерисовывается.
+"""
+
 from __future__ import annotations
 
+import hashlib
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
 from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
 
-import matplotlib.pyplot as plt
+import numpy as np
 import pandas as pd
+from matplotlib import dates as mdates
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from matplotlib.ticker import EngFormatter
 
 from .config import settings
+from .indicators import drawdown, rolling_mean_std, sma
 
 
-def generate_price_plot(ticker: str, df: pd.DataFrame) -> str:
+# Меняется вместе с оформлением — старые хэши перестают совпадать
+CHART_VERSION = "3"
+
+PANELS = ("price", "volume", "indicators", "drawdown")
+FIGSIZE = (8.0, 5.5)
+
+
+# ============================
+# Данные графика
+# ============================
+
+@dataclass
+class ChartData:
+    """Только numpy-массивы: дёшево хэшировать и передавать в процесс."""
+    ticker: str
+    x: np.ndarray                  # даты в числах matplotlib (или номера баров)
+    price: np.ndarray
+    volume: Optional[np.ndarray]
+    price_label: str
+    is_dates: bool
+
+    def digest(self, panels: Sequence[str], dpi: int) -> str:
+        h = hashlib.sha256(
+            f"{CHART_VERSION}|{','.join(panels)}|{dpi}|{self.ticker}|{self.price_label}".encode("utf-8")
+        )
+        h.update(self.x.tobytes())
+        h.update(self.price.tobytes())
+        if self.volume is not None:
+            h.update(self.volume.tobytes())
+        return h.hexdigest()
+
+
+def price_column(df: pd.DataFrame) -> Optional[str]:
+    for col in ("Adj Close", "Close"):
+        if col in df.columns:
+            return col
+    return None
+
+
+def chart_data(ticker: str, df: pd.DataFrame) -> Optional[ChartData]:
+    col = price_column(df) if df is not None else None
+    if col is None or df.empty:
+        return None
+    price = df[col].to_numpy(np.float64)
+    if not np.isfinite(price).any():
+        return None  # одни NaN/inf — рисовать нечего (и оси без пределов)
+    volume = df["Volume"].to_numpy(np.float64) if "Volume" in df.columns else None
+    if isinstance(df.index, pd.DatetimeIndex):
+        x = mdates.date2num(df.index.tz_localize(None) if df.index.tz else df.index)
+        is_dates = True
+    else:
+        x = np.arange(len(df), dtype=np.float64)
+        is_dates = False
+    return ChartData(ticker, np.asarray(x, dtype=np.float64), price, volume, col, is_dates)
+
+
+# ============================
+# Шаблон фигуры
+# ============================
+
+class ChartTemplate:
     """
-    Сохраняет простой график цен для multimodal данных.
+    Фигура с осями и линиями под один набор панелей. render() подставляет
+    данные тикера и сохраняет PNG; заливки (fill_between) пересоздаются —
+    у PolyCollection нет set_data.
     """
-    if "Adj Close" not in df.columns:
+
+    def __init__(self, panels: Sequence[str], is_dates: bool = True, dpi: Optional[int] = None) -> None:
+        self.panels = tuple(panels)
+        self.dpi = dpi or settings.CHART_DPI
+        self.overlay = "indicators" in self.panels
+        rows = ["price"] + [p for p in ("volume", "drawdown") if p in self.panels]
+
+        self.figure = Figure(figsize=FIGSIZE, dpi=self.dpi)
+        FigureCanvasAgg(self.figure)
+        grid = self.figure.add_gridspec(len(rows), 1, height_ratios=[3] + [1] * (len(rows) - 1), hspace=0.08)
+        self.axes: Dict[str, object] = {}
+        for i, name in enumerate(rows):
+            share = self.axes.get("price")
+            self.axes[name] = self.figure.add_subplot(grid[i], sharex=share)
+        # поля фиксированы: tight_layout на каждом графике стоил бы дороже рендера
+        self.figure.subplots_adjust(left=0.09, right=0.98, top=0.93, bottom=0.08)
+
+        price_ax = self.axes["price"]
+        (self.price_line,) = price_ax.plot([], [], color="#2563eb", lw=1.4, label="Price")
+        if self.overlay:
+            (self.sma_fast,) = price_ax.plot([], [], color="#f59e0b", lw=1.0, label="SMA 20")
+            (self.sma_slow,) = price_ax.plot([], [], color="#16a34a", lw=1.0, label="SMA 50")
+        self.legend = price_ax.legend(loc="upper left", fontsize=8, frameon=False)
+        price_ax.set_ylabel("Price")
+        price_ax.grid(alpha=0.25)
+        self.title = self.figure.suptitle("", fontsize=11)
+
+        if "volume" in self.axes:
+            self.axes["volume"].set_ylabel("Volume", fontsize=8)
+            self.axes["volume"].yaxis.set_major_formatter(EngFormatter(places=0))
+            self.axes["volume"].grid(alpha=0.25)
+        if "drawdown" in self.axes:
+            ax = self.axes["drawdown"]
+            (self.dd_line,) = ax.plot([], [], color="#dc2626", lw=0.8)
+            ax.set_ylabel("Drawdown", fontsize=8)
+            ax.yaxis.set_major_formatter(lambda v, _: f"{v:.0%}")
+            ax.grid(alpha=0.25)
+
+        for name, ax in self.axes.items():
+            if name != rows[-1]:
+                ax.tick_params(labelbottom=False)
+        if is_dates:
+            bottom = self.axes[rows[-1]]
+            locator = mdates.AutoDateLocator()
+            bottom.xaxis.set_major_locator(locator)
+            bottom.xaxis.set_major_formatter(mdates.ConciseDateFormatter(locator))
+
+        self._fills: List[object] = []
+
+    def render(self, data: ChartData, path: Path) -> None:
+        for fill in self._fills:
+            fill.remove()
+        self._fills = []
+        x, price = data.x, data.price
+        price_ax = self.axes["price"]
+
+        self.price_line.set_data(x, price)
+        self.legend.get_texts()[0].set_text(data.price_label)
+        self.title.set_text(f"{data.ticker} — {data.price_label}")
+        lo, hi = np.nanmin(price), np.nanmax(price)
+        if self.overlay:
+            row = price[None, :]
+            self.sma_fast.set_data(x, sma(row, 20)[0])
+            self.sma_slow.set_data(x, sma(row, 50)[0])
+            mean, std = rolling_mean_std(row, 20)
+            upper, lower = mean[0] + 2 * std[0], mean[0] - 2 * std[0]
+            self._fills.append(price_ax.fill_between(x, lower, upper, color="#94a3b8", alpha=0.2, lw=0))
+            if np.isfinite(upper).any():
+                lo, hi = min(lo, np.nanmin(lower)), max(hi, np.nanmax(upper))
+        pad = (hi - lo) * 0.05 or 1.0
+        price_ax.set_ylim(lo - pad, hi + pad)
+        price_ax.set_xlim(x[0], x[-1] if len(x) > 1 else x[0] + 1)
+
+        if "volume" in self.axes:
+            ax = self.axes["volume"]
+            volume = data.volume if data.volume is not None else np.zeros_like(price)
+            self._fills.append(ax.fill_between(x, 0, volume, step="mid", color="#64748b", alpha=0.6, lw=0))
+            finite = volume[np.isfinite(volume)]
+            ax.set_ylim(0, max(finite.max() if finite.size else 0.0, 1.0) * 1.05)
+        if "drawdown" in self.axes:
+            ax = self.axes["drawdown"]
+            dd = drawdown(price[None, :])[0]
+            self.dd_line.set_data(x, dd)
+            self._fills.append(ax.fill_between(x, dd, 0, color="#dc2626", alpha=0.25, lw=0))
+            ax.set_ylim(min(np.nanmin(dd), -0.01) * 1.1, 0.005)
+
+        # временный файл + replace: читатель (PDF, дашборд) не увидит недописанный PNG
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(prefix=f".{path.stem}.", suffix=".png", dir=str(path.parent))
+        os.close(fd)
+        try:
+            self.figure.savefig(tmp, format="png", dpi=self.dpi)
+            os.replace(tmp, path)
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+
+
+_templates = threading.local()
+
+
+def _template(panels: Tuple[str, ...], is_dates: bool, dpi: int) -> ChartTemplate:
+    cache = getattr(_templates, "cache", None)
+    if cache is None:
+        cache = _templates.cache = {}
+    key = (panels, is_dates, dpi)
+    if key not in cache:
+        cache[key] = ChartTemplate(panels, is_dates, dpi)
+    return cache[key]
+
+
+def _digest_path(path: Path) -> Path:
+    return path.parent / f"{path.name}.sha256"
+
+
+def _is_fresh(path: Path, digest: str) -> bool:
+    try:
+        return path.exists() and _digest_path(path).read_text(encoding="ascii") == digest
+    except OSError:
+        return False
+
+
+def _render_one(job: Tuple[Tuple[str, ...], int, ChartData, str, str]) -> str:
+    """
+    Выполняется в процессе пула (или в текущем): рендер + запись хэша.
+    Ошибка одного тикера не роняет батч: "" — график пропущен.
+    """
+    panels, dpi, data, path, digest = job
+    path = Path(path)
+    try:
+        _template(panels, data.is_dates, dpi).render(data, path)
+        _digest_path(path).write_text(digest, encoding="ascii")
+    except Exception as e:
+        print(f"⚠️ {data.ticker}: chart failed ({type(e).__name__}: {e}), skipped")
         return ""
+    return str(path)
+
+
+# ============================
+# Батч
+# ============================
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+
+def _get_pool(workers: int) -> ProcessPoolExecutor:
+    """Пул живёт между батчами; spawn — родитель многопоточный (asyncio, веб)."""
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            _pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+            _pool_workers = workers
+        return _pool
+
+
+@dataclass
+class ChartStats:
+    rendered: int = 0
+    unchanged: int = 0
+    skipped: int = 0
+    seconds: float = 0.0
+
+    def report(self) -> str:
+        return (
+            f"charts: {self.rendered} rendered, {self.unchanged} unchanged, "
+            f"{self.skipped} skipped ({self.seconds:.2f}s)"
+        )
+
+
+def render_charts(
+    frames: Dict[str, pd.DataFrame],
+    panels: Optional[Sequence[str]] = None,
+    out_dir: Optional[Path] = None,
+    workers: Optional[int] = None,
+    dpi: Optional[int] = None,
+) -> Tuple[Dict[str, str], ChartStats]:
+    """
+    Рисует графики тикеров; возвращает {тикер: путь к PNG} ("" — нет цен)
+    и статистику. Графики с неизменными данными не перерисовываются.
+    """
+    started = time.perf_counter()
+    panels = tuple(p for p in PANELS if p in (panels or settings.CHART_PANELS))
+    out_dir = Path(out_dir or settings.DATA_DIR)
+    dpi = dpi or settings.CHART_DPI
+    workers = settings.CHART_WORKERS if workers is None else workers
+    stats = ChartStats()
+
+    paths: Dict[str, str] = {}
+    jobs: List[Tuple[Tuple[str, ...], int, ChartData, str, str]] = []
+    for ticker, df in frames.items():
+        data = chart_data(ticker, df)
+        if data is None:
+            print(f"⚠️ {ticker}: no Adj Close/Close prices, chart skipped")
+            paths[ticker] = ""
+            stats.skipped += 1
+            continue
+        path = out_dir / f"{ticker}_price.png"
+        digest = data.digest(panels, dpi)
+        if _is_fresh(path, digest):
+            paths[ticker] = str(path)
+            stats.unchanged += 1
+            continue
+        jobs.append((panels, dpi, data, str(path), digest))
+
+    rendered: Optional[List[str]] = None
+    if len(jobs) >= settings.CHART_PROCESS_MIN and workers > 1:
+        chunk = max(1, len(jobs) // (workers * 4))
+        try:
+            rendered = list(_get_pool(workers).map(_render_one, jobs, chunksize=chunk))
+        except Exception as e:
+            # пул сломан (упавший процесс и т.п.) — дорисуем на месте
+            print(f"⚠️ chart pool failed ({type(e).__name__}: {e}), rendering in-process")
+    if rendered is None:
+        rendered = [_render_one(job) for job in jobs]
+    for job, path in zip(jobs, rendered):
+        paths[job[2].ticker] = path
+    stats.rendered = sum(1 for path in rendered if path)
+    stats.skipped += len(rendered) - stats.rendered
+    stats.seconds = time.perf_counter() - started
+    return paths, stats
+
+
+def generate_price_plot(ticker: str, df: pd.DataFrame) -> str:
+    """
+    Сохраняет график цен одного тикера (см. render_charts для батча).
+    """
+    paths, _ = render_charts({ticker: df}, workers=1)
+    return paths[ticker]
+
+
+# ============================
+# Бенчмарк
+# ============================
+
+def _legacy_plot(ticker: str, df: pd.DataFrame, out_dir: Path) -> str:
+    """Прежняя реализация (pyplot, новая фигура на тикер), с Close вместо Adj Close."""
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
 
     plt.figure()
-    df["Adj Close"].plot()
+    df["Close"].plot()
     plt.title(f"{ticker} Adjusted Close Price")
     plt.xlabel("Date")
     plt.ylabel("Price")
-
-    img_path = settings.DATA_DIR / f"{ticker}_price.png"
+    img_path = out_dir / f"{ticker}_price.png"
     plt.tight_layout()
     plt.savefig(img_path)
     plt.close()
-    return str(img_path)
\ No newline at end of file
+    return str(img_path)
+
+
+def _benchmark(n_tickers: int = 48) -> None:
+    from .market_data import synthetic_prices
+
+    frames = {f"T{i:03d}": synthetic_prices(f"T{i:03d}", periods=252) for i in range(n_tickers)}
+    workers = max(2, settings.CHART_WORKERS)
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+
+        (tmp / "legacy").mkdir()
+        started = time.perf_counter()
+        for t, df in frames.items():
+            _legacy_plot(t, df, tmp / "legacy")
+        legacy = time.perf_counter() - started
+        print(f"🐢 legacy pyplot (price only): {legacy:.2f}s, {legacy / n_tickers * 1000:.0f} ms/chart")
+
+        _, stats = render_charts(frames, out_dir=tmp / "seq", workers=1)
+        print(f"🖼️ templates, in-process (4 panels): {stats.seconds:.2f}s, "
+              f"{stats.seconds / n_tickers * 1000:.0f} ms/chart")
+
+        _, stats = render_charts(frames, out_dir=tmp / "pool", workers=workers)
+        print(f"🧵 templates, {workers} processes (cold pool): {stats.seconds:.2f}s")
+        frames = {t: df.iloc[1:] for t, df in frames.items()}  # новые данные — те же процессы
+        _, stats = render_charts(frames, out_dir=tmp / "pool", workers=workers)
+        print(f"🔥 templates, {workers} processes (warm pool): {stats.seconds:.2f}s "
+              f"({os.cpu_count()} CPU)")
+
+        _, stats = render_charts(frames, out_dir=tmp / "pool", workers=workers)
+        print(f"♻️ unchanged data: {stats.report()}")
+
+        paths, _ = render_charts({"X": frames["T000"]}, out_dir=tmp, workers=1)
+        print(f"✅ frame without 'Adj Close' -> {Path(paths['X']).name}")
+
+
+if __name__ == "__main__":
+    _benchmark()
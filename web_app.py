@@ -1,127 +1,176 @@
-import subprocess
 from pathlib import Path
-from flask import Flask, render_template_string, Response, send_file
-from reportlab.lib.pagesizes import A4
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.platypus import SimpleDocTemplate, Paragraph
+from flask import Flask, Response, send_file, request, jsonify, abort
 
 BASE_DIR = Path(__file__).resolve().parent
 REPORT_MD = BASE_DIR / "final_investment_report.md"
-REPORT_PDF = BASE_DIR / "final_investment_report.pdf"
+
+try:
+    from .dashboard_ui import render_index
+    from .config import settings
+    from .jobs import JobManager
+    from .pdf_renderer import get_pdf_renderer
+    from .report_store import get_report_store, query_filters
+    from .streaming import sse_frame
+except ImportError:  # запуск как скрипт: python web_app.py
+    from Final_Project.dashboard_ui import render_index
+    from Final_Project.config import settings
+    from Final_Project.jobs import JobManager
+    from Final_Project.pdf_renderer import get_pdf_renderer
+    from Final_Project.report_store import get_report_store, query_filters
+    from Final_Project.streaming import sse_frame
 
 app = Flask(__name__)
+jobs = JobManager()
+reports = get_report_store()
+TICKERS = settings.DEFAULT_TICKERS
 
-HTML = """
-<!DOCTYPE html>
-<html>
-<head>
-    <meta charset="utf-8">
-    <title>Intelligent Financial Agent Platform</title>
-    <style>
-        body {
-            background: #0f172a;          /* тёмно-синий */
-            color: #f1f5f9;               /* светлый текст */
-            font-family: monospace;
-            padding: 20px;
-        }
-        pre {
-            background: #020617;
-            padding: 20px;
-            border-radius: 12px;
-            white-space: pre-wrap;
-            font-size: 13px;
-            height: 600px;
-            overflow-y: scroll;
-            border: 2px solid #22c55e;    /* зелёный акцент */
-        }
-        h1 {
-            color: #22c55e;               /* зелёный заголовок */
-        }
-        .buttons {
-            margin-bottom: 20px;
-        }
-        button, a {
-            background: #22c55e;          /* зелёные кнопки */
-            color: #020617;               /* тёмный текст */
-            border: none;
-            padding: 10px 22px;
-            margin-right: 12px;
-            text-decoration: none;
-            border-radius: 10px;
-            font-weight: bold;
-            cursor: pointer;
-            transition: 0.2s;
-        }
-        button:hover, a:hover {
-            background: #16a34a;          /* тёмно-зелёный hover */
-        }
-    </style>
-</head>
-<body>
-
-    <h1>Intelligent Financial Multi-Agent Dashboard</h1>
-
-    <div class="buttons">
-        <button onclick="location.reload()">Restart Pipeline</button>
-        <a href="/download_md" target="_blank">Download Markdown</a>
-        <a href="/download_pdf" target="_blank">Download PDF</a>
-    </div>
-
-    <pre id="output"></pre>
-
-    <script>
-        const evtSource = new EventSource("/stream");
-        evtSource.onmessage = function(event) {
-            document.getElementById("output").textContent += event.data + "\\n";
-        };
-    </script>
-
-</body>
-</html>
-"""
 
 @app.route("/")
 def index():
-    return render_template_string(HTML)
+    return render_index(TICKERS)
+
+
+def sse_stream(job, last_seq: int = 0):
+    """SSE по логу запуска: id: — номер строки (для Last-Event-ID), токены LLM — event: token."""
+    for item in job.subscribe(last_seq):
+        if item is None:
+            yield ": keep-alive\n\n"
+            continue
+        yield sse_frame(*item)
+    yield f"event: done\ndata: {job.status}\n\n"
+
+
+def send_pdf(md_path: Path):
+    # рендер (или попадание в кэш) — в пуле pdf_renderer; файл отдаётся потоково
+    pdf_path = get_pdf_renderer().render(md_path)
+    return send_file(pdf_path, as_attachment=True, download_name=md_path.with_suffix(".pdf").name,
+                     conditional=True, max_age=0)
+
+
+def _get_job(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        abort(404)
+    return job
+
+
+@app.route("/jobs", methods=["GET"])
+def list_jobs():
+    return jsonify([job.to_dict() for job in jobs.list()])
+
+
+@app.route("/jobs", methods=["POST"])
+def create_job():
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        payload = {}
+    raw = payload.get("tickers") or request.form.get("tickers") or ",".join(TICKERS)
+    tickers = raw.split(",") if isinstance(raw, str) else raw
+    try:
+        job, created = jobs.submit(tickers)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({**job.to_dict(), "created": created}), 201 if created else 200
+
+
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    return jsonify(_get_job(job_id).to_dict())
 
-def run_script():
-    process = subprocess.Popen(
-        ["python", "-m", "Final_Project.main"],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        universal_newlines=True,
-        bufsize=1
-    )
 
-    for line in process.stdout:
-        yield f"data:{line}\n\n"
+@app.route("/jobs/<job_id>", methods=["DELETE"])
+def cancel_job(job_id):
+    _get_job(job_id)
+    return jsonify(jobs.cancel(job_id).to_dict())
+
+
+@app.route("/jobs/<job_id>/stream")
+def job_stream(job_id):
+    job = _get_job(job_id)
+    last_id = request.headers.get("Last-Event-ID") or request.args.get("last_id") or 0
+    try:
+        last_seq = int(last_id)
+    except ValueError:
+        last_seq = 0
+    return Response(sse_stream(job, last_seq), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 
 @app.route("/stream")
 def stream():
-    return Response(run_script(), mimetype="text/event-stream")
+    # совместимость: запуск с тикерами по умолчанию (или присоединение к нему)
+    job, _ = jobs.submit(TICKERS)
+    return Response(sse_stream(job), mimetype="text/event-stream")
+
+
+@app.route("/jobs/<job_id>/download_md")
+def job_download_md(job_id):
+    job = _get_job(job_id)
+    if not job.report_path.exists():
+        abort(404)
+    return send_file(job.report_path, as_attachment=True)
+
+
+@app.route("/jobs/<job_id>/download_pdf")
+def job_download_pdf(job_id):
+    job = _get_job(job_id)
+    if not job.report_path.exists():
+        abort(404)
+    return send_pdf(job.report_path)
+
 
 @app.route("/download_md")
 def download_md():
-    return send_file(REPORT_MD, as_attachment=True)
+    return send_file(jobs.latest_report() or REPORT_MD, as_attachment=True)
+
 
 @app.route("/download_pdf")
 def download_pdf():
-    create_pdf_from_md()
-    return send_file(REPORT_PDF, as_attachment=True)
-
-def create_pdf_from_md():
-    if not REPORT_MD.exists():
-        return
-
-    styles = getSampleStyleSheet()
-    story = []
-
-    with open(REPORT_MD, "r", encoding="utf-8") as f:
-        for line in f:
-            story.append(Paragraph(line.replace("&", "&amp;"), styles["Normal"]))
+    md_path = jobs.latest_report() or REPORT_MD
+    if not md_path.exists():
+        abort(404)
+    return send_pdf(md_path)
+
+
+@app.route("/reports")
+def list_reports():
+    # список и фильтры — из SQLite-индекса, без обхода каталогов
+    try:
+        filters = query_filters(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify([r.to_dict() for r in reports.list(**filters)])
+
+
+@app.route("/reports/diff")
+def diff_reports():
+    old, new = request.args.get("a"), request.args.get("b")
+    diff = reports.diff(old, new) if old and new else None
+    if diff is None:
+        abort(404)
+    return Response(diff, mimetype="text/plain; charset=utf-8")
+
+
+@app.route("/reports/<run_id>")
+def report_md(run_id):
+    text = reports.read(run_id)
+    if text is None:
+        abort(404)
+    return Response(text, mimetype="text/markdown; charset=utf-8",
+                    headers={"Content-Disposition": f"attachment; filename={run_id}.md"})
+
+
+@app.route("/reports/<run_id>/pdf")
+def report_pdf(run_id):
+    text = reports.read(run_id)
+    if text is None:
+        abort(404)
+    pdf_path = get_pdf_renderer().submit_text(text, title=run_id).result()
+    return send_file(pdf_path, as_attachment=True, download_name=f"{run_id}.pdf",
+                     conditional=True, max_age=0)
 
-    pdf = SimpleDocTemplate(str(REPORT_PDF), pagesize=A4)
-    pdf.build(story)
 
 if __name__ == "__main__":
-    app.run(debug=True, port=8000)
\ No newline at end of file
+    # threaded: каждый SSE-зритель держит свой поток;
+    # reloader запустил бы второй пул прогретых воркеров в процессе-наблюдателе
+    app.run(debug=True, port=8000, threaded=True, use_reloader=settings.JOB_EXECUTOR != "worker")
\ No newline at end of file
@@ -0,0 +1,493 @@
+# worker.py
+
+"""
+Прогретые процессы пайплайна для веб-дашборда (JOB_EXECUTOR="worker").
+
+Холодный запуск (`python -m Final_Project.main` на каждый job) каждый раз
+заново импортирует crewai/langchain/pandas/matplotlib, строит агентов,
+грузит модель эмбеддингов и открывает векторное хранилище — секунды до
+первой полезной строки вывода. Здесь:
+
+- воркер — постоянный процесс (`python -m Final_Project.worker --serve`),
+  который при старте один раз проходит WARM_STEPS и держит состояние
+  в синглтонах модулей (get_agents, get_embeddings, get_vector_store,
+  get_retriever);
+- задания приходят по локальной очереди — JSON-строки в stdin, вывод
+  запуска (print пайплайна) уходит JSON-строками в stdout;
+- запуски внутри воркера идут по одному; отмена — cancel asyncio-задачи
+  пайплайна, без потери прогретого состояния (синхронные фазы пайплайна
+  идут в потоках, пул DAG на отмене не ждёт идущие вызовы);
+- WarmWorkerPool в веб-процессе держит N воркеров и раздаёт им job'ы;
+  упавший воркер перезапускается (этот запуск снова холодный).
+
+Отдельный процесс, а не multiprocessing: spawn повторно импортирует
+__main__ веб-сервера (а с ним и JobManager), fork из многопоточного
+сервера небезопасен.
+
+Сравнение холодного и тёплого времени до первого вывода:
+    python -m Final_Project.worker --bench
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import atexit
+import json
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+import traceback
+from contextlib import redirect_stderr, redirect_stdout
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, TextIO, Tuple
+
+from .config import settings
+
+
+# ============================
+# Прогрев
+# ============================
+
+def _warm_libraries() -> None:
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot  # noqa: F401
+    import numpy  # noqa: F401
+    import pandas  # noqa: F401
+    import yfinance  # noqa: F401
+    import langchain_core.documents  # noqa: F401
+    import langchain_core.prompts  # noqa: F401
+
+
+def _warm_pipeline() -> None:
+    from . import main  # noqa: F401  (crewai, crew_setup, rag_kg, chains, ...)
+
+
+def _warm_agents() -> None:
+    from .agents import get_agents
+    get_agents()
+
+
+def _warm_embeddings() -> None:
+    from .embeddings import get_embeddings
+    get_embeddings().model  # загрузка модели — самое долгое
+
+
+def _warm_vector_store() -> None:
+    from .rag_kg import get_vector_store
+    from .retrieval import get_retriever
+    get_retriever(get_vector_store())
+
+
+WARM_STEPS: List[Tuple[str, Callable[[], None]]] = [
+    ("libraries", _warm_libraries),
+    ("pipeline", _warm_pipeline),
+    ("agents", _warm_agents),
+    ("embeddings", _warm_embeddings),
+    ("vector_store", _warm_vector_store),
+]
+
+
+def warm_up() -> Dict[str, dict]:
+    """
+    Проходит WARM_STEPS по порядку. Упавший шаг не останавливает прогрев:
+    запуск, которому он нужен, упадёт сам — так же, как в холодном режиме.
+    """
+    steps: Dict[str, dict] = {}
+    for name, step in WARM_STEPS:
+        started = time.perf_counter()
+        try:
+            step()
+            error = None
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        steps[name] = {"seconds": round(time.perf_counter() - started, 3), "error": error}
+    return steps
+
+
+def format_warmup(steps: Dict[str, dict]) -> str:
+    return ", ".join(
+        f"{name} {s['seconds']:.2f}s" if not s["error"] else f"{name} ✗ ({s['error']})"
+        for name, s in steps.items()
+    )
+
+
+# ============================
+# Процесс воркера
+# ============================
+
+class _Channel:
+    """JSON-строки в исходный stdout процесса (общий для потоков)."""
+
+    def __init__(self, stream: TextIO) -> None:
+        self._stream = stream
+        self._lock = threading.Lock()
+
+    def send(self, message: dict) -> None:
+        data = json.dumps(message, ensure_ascii=False)
+        with self._lock:
+            self._stream.write(data + "\n")
+            self._stream.flush()
+
+
+class _LineWriter:
+    """Подменяет sys.stdout/stderr: каждая строка — сообщение {"job", "line"}."""
+
+    def __init__(self, channel: _Channel, job_id: Optional[str]) -> None:
+        self.channel = channel
+        self.job_id = job_id
+        self._buffer = ""
+        self._lock = threading.Lock()
+
+    def write(self, text: str) -> int:
+        with self._lock:
+            self._buffer += text
+            *lines, self._buffer = self._buffer.split("\n")
+        for line in lines:
+            self.channel.send({"job": self.job_id, "line": line})
+        return len(text)
+
+    def flush(self) -> None:
+        with self._lock:
+            rest, self._buffer = self._buffer, ""
+        if rest:
+            self.channel.send({"job": self.job_id, "line": rest})
+
+    def isatty(self) -> bool:
+        return False
+
+
+async def _probe() -> None:
+    # для бенчмарка: «первая строка» без работы пайплайна
+    print("📡 probe")
+
+
+def _job_coroutine(message: dict):
+    if message.get("probe"):
+        return _probe()
+    from .main import run_pipeline
+    return run_pipeline(list(message["tickers"]), message.get("output_dir"), run_id=message["run"])
+
+
+def serve() -> None:
+    """Цикл воркера: прогрев, затем задания из stdin по одному."""
+    channel = _Channel(sys.stdout)
+    # всё, что печатается вне запусков (прогрев, фоновые потоки), — с job=None
+    sys.stdout = sys.stderr = _LineWriter(channel, None)
+
+    started = time.perf_counter()
+    steps = warm_up()
+    channel.send({"ready": {
+        "pid": os.getpid(),
+        "seconds": round(time.perf_counter() - started, 3),
+        "steps": steps,
+    }})
+
+    tasks: "queue.Queue[Optional[dict]]" = queue.Queue()
+    current: Dict[str, tuple] = {}  # job_id -> (loop, task) идущего запуска
+    cancelled = set()
+
+    def listen() -> None:
+        # stdin читается отдельно, чтобы cancel доходил во время запуска
+        for raw in sys.stdin:
+            try:
+                message = json.loads(raw)
+            except ValueError:
+                continue
+            job_id = message.get("cancel")
+            if job_id is None:
+                tasks.put(message)
+                continue
+            cancelled.add(job_id)
+            if job_id in current:
+                loop, task = current[job_id]
+                loop.call_soon_threadsafe(task.cancel)
+        tasks.put(None)  # родитель закрыл stdin — выходим
+
+    threading.Thread(target=listen, name="worker-stdin", daemon=True).start()
+
+    while True:
+        message = tasks.get()
+        if message is None:
+            return
+        job_id = message["run"]
+        writer = _LineWriter(channel, job_id)
+        code = 0
+        with redirect_stdout(writer), redirect_stderr(writer):
+            loop = asyncio.new_event_loop()
+            try:
+                task = loop.create_task(_job_coroutine(message))
+                current[job_id] = (loop, task)
+                if job_id in cancelled:
+                    task.cancel()  # cancel пришёл раньше, чем запуск начался
+                loop.run_until_complete(task)
+            except asyncio.CancelledError:
+                code = -15
+            except SystemExit as e:
+                # run_pipeline сообщает о неудаче кодом выхода, как и в subprocess-режиме
+                code = e.code if isinstance(e.code, int) else 1
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            finally:
+                current.pop(job_id, None)
+                cancelled.discard(job_id)
+                loop.run_until_complete(loop.shutdown_asyncgens())
+                loop.close()
+                writer.flush()
+        channel.send({"job": job_id, "exit": code})
+
+
+# ============================
+# Пул воркеров (в веб-процессе)
+# ============================
+
+class WarmWorker:
+    def __init__(self, index: int) -> None:
+        self.index = index
+        self.process: Optional[subprocess.Popen] = None
+        self.ready = threading.Event()
+        self.warmup: Optional[dict] = None
+        self.starts = 0
+        self._events: "queue.Queue[dict]" = queue.Queue()
+        self._send_lock = threading.Lock()
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def start(self) -> None:
+        self.ready.clear()
+        self.warmup = None
+        self._events = queue.Queue()
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", f"{__package__}.worker", "--serve"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+            encoding="utf-8",
+            bufsize=1,
+            env={"TOKEN_EVENTS": "1", **os.environ, "PYTHONUNBUFFERED": "1"},
+            cwd=str(Path(__file__).resolve().parent.parent),
+        )
+        self.starts += 1
+        threading.Thread(
+            target=self._read, args=(self.process, self._events),
+            name=f"warm-worker-{self.index}", daemon=True,
+        ).start()
+
+    def _read(self, process: subprocess.Popen, events: "queue.Queue[dict]") -> None:
+        for raw in process.stdout:
+            try:
+                message = json.loads(raw)
+            except ValueError:
+                # кто-то написал прямо в fd 1 мимо sys.stdout
+                message = {"job": None, "line": raw.rstrip("\n")}
+            if "ready" in message:
+                self.warmup = message["ready"]
+                print(f"🔥 warm worker {self.index} (pid {self.warmup['pid']}) ready in "
+                      f"{self.warmup['seconds']:.2f}s: {format_warmup(self.warmup['steps'])}")
+                self.ready.set()
+            elif message.get("job") is None:
+                print(f"[worker {self.index}] {message.get('line', '')}")
+            else:
+                events.put(message)
+
+    def send(self, message: dict) -> None:
+        with self._send_lock:
+            self.process.stdin.write(json.dumps(message) + "\n")
+            self.process.stdin.flush()
+
+    def run(self, message: dict, on_line: Callable[[str], None]) -> int:
+        """Отправляет задание и пересылает его вывод в on_line; возвращает код."""
+        job_id = message["run"]
+        self.send(message)
+        while True:
+            try:
+                event = self._events.get(timeout=1.0)
+            except queue.Empty:
+                if not self.alive:
+                    on_line(f"❌ warm worker {self.index} exited with code {self.process.returncode}")
+                    return self.process.returncode or -1
+                continue
+            if event.get("job") != job_id:
+                continue  # хвост прошлого (отменённого) запуска
+            if "exit" in event:
+                return event["exit"]
+            on_line(event["line"])
+
+    def close(self, timeout: float = 5.0) -> None:
+        if not self.alive:
+            return
+        try:
+            self.process.stdin.close()  # воркер доделает текущий запуск и выйдет
+            self.process.wait(timeout=timeout)
+        except (OSError, subprocess.TimeoutExpired):
+            self.process.terminate()
+
+
+class WarmWorkerPool:
+    """
+    N прогретых воркеров. run() блокируется, пока не освободится воркер,
+    так что число одновременных запусков ограничено размером пула.
+    """
+
+    def __init__(self, size: Optional[int] = None) -> None:
+        self.size = size or settings.WORKER_PROCESSES or settings.JOB_MAX_WORKERS
+        self._workers = [WarmWorker(i) for i in range(self.size)]
+        self._idle: "queue.Queue[WarmWorker]" = queue.Queue()
+        self._busy: Dict[str, WarmWorker] = {}
+        self._lock = threading.Lock()
+        for worker in self._workers:
+            worker.start()  # прогрев идёт параллельно со стартом веб-сервера
+            self._idle.put(worker)
+        atexit.register(self.close)
+
+    def run(
+        self,
+        job_id: str,
+        tickers: Sequence[str],
+        output_dir: Optional[Path],
+        on_line: Callable[[str], None],
+        cancelled: Optional[Callable[[], bool]] = None,
+        probe: bool = False,
+    ) -> int:
+        worker = self._idle.get()
+        try:
+            if not worker.alive:
+                on_line(f"♻️ restarting warm worker {worker.index} (cold start)")
+                worker.start()
+            if not worker.ready.is_set():
+                on_line(f"⏳ warm worker {worker.index} is still warming up")
+            with self._lock:
+                self._busy[job_id] = worker
+                if cancelled is not None and cancelled():
+                    worker.send({"cancel": job_id})
+            message = {
+                "run": job_id,
+                "tickers": list(tickers),
+                "output_dir": str(output_dir) if output_dir else None,
+                "probe": probe,
+            }
+            return worker.run(message, on_line)
+        finally:
+            with self._lock:
+                self._busy.pop(job_id, None)
+            self._idle.put(worker)
+
+    def cancel(self, job_id: str) -> bool:
+        with self._lock:
+            worker = self._busy.get(job_id)
+            if worker is None or not worker.alive:
+                return False
+            worker.send({"cancel": job_id})
+            return True
+
+    def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        deadline = None if timeout is None else time.time() + timeout
+        for worker in self._workers:
+            left = None if deadline is None else max(deadline - time.time(), 0)
+            if not worker.ready.wait(left):
+                return False
+        return True
+
+    def close(self) -> None:
+        for worker in self._workers:
+            worker.close()
+
+
+# ============================
+# Бенчмарк: время до первого вывода
+# ============================
+
+def _probe_cold() -> None:
+    """
+    Холодный процесс как `python -m Final_Project.main`: первая строка
+    пайплайна печатается сразу после импорта main. Остальной прогрев
+    (агенты, эмбеддинги, хранилище) холодный запуск оплачивает позже,
+    по ходу работы, — он меряется после первой строки, только для отчёта.
+    """
+    started = time.perf_counter()
+    try:
+        _warm_pipeline()
+        error = None
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    imported = {"seconds": round(time.perf_counter() - started, 3), "error": error}
+    print("📡 probe", flush=True)
+    print(json.dumps({"import": imported, "later": warm_up()}), flush=True)
+
+
+def _cold_first_output() -> Tuple[float, Dict[str, Dict[str, dict]]]:
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", f"{__package__}.worker", "--probe"],
+        stdout=subprocess.PIPE,
+        text=True,
+        encoding="utf-8",
+        env={**os.environ, "PYTHONUNBUFFERED": "1"},
+        cwd=str(Path(__file__).resolve().parent.parent),
+    )
+    first = None
+    lines = []
+    for line in process.stdout:
+        if first is None and line.startswith("📡"):
+            first = time.perf_counter() - started
+        lines.append(line)
+    process.wait()
+    return first, json.loads(lines[-1])
+
+
+def _benchmark(runs: int = 3) -> None:
+    import numpy as np
+
+    cold = []
+    probe: Dict[str, Dict[str, dict]] = {}
+    for _ in range(runs):
+        seconds, probe = _cold_first_output()
+        cold.append(seconds)
+    print(f"🧊 cold (new process per job): first output after "
+          f"{np.median(cold) * 1000:.0f} ms median of {runs}")
+    print(f"   before it: {format_warmup({'pipeline import': probe['import']})}")
+    print(f"   paid later in each cold run: {format_warmup(probe['later'])}")
+
+    pool = WarmWorkerPool(size=1)
+    started = time.perf_counter()
+    pool.wait_ready()
+    print(f"🔥 pool warm-up (once per server start): {time.perf_counter() - started:.2f}s")
+
+    warm = []
+    for i in range(runs):
+        first: List[float] = []
+        started = time.perf_counter()
+
+        def on_line(line: str) -> None:
+            if not first:
+                first.append(time.perf_counter() - started)
+
+        pool.run(f"bench{i}", [], None, on_line, probe=True)
+        warm.append(first[0])
+    pool.close()
+    print(f"♨️ warm (queued to a ready worker): first output after "
+          f"{np.median(warm) * 1000:.1f} ms median of {runs}")
+    print(f"   speed-up {np.median(cold) / np.median(warm):.0f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Warm pipeline worker")
+    parser.add_argument("--serve", action="store_true", help="run as a pool worker (JSON lines on stdin/stdout)")
+    parser.add_argument("--probe", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--bench", action="store_true", help="compare cold vs warm time-to-first-output")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve()
+    elif args.probe:
+        _probe_cold()
+    else:
+        _benchmark(args.runs)